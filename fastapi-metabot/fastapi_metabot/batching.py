@@ -0,0 +1,94 @@
+import asyncio
+import json
+from typing import List, Tuple, Optional, Dict, Set
+
+from httpx import Headers
+
+from fastapi_metabot.client import ApiClient, AsyncApis
+from fastapi_metabot.client.exceptions import UnexpectedResponse
+from fastapi_metabot.client.models import (
+    SlackRequest,
+    SlackBatchRequest,
+    SlackBatchResult,
+)
+
+
+class SlackBatcher:
+    client: ApiClient
+    delay: float
+    max_size: int
+
+    # (request, future of its response data)
+    _pending: List[Tuple[SlackRequest, 'asyncio.Future[Dict]']]
+    _timer: Optional[asyncio.TimerHandle]
+    _tasks: Set[asyncio.Task]
+
+    def __init__(self, client: ApiClient, delay: float, max_size: int) -> None:
+        self.client = client
+        self.delay = delay
+        self.max_size = max_size
+
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def request(self, req: SlackRequest) -> Dict:
+        # Requests made within the delay of the first one are sent together
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append((req, future))
+        if len(self._pending) >= self.max_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(
+                self.delay,
+                self.flush,
+            )
+        return await future
+
+    def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, []
+        task = asyncio.create_task(self._send(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(
+            self,
+            pending: List[Tuple[SlackRequest, 'asyncio.Future[Dict]']],
+    ) -> None:
+        api = AsyncApis(self.client).metabot_api
+        try:
+            resp = await api.batch_api_slack_batch_post(
+                SlackBatchRequest(requests=[req for req, _ in pending])
+            )
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(pending, resp.results):
+            # Callers which were cancelled in the meantime are skipped
+            if future.done():
+                continue
+            # Older metabot versions report Slack API errors with a 200
+            if result.error is None and result.status_code == 200:
+                future.set_result(result.data or {})
+            else:
+                future.set_exception(self._error(result))
+
+    @staticmethod
+    def _error(result: SlackBatchResult) -> UnexpectedResponse:
+        # Failed requests raise the same exception as they would
+        # when sent on their own
+        return UnexpectedResponse(
+            status_code=result.status_code,
+            reason_phrase='',
+            content=json.dumps({'detail': result.error}).encode('utf-8'),
+            headers=Headers(),
+        )
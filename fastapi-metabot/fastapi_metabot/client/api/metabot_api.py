@@ -1,5 +1,4 @@
-from asyncio import get_event_loop
-from typing import TYPE_CHECKING, Awaitable
+from typing import TYPE_CHECKING, Any, Dict
 
 from fastapi.encoders import jsonable_encoder
 
@@ -13,54 +12,106 @@ class _MetabotApi:
     def __init__(self, api_client: "ApiClient"):
         self.api_client = api_client
 
-    def _build_for_get_module_by_name_api_modules_module_name_get(self, module_name: str) -> Awaitable[m.Module]:
+    def _build_for_batch_api_slack_batch_post(self, slack_batch_request: m.SlackBatchRequest) -> Dict[str, Any]:
+        body = jsonable_encoder(slack_batch_request)
+
+        return dict(type_=m.SlackBatchResponse, method="POST", url="/api/slack/batch", json=body)
+
+    def _build_for_get_module_by_name_api_modules_module_name_get(self, module_name: str) -> Dict[str, Any]:
+        path_params = {"module_name": str(module_name)}
+
+        return dict(type_=m.Module, method="GET", url="/api/modules/{module_name}", path_params=path_params,)
+
+    def _build_for_get_modules_api_modules_get(self,) -> Dict[str, Any]:
+        return dict(type_=m.GetModulesResponse, method="GET", url="/api/modules/",)
+
+    def _build_for_refresh_module_api_modules_module_name_heartbeat_post(
+        self, module_name: str, module_heartbeat: m.ModuleHeartbeat
+    ) -> Dict[str, Any]:
         path_params = {"module_name": str(module_name)}
 
-        return self.api_client.request(
-            type_=m.Module, method="GET", url="/api/modules/{module_name}", path_params=path_params,
+        body = jsonable_encoder(module_heartbeat)
+
+        return dict(
+            type_=m.ModuleHeartbeat,
+            method="POST",
+            url="/api/modules/{module_name}/heartbeat",
+            path_params=path_params,
+            json=body,
         )
 
-    def _build_for_get_modules_api_modules_get(self,) -> Awaitable[m.GetModulesResponse]:
-        return self.api_client.request(type_=m.GetModulesResponse, method="GET", url="/api/modules/",)
+    def _build_for_register_module_api_modules_post(
+        self, module: m.Module, manifest_hash: str = None
+    ) -> Dict[str, Any]:
+        query_params = {}
+        if manifest_hash is not None:
+            query_params["manifest_hash"] = str(manifest_hash)
 
-    def _build_for_register_module_api_modules_post(self, module: m.Module) -> Awaitable[m.Module]:
         body = jsonable_encoder(module)
 
-        return self.api_client.request(type_=m.Module, method="POST", url="/api/modules/", json=body)
+        return dict(type_=m.Module, method="POST", url="/api/modules/", params=query_params, json=body)
 
-    def _build_for_request_api_slack_post(self, slack_request: m.SlackRequest) -> Awaitable[m.SlackResponse]:
+    def _build_for_request_api_slack_post(self, slack_request: m.SlackRequest) -> Dict[str, Any]:
         body = jsonable_encoder(slack_request)
 
-        return self.api_client.request(type_=m.SlackResponse, method="POST", url="/api/slack/", json=body)
+        return dict(type_=m.SlackResponse, method="POST", url="/api/slack/", json=body)
 
 
 class AsyncMetabotApi(_MetabotApi):
+    async def batch_api_slack_batch_post(self, slack_batch_request: m.SlackBatchRequest) -> m.SlackBatchResponse:
+        kwargs = self._build_for_batch_api_slack_batch_post(slack_batch_request=slack_batch_request)
+        return await self.api_client.request(**kwargs)
+
     async def get_module_by_name_api_modules_module_name_get(self, module_name: str) -> m.Module:
-        return await self._build_for_get_module_by_name_api_modules_module_name_get(module_name=module_name)
+        kwargs = self._build_for_get_module_by_name_api_modules_module_name_get(module_name=module_name)
+        return await self.api_client.request(**kwargs)
 
     async def get_modules_api_modules_get(self,) -> m.GetModulesResponse:
-        return await self._build_for_get_modules_api_modules_get()
+        kwargs = self._build_for_get_modules_api_modules_get()
+        return await self.api_client.request(**kwargs)
+
+    async def refresh_module_api_modules_module_name_heartbeat_post(
+        self, module_name: str, module_heartbeat: m.ModuleHeartbeat
+    ) -> m.ModuleHeartbeat:
+        kwargs = self._build_for_refresh_module_api_modules_module_name_heartbeat_post(
+            module_name=module_name, module_heartbeat=module_heartbeat
+        )
+        return await self.api_client.request(**kwargs)
 
-    async def register_module_api_modules_post(self, module: m.Module) -> m.Module:
-        return await self._build_for_register_module_api_modules_post(module=module)
+    async def register_module_api_modules_post(self, module: m.Module, manifest_hash: str = None) -> m.Module:
+        kwargs = self._build_for_register_module_api_modules_post(module=module, manifest_hash=manifest_hash)
+        return await self.api_client.request(**kwargs)
 
     async def request_api_slack_post(self, slack_request: m.SlackRequest) -> m.SlackResponse:
-        return await self._build_for_request_api_slack_post(slack_request=slack_request)
+        kwargs = self._build_for_request_api_slack_post(slack_request=slack_request)
+        return await self.api_client.request(**kwargs)
 
 
 class SyncMetabotApi(_MetabotApi):
+    def batch_api_slack_batch_post(self, slack_batch_request: m.SlackBatchRequest) -> m.SlackBatchResponse:
+        kwargs = self._build_for_batch_api_slack_batch_post(slack_batch_request=slack_batch_request)
+        return self.api_client.request_sync(**kwargs)
+
     def get_module_by_name_api_modules_module_name_get(self, module_name: str) -> m.Module:
-        coroutine = self._build_for_get_module_by_name_api_modules_module_name_get(module_name=module_name)
-        return get_event_loop().run_until_complete(coroutine)
+        kwargs = self._build_for_get_module_by_name_api_modules_module_name_get(module_name=module_name)
+        return self.api_client.request_sync(**kwargs)
 
     def get_modules_api_modules_get(self,) -> m.GetModulesResponse:
-        coroutine = self._build_for_get_modules_api_modules_get()
-        return get_event_loop().run_until_complete(coroutine)
+        kwargs = self._build_for_get_modules_api_modules_get()
+        return self.api_client.request_sync(**kwargs)
+
+    def refresh_module_api_modules_module_name_heartbeat_post(
+        self, module_name: str, module_heartbeat: m.ModuleHeartbeat
+    ) -> m.ModuleHeartbeat:
+        kwargs = self._build_for_refresh_module_api_modules_module_name_heartbeat_post(
+            module_name=module_name, module_heartbeat=module_heartbeat
+        )
+        return self.api_client.request_sync(**kwargs)
 
-    def register_module_api_modules_post(self, module: m.Module) -> m.Module:
-        coroutine = self._build_for_register_module_api_modules_post(module=module)
-        return get_event_loop().run_until_complete(coroutine)
+    def register_module_api_modules_post(self, module: m.Module, manifest_hash: str = None) -> m.Module:
+        kwargs = self._build_for_register_module_api_modules_post(module=module, manifest_hash=manifest_hash)
+        return self.api_client.request_sync(**kwargs)
 
     def request_api_slack_post(self, slack_request: m.SlackRequest) -> m.SlackResponse:
-        coroutine = self._build_for_request_api_slack_post(slack_request=slack_request)
-        return get_event_loop().run_until_complete(coroutine)
+        kwargs = self._build_for_request_api_slack_post(slack_request=slack_request)
+        return self.api_client.request_sync(**kwargs)
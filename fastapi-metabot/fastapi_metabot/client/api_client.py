@@ -1,8 +1,7 @@
-from asyncio import get_event_loop
 from functools import lru_cache
-from typing import Any, Awaitable, Callable, Dict, Generic, Type, TypeVar, overload
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Generic, Optional, Type, TypeVar, overload
 
-from httpx import AsyncClient, Request, Response
+from httpx import AsyncClient, Client, PoolLimits, Request, Response, Timeout
 from pydantic import ValidationError
 
 from fastapi_metabot.client.api.metabot_api import AsyncMetabotApi, SyncMetabotApi
@@ -31,10 +30,55 @@ MiddlewareT = Callable[[Request, Send], Awaitable[Response]]
 
 
 class ApiClient:
-    def __init__(self, host: str = None, **kwargs: Any) -> None:
+    def __init__(
+        self,
+        host: str = None,
+        *,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 10,
+        timeout: Optional[float] = 5.0,
+        connect_timeout: Optional[float] = None,
+        http2: bool = False,
+        **kwargs: Any,
+    ) -> None:
         self.host = host
         self.middleware: MiddlewareT = BaseMiddleware()
-        self._async_client = AsyncClient(**kwargs)
+        self.http2 = http2
+        self._client_kwargs = {
+            "pool_limits": PoolLimits(soft_limit=max_keepalive_connections, hard_limit=max_connections),
+            "timeout": Timeout(timeout, connect_timeout=connect_timeout if connect_timeout is not None else timeout),
+            **kwargs,
+        }
+        self._async_client: Optional[AsyncClient] = None
+        self._sync_client: Optional[Client] = None
+
+    @property
+    def async_client(self) -> AsyncClient:
+        """
+        Clients are created on first use or on startup of the app, and closed on its shutdown
+        """
+        if self._async_client is None:
+            self._async_client = AsyncClient(http2=self.http2, **self._client_kwargs)
+        return self._async_client
+
+    @property
+    def sync_client(self) -> Client:
+        # Blocking requests get their own pool, without HTTP/2
+        if self._sync_client is None:
+            self._sync_client = Client(**self._client_kwargs)
+        return self._sync_client
+
+    def open(self) -> None:
+        self.async_client
+        self.sync_client
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
 
     @overload
     async def request(
@@ -58,21 +102,40 @@ class ApiClient:
         return await self.send(request, type_)
 
     @overload
-    def request_sync(self, *, type_: Type[T], **kwargs: Any) -> T:
+    def request_sync(
+        self, *, type_: Type[T], method: str, url: str, path_params: Dict[str, Any] = None, **kwargs: Any
+    ) -> T:
         ...
 
     @overload  # noqa F811
-    def request_sync(self, *, type_: None, **kwargs: Any) -> None:
+    def request_sync(
+        self, *, type_: None, method: str, url: str, path_params: Dict[str, Any] = None, **kwargs: Any
+    ) -> None:
         ...
 
-    def request_sync(self, *, type_: Any, **kwargs: Any) -> Any:  # noqa F811
+    def request_sync(  # noqa F811
+        self, *, type_: Any, method: str, url: str, path_params: Dict[str, Any] = None, **kwargs: Any
+    ) -> Any:
         """
-        This method is not used by the generated apis, but is included for convenience
+        Used by the sync apis, it blocks on a pooled sync client instead of an event loop,
+        so it works from threads and running loops alike, but skips the middleware
         """
-        return get_event_loop().run_until_complete(self.request(type_=type_, **kwargs))
+        if path_params is None:
+            path_params = {}
+        url = (self.host or "") + url.format(**path_params)
+        request = Request(method, url, **kwargs)
+        try:
+            response = self.sync_client.send(request)
+        except Exception as e:
+            raise ResponseHandlingException(e)
+        return self._parse_response(response, type_)
 
     async def send(self, request: Request, type_: Type[T]) -> T:
         response = await self.middleware(request, self.send_inner)
+        return self._parse_response(response, type_)
+
+    @staticmethod
+    def _parse_response(response: Response, type_: Type[T]) -> T:
         if response.status_code in [200, 201]:
             try:
                 return parse_as_type(response.json(), type_)
@@ -82,7 +145,31 @@ class ApiClient:
 
     async def send_inner(self, request: Request) -> Response:
         try:
-            response = await self._async_client.send(request)
+            response = await self.async_client.send(request)
+        except Exception as e:
+            raise ResponseHandlingException(e)
+        return response
+
+    async def stream_lines(self, *, method: str, url: str, **kwargs: Any) -> AsyncGenerator[str, None]:
+        """
+        This method is not used by the generated apis, it yields the lines of a streaming response
+        and closes the connection as soon as the iteration stops
+        """
+        request = Request(method, (self.host or "") + url, **kwargs)
+        response = await self.middleware(request, self.send_inner_stream)
+        try:
+            if response.status_code not in [200, 201]:
+                await response.aread()
+                raise UnexpectedResponse.for_response(response)
+            async for line in response.aiter_lines():
+                if line.strip():
+                    yield line
+        finally:
+            await response.aclose()
+
+    async def send_inner_stream(self, request: Request) -> Response:
+        try:
+            response = await self.async_client.send(request, stream=True)
         except Exception as e:
             raise ResponseHandlingException(e)
         return response
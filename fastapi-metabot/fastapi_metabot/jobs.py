@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from contextvars import Context, copy_context
+from dataclasses import dataclass, field
+from itertools import count
+from time import monotonic
+from typing import Callable, Awaitable, Tuple, Optional, List, Iterator, Any
+
+from fastapi_metabot.models import JobStats
+
+log = logging.getLogger(__name__)
+
+# Lower goes first: view submissions must be answered quickly,
+# while commands may take their time
+VIEW_PRIORITY = 0
+ACTION_PRIORITY = 1
+COMMAND_PRIORITY = 2
+
+
+@dataclass(order=True)
+class Job:
+    priority: int
+    sequence: int
+    function: Callable[..., Awaitable] = field(compare=False)
+    args: Tuple = field(compare=False)
+    timeout: Optional[float] = field(compare=False)
+    context: Context = field(compare=False)
+    enqueued_at: float = field(compare=False)
+
+
+class JobRunner:
+    max_concurrency: int
+    max_queued: int
+    drain_timeout: float
+    stats: JobStats
+
+    _queue: Optional['asyncio.PriorityQueue[Job]']
+    _workers: List[asyncio.Task]
+    _sequence: Iterator[int]
+
+    def __init__(
+            self,
+            max_concurrency: int,
+            max_queued: int,
+            drain_timeout: float = 10,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self.drain_timeout = drain_timeout
+        self.stats = JobStats()
+
+        self._queue = None
+        self._workers = []
+        self._sequence = count()
+
+    def get_stats(self) -> JobStats:
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return self.stats.copy(update={'queued': queued})
+
+    def submit(
+            self,
+            priority: int,
+            function: Callable[..., Awaitable],
+            *args: Any,
+            timeout: Optional[float] = None,
+    ) -> None:
+        assert self._queue is not None, 'Job runner must be started first'
+
+        # Jobs run in the context they were submitted from,
+        # e.g. with the metadata of their request.
+        # Raises asyncio.QueueFull once max_queued jobs are waiting.
+        self._queue.put_nowait(Job(
+            priority=priority,
+            sequence=next(self._sequence),
+            function=function,
+            args=args,
+            timeout=timeout,
+            context=copy_context(),
+            enqueued_at=monotonic(),
+        ))
+
+    async def start(self) -> None:
+        # The queue must be created within the running event loop
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_queued)
+        self._workers = [
+            asyncio.create_task(self._work())
+            for _ in range(self.max_concurrency)
+        ]
+
+    async def stop(self) -> None:
+        # Queued jobs get a chance to finish, those which are still left
+        # after the drain timeout are dropped
+        if self._queue is not None and self._workers:
+            try:
+                await asyncio.wait_for(self._queue.join(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+            if discarded := self._queue.qsize():
+                self.stats.discarded += discarded
+                log.warning(f'Discarded {discarded} queued jobs on shutdown')
+            if running := self.stats.running:
+                log.warning(f'Cancelled {running} running jobs on shutdown')
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    async def _work(self) -> None:
+        assert self._queue is not None
+        while True:
+            job = await self._queue.get()
+            started_at = monotonic()
+            self.stats.wait_seconds += started_at - job.enqueued_at
+            self.stats.running += 1
+            try:
+                await self._run(job)
+            finally:
+                self.stats.running -= 1
+                self.stats.run_seconds += monotonic() - started_at
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        # Tasks copy the context they are created in
+        task = job.context.run(
+            lambda: asyncio.ensure_future(job.function(*job.args))
+        )
+        try:
+            # Handlers in threads or processes can't be interrupted,
+            # only the wait for them is cancelled
+            await asyncio.wait_for(task, job.timeout)
+        except asyncio.TimeoutError:
+            self.stats.timed_out += 1
+            log.error(
+                f'Job {job.function.__name__}{job.args} '
+                f'timed out after {job.timeout} seconds'
+            )
+        except Exception:
+            self.stats.failed += 1
+            log.exception(f'Job {job.function.__name__}{job.args} failed')
+        else:
+            self.stats.completed += 1
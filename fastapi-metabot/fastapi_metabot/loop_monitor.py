@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import sys
+import threading
+from collections import deque
+from datetime import datetime
+from time import monotonic
+from traceback import extract_stack
+from types import FrameType
+from typing import Deque, Optional, List, Callable
+
+from fastapi_metabot.models import LoopStats, SlowCallback, LoopReport
+
+log = logging.getLogger(__name__)
+
+
+def format_stack(frame: FrameType) -> List[str]:
+    return [
+        f'{summary.filename}:{summary.lineno} {summary.name}'
+        for summary in extract_stack(frame)
+    ]
+
+
+# The sampler wakes up every interval and measures how late it is,
+# i.e. the lag every callback scheduled at that moment would see.
+# A watchdog thread notices when the loop hasn't woken the sampler for
+# longer than the threshold and snapshots the stack of the loop thread,
+# which is the stack of the callback blocking it.
+class LoopMonitor:
+    interval: float
+    threshold: float
+    stats: LoopStats
+    # Called with every measured lag, e.g. to feed a histogram
+    on_lag: Optional[Callable[[float], None]]
+
+    _records: Deque[SlowCallback]
+    _blocked: Optional[SlowCallback]
+    _beat: float
+    _loop_thread_id: int
+    _task: Optional[asyncio.Task]
+    _watchdog: Optional[threading.Thread]
+    _stopped: threading.Event
+
+    def __init__(
+            self,
+            interval: float = 0.1,
+            threshold: float = 0.1,
+            max_records: int = 100,
+            on_lag: Optional[Callable[[float], None]] = None,
+    ) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.stats = LoopStats()
+        self.on_lag = on_lag
+
+        self._records = deque(maxlen=max_records)
+        self._blocked = None
+        self._beat = monotonic()
+        self._loop_thread_id = threading.get_ident()
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def get_report(self) -> LoopReport:
+        return LoopReport(
+            stats=self.stats.copy(),
+            slow_callbacks=[x.copy() for x in reversed(self._records)],
+        )
+
+    async def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._beat = monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._sample())
+        self._watchdog = threading.Thread(
+            target=self._watch,
+            name='loop-monitor',
+            daemon=True,
+        )
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def _sample(self) -> None:
+        while True:
+            expected_at = monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self._beat = now = monotonic()
+            self._record_lag(max(now - expected_at, 0))
+
+    def _record_lag(self, lag: float) -> None:
+        self.stats.samples += 1
+        self.stats.lag_seconds = lag
+        self.stats.max_lag_seconds = max(self.stats.max_lag_seconds, lag)
+        self.stats.total_lag_seconds += lag
+        if self.on_lag is not None:
+            self.on_lag(lag)
+
+        if (blocked := self._blocked) is not None:
+            self._blocked = None
+            blocked.blocked_seconds = lag
+            log.warning(
+                f'Event loop was blocked for {lag:.3f} seconds at '
+                f'{blocked.stack[-1] if blocked.stack else "unknown"}'
+            )
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            blocked_for = monotonic() - beat - self.interval
+            if blocked_for < self.threshold or self._blocked is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)  # noqa
+            # The loop may have caught up in the meantime
+            if frame is None or self._beat != beat:
+                continue
+
+            record = SlowCallback(
+                detected_at=datetime.utcnow(),
+                stack=format_stack(frame),
+            )
+            self._blocked = record
+            self._records.append(record)
+            self.stats.slow_callbacks += 1
@@ -1,6 +1,7 @@
+from datetime import datetime
 from typing import Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class CommandMetadata(BaseModel):
@@ -17,6 +18,9 @@ class CommandMetadata(BaseModel):
 class CommandPayload(BaseModel):
     arguments: Dict[str, str]
     metadata: CommandMetadata
+    # W3C trace context of metabot's dispatch, which may be
+    # lost from the headers on the way through proxies
+    traceparent: Optional[str] = None
 
 
 class ActionMetadata(BaseModel):
@@ -39,3 +43,59 @@ class ActionMetadata(BaseModel):
 
 class ActionPayload(BaseModel):
     metadata: ActionMetadata
+    traceparent: Optional[str] = None
+
+
+class JobStats(BaseModel):
+    queued: int = 0
+    running: int = 0
+    completed: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    # Jobs which were still queued after the drain timeout on shutdown
+    discarded: int = 0
+    # Total seconds jobs have spent waiting in the queue and running
+    wait_seconds: float = 0
+    run_seconds: float = 0
+
+
+class SlowCallback(BaseModel):
+    detected_at: datetime
+    # How long the loop was blocked, 0 while it still is
+    blocked_seconds: float = 0
+    # Innermost frame last
+    stack: List[str]
+
+
+class LoopStats(BaseModel):
+    samples: int = 0
+    lag_seconds: float = 0
+    max_lag_seconds: float = 0
+    total_lag_seconds: float = 0
+    slow_callbacks: int = 0
+
+
+class LoopReport(BaseModel):
+    stats: LoopStats
+    slow_callbacks: List[SlowCallback]
+
+
+class ProfileRequest(BaseModel):
+    # Requests only have to match the filters which are set
+    module: Optional[str] = None
+    command: Optional[str] = None
+    action: Optional[str] = None
+    requests: int = Field(1, gt=0)
+    interval: float = Field(0.005, gt=0)
+
+
+class ProfileStatus(BaseModel):
+    module: Optional[str]
+    command: Optional[str]
+    action: Optional[str]
+    requests: int
+    started_at: datetime
+    profiled: int = 0
+    active: int = 0
+    samples: int = 0
+    done: bool = False
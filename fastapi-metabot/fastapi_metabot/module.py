@@ -1,25 +1,49 @@
 import asyncio
+import json
 import logging
 from asyncio import iscoroutinefunction, Task
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from dataclasses import dataclass, field
+from functools import partial
+from hashlib import sha256
 from inspect import signature, Parameter
-from typing import Callable, Optional, Dict, List, Any, Type
+from typing import Callable, Optional, Dict, List, Any, Type, Set
 
 from fastapi import FastAPI, Depends
+from fastapi.encoders import jsonable_encoder
 
+from fastapi_metabot.batching import SlackBatcher
 from fastapi_metabot.client import (
     AsyncApis,
     ApiClient,
     models
 )
-from fastapi_metabot.client.exceptions import ApiException
+from fastapi_metabot.client.api.metabot_api import AsyncMetabotApi
+from fastapi_metabot.client.exceptions import ApiException, UnexpectedResponse
+from fastapi_metabot.jobs import (
+    JobRunner,
+    VIEW_PRIORITY,
+    ACTION_PRIORITY,
+    COMMAND_PRIORITY,
+)
+from fastapi_metabot.loop_monitor import LoopMonitor
+from fastapi_metabot.processes import ProcessRunner
+from fastapi_metabot.profiling import Profiler
 from fastapi_metabot.routes import router
+from fastapi_metabot.tracing import (
+    TraceContextMiddleware,
+    SpanExporter,
+    handler_span,
+)
 from fastapi_metabot.utils import current_module
 
 log = logging.getLogger(__name__)
 
 Converter = Callable[[str], Any]
 
+PROCESS_EXECUTOR = 'process'
+
 
 @dataclass
 class Argument:
@@ -43,12 +67,24 @@ class Module:
     module_url: str
     metabot_client: ApiClient
     heartbeat_delay: float
+    slack_batcher: Optional[SlackBatcher]
+    response_client: ApiClient
+    jobs: JobRunner
+    job_timeout: Optional[float]
+    loop_monitor: Optional[LoopMonitor]
+    profiling_token: Optional[str]
+    profiler: Profiler
+    span_exporter: SpanExporter
 
     _commands: Dict[str, Command]
     _views: Dict[str, Callable]
     _actions: Dict[str, Callable]
     _converters: Dict[Type, Converter]
     _heartbeat: Optional[Task]
+    _executor: ThreadPoolExecutor
+    _process_runner: ProcessRunner
+    _process_handlers: Set[Callable]
+    _timeouts: Dict[Callable, float]
 
     def __init__(
             self,
@@ -56,19 +92,84 @@ class Module:
             module_url: str,
             metabot_url: str,
             description: Optional[str] = None,
+            metabot_client_options: Optional[Dict[str, Any]] = None,
             heartbeat_delay: float = 10,
+            slack_batch_delay: float = 0,
+            slack_batch_size: int = 100,
+            sync_workers: int = 10,
+            process_workers: Optional[int] = None,
+            max_jobs: int = 50,
+            max_queued_jobs: int = 1000,
+            job_timeout: Optional[float] = None,
+            job_drain_timeout: float = 10,
+            loop_monitor: bool = False,
+            loop_monitor_options: Optional[Dict[str, Any]] = None,
+            profiling_token: Optional[str] = None,
+            tracing_options: Optional[Dict[str, Any]] = None,
     ) -> None:
         self.name = name
         self.description = description
         self.module_url = module_url
-        self.metabot_client = ApiClient(host=metabot_url)
+        # Connection limits, timeouts and HTTP/2
+        # of the metabot client can be tuned with its options
+        self.metabot_client = ApiClient(
+            host=metabot_url,
+            **(metabot_client_options or {}),
+        )
+        self.metabot_client.add_middleware(TraceContextMiddleware())
         self.heartbeat_delay = heartbeat_delay
 
+        # async_slack_request calls made within a few milliseconds of each
+        # other are sent to metabot in a single batch, if enabled
+        self.slack_batcher = None
+        if slack_batch_delay:
+            self.slack_batcher = SlackBatcher(
+                self.metabot_client,
+                slack_batch_delay,
+                slack_batch_size,
+            )
+
+        # Pooled connections to Slack for replies to response urls
+        self.response_client = ApiClient()
+
+        # Commands and actions are queued and run by a limited number
+        # of workers, instead of all at once
+        self.jobs = JobRunner(max_jobs, max_queued_jobs, job_drain_timeout)
+        self.job_timeout = job_timeout
+
+        # Event loop lag and stacks of callbacks blocking the loop
+        # (interval, threshold, max_records) are served at /debug/loop
+        self.loop_monitor = None
+        if loop_monitor:
+            self.loop_monitor = LoopMonitor(**(loop_monitor_options or {}))
+
+        # Profiles of the next commands or actions can be taken through
+        # /debug/profile by admins with the token, if it is set
+        self.profiling_token = profiling_token
+        self.profiler = Profiler()
+
+        # Handlers get a span each, which is exported along with the spans
+        # of metabot if a file_path or an OTLP/HTTP endpoint is set
+        self.span_exporter = SpanExporter(
+            service_name=name,
+            **(tracing_options or {}),
+        )
+
         self._commands = {}
         self._views = {}
         self._actions = {}
         self._converters = {}
         self._heartbeat = None
+        # Synchronous handlers and converters run in threads,
+        # so that they don't block the event loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=sync_workers,
+            thread_name_prefix=f'{name}-sync',
+        )
+        # CPU heavy handlers run in worker processes, if asked to
+        self._process_runner = ProcessRunner(process_workers)
+        self._process_handlers = set()
+        self._timeouts = {}
 
     def command(
             self,
@@ -77,10 +178,14 @@ class Module:
             function: Optional[Callable] = None,
             description: Optional[str] = None,
             arg_descriptions: Optional[Dict[str, str]] = None,
+            executor: Optional[str] = None,
+            timeout: Optional[float] = None,
     ) -> Callable:
         assert name not in self._commands, 'Duplicate command names detected'
+        self._check_executor(executor)
 
         def wrapper(f: Callable) -> Callable:
+            self._register_handler(f, executor, timeout)
             arguments = self._parse_arguments(f, arg_descriptions)
             self._commands[name] = Command(
                 name=name,
@@ -117,10 +222,14 @@ class Module:
             name: str,
             *,
             function: Optional[Callable] = None,
+            executor: Optional[str] = None,
+            timeout: Optional[float] = None,
     ) -> Callable:
         assert name not in self._actions, 'Duplicate action names detected'
+        self._check_executor(executor)
 
         def wrapper(f: Callable) -> Callable:
+            self._register_handler(f, executor, timeout)
             self._actions[name] = f
             return f
 
@@ -133,11 +242,15 @@ class Module:
             self,
             name: str,
             *,
-            function: Optional[Callable] = None
+            function: Optional[Callable] = None,
+            executor: Optional[str] = None,
+            timeout: Optional[float] = None,
     ) -> Callable:
         assert name not in self._views, 'Duplicate view names detected'
+        self._check_executor(executor)
 
         def wrapper(f: Callable) -> Callable:
+            self._register_handler(f, executor, timeout)
             self._views[name] = f
             return f
 
@@ -146,6 +259,23 @@ class Module:
         else:
             return wrapper(function)
 
+    @staticmethod
+    def _check_executor(executor: Optional[str]) -> None:
+        assert executor in (None, PROCESS_EXECUTOR), (
+            f'Unknown executor {executor}'
+        )
+
+    def _register_handler(
+            self,
+            f: Callable,
+            executor: Optional[str],
+            timeout: Optional[float],
+    ) -> None:
+        if executor == PROCESS_EXECUTOR:
+            self._process_handlers.add(f)
+        if timeout is not None:
+            self._timeouts[f] = timeout
+
     @staticmethod
     def _parse_arguments(
             f: Callable,
@@ -167,44 +297,91 @@ class Module:
             description=arg_descriptions.get(p.name),
         ) for p in params.values()]
 
+    def submit_command(self, name: str, arguments: Dict[str, str]) -> None:
+        command = self._commands.get(name)
+        self.jobs.submit(
+            COMMAND_PRIORITY,
+            self.execute_command,
+            name,
+            arguments,
+            timeout=self._get_timeout(command.func if command else None),
+        )
+
+    def submit_action(self, action_id: str) -> None:
+        action_type, action_name = action_id.split(':', 2)
+        if action_type == 'view_submission':
+            priority = VIEW_PRIORITY
+            handler = self._views.get(action_name)
+        else:
+            priority = ACTION_PRIORITY
+            handler = self._actions.get(action_name)
+        self.jobs.submit(
+            priority,
+            self.execute_action,
+            action_id,
+            timeout=self._get_timeout(handler),
+        )
+
+    def _get_timeout(self, handler: Optional[Callable]) -> Optional[float]:
+        if handler is not None and handler in self._timeouts:
+            return self._timeouts[handler]
+        return self.job_timeout
+
     async def execute_command(
             self,
             name: str,
             arguments: Dict[str, str],
     ) -> None:
         command = self._commands[name]
-        converted_args = {
-            arg.name: await self._maybe_await(
-                self._get_converter(arg.type),
-                value
-            )
-            for arg in command.arguments
-            if (value := arguments.get(arg.name))
-        }
-        await self._maybe_await(command.func, **converted_args)
+        with handler_span(
+                f'command {self.name} {name}',
+                self.span_exporter,
+        ), self.profiler.profile(module=self.name, command=name):
+            converted_args = {
+                arg.name: await self._convert(arg.type, value)
+                for arg in command.arguments
+                if (value := arguments.get(arg.name))
+            }
+            await self._maybe_await(command.func, **converted_args)
 
     async def execute_action(self, action_id: str) -> None:
         action_type, action_name = action_id.split(':', 2)
-        if action_type == 'block_actions':
-            await self._maybe_await(self._actions[action_name])
-        elif action_type == 'view_submission':
-            await self._maybe_await(self._views[action_name])
-        else:
-            log.error(f'Unknown action {action_id} triggered')
+        with handler_span(
+                f'action {action_id}',
+                self.span_exporter,
+        ), self.profiler.profile(module=self.name, action=action_id):
+            if action_type == 'block_actions':
+                await self._maybe_await(self._actions[action_name])
+            elif action_type == 'view_submission':
+                await self._maybe_await(self._views[action_name])
+            else:
+                log.error(f'Unknown action {action_id} triggered')
 
-    @staticmethod
     async def _maybe_await(
+            self,
             function: Callable,
             *args: Any,
             **kwargs: Any
     ) -> Any:
+        if function in self._process_handlers:
+            return await self._process_runner.run(function, *args, **kwargs)
         if iscoroutinefunction(function):
             return await function(*args, **kwargs)
-        else:
-            return function(*args, **kwargs)
 
-    def _get_converter(self, to_type: Type) -> Converter:
-        return self._converters.get(to_type, to_type)
+        # The thread gets a copy of the current context,
+        # so the metadata and the current module are still available there
+        context = copy_context()
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor,
+            partial(context.run, function, *args, **kwargs),
+        )
+
+    async def _convert(self, to_type: Type, value: str) -> Any:
+        # Types without custom converters, like int, are cheap enough
+        # to be called right away
+        if to_type not in self._converters:
+            return to_type(value)
+        return await self._maybe_await(self._converters[to_type], value)
 
     def install(self, app: FastAPI, prefix: str = '') -> FastAPI:
         async def set_current_module() -> None:
@@ -217,20 +394,61 @@ class Module:
             dependencies=[Depends(set_current_module)],
         )
 
+        app.add_event_handler('startup', self._open_clients)
+        app.add_event_handler('startup', self.span_exporter.start)
+        app.add_event_handler('startup', self._start_process_runner)
+        app.add_event_handler('startup', self.jobs.start)
+        if self.loop_monitor is not None:
+            app.add_event_handler('startup', self.loop_monitor.start)
+            app.add_event_handler('shutdown', self.loop_monitor.stop)
         if self.heartbeat_delay:
             app.add_event_handler('startup', self._start_heartbeat)
             app.add_event_handler('shutdown', self._stop_heartbeat)
+        # Clients are closed last, running jobs may still need them
+        app.add_event_handler('shutdown', self.jobs.stop)
+        app.add_event_handler('shutdown', self._process_runner.stop)
+        app.add_event_handler('shutdown', self._stop_executor)
+        app.add_event_handler('shutdown', self.span_exporter.stop)
+        app.add_event_handler('shutdown', self._close_clients)
 
         return app
 
+    def _open_clients(self) -> None:
+        self.metabot_client.open()
+        self.response_client.open()
+
+    async def _close_clients(self) -> None:
+        await self.metabot_client.aclose()
+        await self.response_client.aclose()
+
+    def _stop_executor(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    async def _start_process_runner(self) -> None:
+        # Worker processes are only needed by process handlers
+        if self._process_handlers:
+            await self._process_runner.start()
+
     def _start_heartbeat(self) -> None:
         module = self._build_module_payload()
+        manifest_hash = self._hash_module_payload(module)
         metabot_api = AsyncApis(self.metabot_client).metabot_api
 
         async def heartbeat() -> None:
+            registered = False
             while True:
                 try:
-                    await metabot_api.register_module_api_modules_post(module)
+                    if registered:
+                        registered = await self._refresh_module(
+                            metabot_api,
+                            manifest_hash,
+                        )
+                    if not registered:
+                        await metabot_api.register_module_api_modules_post(
+                            module,
+                            manifest_hash,
+                        )
+                        registered = True
                 except ApiException:
                     log.exception('Heartbeat to metabot server has failed')
 
@@ -238,6 +456,39 @@ class Module:
 
         self._heartbeat = asyncio.create_task(heartbeat())
 
+    async def _refresh_module(
+            self,
+            metabot_api: AsyncMetabotApi,
+            manifest_hash: str,
+    ) -> bool:
+        refresh_module = (
+            metabot_api.refresh_module_api_modules_module_name_heartbeat_post
+        )
+        try:
+            await refresh_module(
+                self.name,
+                models.ModuleHeartbeat(
+                    manifest_hash=manifest_hash,
+                    url=self.module_url,
+                ),
+            )
+        except UnexpectedResponse as e:
+            # Metabot doesn't know our manifest (e.g. it has expired
+            # or another replica has changed it), so we must register again
+            if e.status_code != 404:
+                raise
+            return False
+        return True
+
+    @staticmethod
+    def _hash_module_payload(module: models.Module) -> str:
+        # All replicas of a module share the manifest, but not the URL
+        raw_module = json.dumps(
+            jsonable_encoder(module, exclude={'url', 'endpoints'}),
+            sort_keys=True,
+        )
+        return sha256(raw_module.encode('utf-8')).hexdigest()
+
     def _build_module_payload(self) -> models.Module:
         return models.Module(
             name=self.name,
@@ -0,0 +1,188 @@
+import asyncio
+import multiprocessing
+import os
+from asyncio import iscoroutinefunction
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import Context
+from functools import partial
+from multiprocessing.managers import SyncManager
+from queue import Queue
+from threading import Lock
+from typing import Optional, Callable, Any, Dict, Tuple
+
+from httpx import Headers
+
+from fastapi_metabot.client.exceptions import (
+    ResponseHandlingException,
+    UnexpectedResponse,
+)
+from fastapi_metabot.models import CommandMetadata, ActionMetadata
+from fastapi_metabot.utils import (
+    command_metadata,
+    action_metadata,
+    parent_slack_request,
+    async_slack_request,
+)
+
+# (is successful, response data or (status code, content))
+Reply = Tuple[bool, Any]
+
+
+class ParentSlackRequest:
+    _calls: Queue
+    _replies: Queue
+    _lock: Lock
+
+    def __init__(self, calls: Queue, replies: Queue) -> None:
+        self._calls = calls
+        self._replies = replies
+        self._lock = Lock()
+
+    def __call__(self, req: Dict) -> Dict:
+        # Replies aren't tagged, so requests of a handler go one at a time
+        with self._lock:
+            self._calls.put(req)
+            is_successful, result = self._replies.get()
+        if is_successful:
+            return result
+
+        status_code, content = result
+        if status_code is None:
+            raise ResponseHandlingException(Exception(content.decode()))
+        raise UnexpectedResponse(status_code, '', content, Headers())
+
+
+def _run_handler(
+        function: Callable,
+        command_meta: Optional[CommandMetadata],
+        action_meta: Optional[ActionMetadata],
+        calls: Queue,
+        replies: Queue,
+        args: Tuple,
+        kwargs: Dict,
+) -> Any:
+    command_metadata.set(command_meta)
+    action_metadata.set(action_meta)
+    parent_slack_request.set(ParentSlackRequest(calls, replies))
+
+    if iscoroutinefunction(function):
+        return asyncio.run(function(*args, **kwargs))
+    return function(*args, **kwargs)
+
+
+def _call_in_new_context(*args: Any) -> Any:
+    # Worker processes are reused, handlers mustn't see each other's metadata
+    return Context().run(_run_handler, *args)
+
+
+# Every handler in flight has a thread waiting for its Slack requests,
+# and needs another one for the rest of the queue calls. These threads
+# have an executor of their own, sized for as many handlers as there are
+# worker processes, so that they never starve the default executor (or
+# each other, which would deadlock handlers waiting for their replies).
+class ProcessRunner:
+    max_workers: int
+
+    _executor: Optional[ProcessPoolExecutor]
+    _manager: Optional[SyncManager]
+    _relay_executor: Optional[ThreadPoolExecutor]
+    _slots: Optional[asyncio.Semaphore]
+
+    def __init__(self, max_workers: Optional[int] = None) -> None:
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+        self._manager = None
+        self._relay_executor = None
+        self._slots = None
+
+    async def start(self) -> None:
+        # Handlers are pickled by reference, spawned workers import
+        # them anew instead of inheriting the state of the event loop
+        context = multiprocessing.get_context('spawn')
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=context,
+        )
+        self._manager = context.Manager()
+        self._relay_executor = ThreadPoolExecutor(
+            max_workers=2 * self.max_workers,
+            thread_name_prefix='process-relay',
+        )
+        self._slots = asyncio.Semaphore(self.max_workers)
+
+        # Workers are started right away, so that the first handlers
+        # don't have to wait for them
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(self._executor, os.getpid)
+            for _ in range(self.max_workers)
+        ])
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+        if self._relay_executor is not None:
+            self._relay_executor.shutdown()
+            self._relay_executor = None
+        self._slots = None
+
+    async def run(self, function: Callable, *args: Any, **kwargs: Any) -> Any:
+        assert self._slots is not None, 'Process pool must be started first'
+
+        # Handlers beyond the number of workers would only wait for them
+        async with self._slots:
+            return await self._run(function, args, kwargs)
+
+    async def _run(self, function: Callable, args: Tuple, kwargs: Dict) -> Any:
+        assert self._manager is not None and self._relay_executor is not None
+
+        loop = asyncio.get_event_loop()
+        calls = await loop.run_in_executor(
+            self._relay_executor,
+            self._manager.Queue,
+        )
+        replies = await loop.run_in_executor(
+            self._relay_executor,
+            self._manager.Queue,
+        )
+        relay = asyncio.create_task(self._relay(calls, replies))
+        try:
+            return await loop.run_in_executor(self._executor, partial(
+                _call_in_new_context,
+                function,
+                command_metadata.get(),
+                action_metadata.get(),
+                calls,
+                replies,
+                args,
+                kwargs,
+            ))
+        finally:
+            await loop.run_in_executor(self._relay_executor, calls.put, None)
+            await relay
+
+    async def _relay(self, calls: Queue, replies: Queue) -> None:
+        # Slack requests of the handler are sent by the parent process,
+        # where the module and its clients live
+        loop = asyncio.get_event_loop()
+        while (req := await loop.run_in_executor(
+                self._relay_executor,
+                calls.get,
+        )) is not None:
+            reply: Reply
+            try:
+                reply = (True, await async_slack_request(**req))
+            except UnexpectedResponse as e:
+                reply = (False, (e.status_code, e.content))
+            except Exception as e:
+                # The handler would wait for a reply forever otherwise
+                reply = (False, (None, str(e).encode('utf-8')))
+            await loop.run_in_executor(
+                self._relay_executor,
+                replies.put,
+                reply,
+            )
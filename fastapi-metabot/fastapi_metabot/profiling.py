@@ -0,0 +1,245 @@
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import datetime
+from time import monotonic
+from types import FrameType
+from typing import (
+    DefaultDict,
+    Dict,
+    Tuple,
+    Optional,
+    List,
+    Any,
+    ContextManager,
+)
+
+from fastapi_metabot.models import ProfileRequest, ProfileStatus
+
+WALL = 'wall'
+CPU = 'cpu'
+COLLAPSED = 'collapsed'
+SPEEDSCOPE = 'speedscope'
+
+# Thread name first, innermost frame last
+Stack = Tuple[str, ...]
+
+NOT_PROFILED: ContextManager[None] = nullcontext()
+
+
+def _format_frame(frame: FrameType) -> str:
+    # Samples of a function are merged regardless of the line they are at
+    code = frame.f_code
+    name = f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'
+    return name.replace(';', ':')
+
+
+def _walk_stack(frame: Optional[FrameType]) -> List[str]:
+    frames = []
+    while frame is not None:
+        frames.append(_format_frame(frame))
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+# CPU clocks of other threads are only available on some Unix platforms
+_get_cpu_clock = getattr(time, 'pthread_getcpuclockid', None)
+
+
+def _thread_cpu_time(thread_id: int) -> Optional[float]:
+    if _get_cpu_clock is None:
+        return None
+    try:
+        return time.clock_gettime(_get_cpu_clock(thread_id))
+    except OSError:
+        return None
+
+
+class ProfileSession:
+    status: ProfileStatus
+    interval: float
+    sampler: Optional[threading.Thread]
+    # Seconds spent in every stack
+    wall: DefaultDict[Stack, float]
+    cpu: DefaultDict[Stack, float]
+
+    def __init__(self, req: ProfileRequest) -> None:
+        self.status = ProfileStatus(
+            module=req.module,
+            command=req.command,
+            action=req.action,
+            requests=req.requests,
+            started_at=datetime.utcnow(),
+        )
+        self.interval = req.interval
+        self.sampler = None
+        self.wall = defaultdict(float)
+        self.cpu = defaultdict(float)
+
+    def claim(
+            self,
+            module: Optional[str],
+            command: Optional[str],
+            action: Optional[str],
+    ) -> bool:
+        status = self.status
+        if status.profiled + status.active >= status.requests:
+            return False
+        for expected, actual in (
+                (status.module, module),
+                (status.command, command),
+                (status.action, action),
+        ):
+            if expected is not None and expected != actual:
+                return False
+        status.active += 1
+        return True
+
+    def release(self) -> None:
+        self.status.active -= 1
+        self.status.profiled += 1
+        self.status.done = self.status.profiled >= self.status.requests
+
+
+# While matching requests are in flight, a thread samples the stacks of
+# all other threads every interval. Samples are weighted by the wall time
+# since the previous one and by the CPU time the thread has used in the
+# meantime. Handlers share the event loop, so its samples include every
+# coroutine running at the moment, not just the profiled ones, while
+# handlers in worker processes aren't sampled at all.
+class Profiler:
+    session: Optional[ProfileSession]
+
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.session = None
+        self._lock = threading.Lock()
+
+    def start(self, req: ProfileRequest) -> ProfileStatus:
+        # Starting a new session discards the previous one
+        self.session = ProfileSession(req)
+        return self.session.status
+
+    def cancel(self) -> None:
+        self.session = None
+
+    def get_stacks(self, mode: str) -> Dict[Stack, float]:
+        assert self.session is not None, 'No profile has been started'
+        with self._lock:
+            return dict(getattr(self.session, mode))
+
+    def profile(
+            self,
+            module: Optional[str] = None,
+            command: Optional[str] = None,
+            action: Optional[str] = None,
+    ) -> ContextManager[None]:
+        # Only a single attribute is checked while profiling is off
+        if (session := self.session) is None or session.status.done:
+            return NOT_PROFILED
+        with self._lock:
+            if not session.claim(module, command, action):
+                return NOT_PROFILED
+        return _ProfiledRequest(self, session)
+
+    def _enter(self, session: ProfileSession) -> None:
+        with self._lock:
+            if session.sampler is None:
+                session.sampler = threading.Thread(
+                    target=self._sample,
+                    args=(session,),
+                    name='profiler',
+                    daemon=True,
+                )
+                session.sampler.start()
+
+    def _exit(self, session: ProfileSession) -> None:
+        with self._lock:
+            session.release()
+
+    def _sample(self, session: ProfileSession) -> None:
+        sampler_id = threading.get_ident()
+        cpu_times: Dict[int, float] = {}
+        sampled_at = monotonic()
+        while True:
+            time.sleep(session.interval)
+            now = monotonic()
+            wall, sampled_at = now - sampled_at, now
+            names = {x.ident: x.name for x in threading.enumerate()}
+            frames = sys._current_frames()  # noqa
+
+            with self._lock:
+                if not session.status.active or self.session is not session:
+                    session.sampler = None
+                    return
+
+                for thread_id, frame in frames.items():
+                    if thread_id == sampler_id:
+                        continue
+                    stack = (
+                        names.get(thread_id, str(thread_id)),
+                        *_walk_stack(frame),
+                    )
+                    session.wall[stack] += wall
+
+                    cpu_time = _thread_cpu_time(thread_id)
+                    if cpu_time is None:
+                        continue
+                    previous = cpu_times.get(thread_id, cpu_time)
+                    cpu_times[thread_id] = cpu_time
+                    if cpu_time > previous:
+                        session.cpu[stack] += cpu_time - previous
+                session.status.samples += 1
+
+
+class _ProfiledRequest:
+    profiler: Profiler
+    session: ProfileSession
+
+    def __init__(self, profiler: Profiler, session: ProfileSession) -> None:
+        self.profiler = profiler
+        self.session = session
+
+    def __enter__(self) -> None:
+        self.profiler._enter(self.session)  # noqa
+
+    def __exit__(self, *args: Any) -> None:
+        self.profiler._exit(self.session)  # noqa
+
+
+def to_collapsed(stacks: Dict[Stack, float]) -> str:
+    # Folded stacks as read by flamegraph.pl, weighted in microseconds
+    lines = []
+    for stack, seconds in sorted(stacks.items()):
+        if (weight := round(seconds * 1e6)) > 0:
+            lines.append(f'{";".join(stack)} {weight}')
+    return '\n'.join(lines) + '\n'
+
+
+def to_speedscope(stacks: Dict[Stack, float], name: str) -> Dict[str, Any]:
+    # https://www.speedscope.app/file-format-schema.json
+    frames: Dict[str, int] = {}
+    samples = []
+    weights = []
+    for stack, seconds in stacks.items():
+        samples.append([frames.setdefault(x, len(frames)) for x in stack])
+        weights.append(seconds)
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': [{'name': x} for x in frames]},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+        'name': name,
+        'exporter': 'fastapi_metabot',
+    }
@@ -1,11 +1,32 @@
-from fastapi import BackgroundTasks, APIRouter, HTTPException
+from asyncio import QueueFull
+from hmac import compare_digest
+from typing import Optional, Union, Dict, Any
+
+from fastapi import APIRouter, HTTPException, Header, Depends, Query
 from fastapi.encoders import jsonable_encoder
+from starlette.responses import PlainTextResponse
 
-from fastapi_metabot.models import CommandPayload, ActionPayload
+from fastapi_metabot.models import (
+    CommandPayload,
+    ActionPayload,
+    JobStats,
+    LoopReport,
+    ProfileRequest,
+    ProfileStatus,
+)
+from fastapi_metabot.profiling import (
+    to_collapsed,
+    to_speedscope,
+    WALL,
+    CPU,
+    COLLAPSED,
+    SPEEDSCOPE,
+)
 from fastapi_metabot.utils import (
     current_module,
     command_metadata,
     action_metadata,
+    trace_context,
 )
 
 router = APIRouter()
@@ -15,30 +36,130 @@ router = APIRouter()
 async def execute_command(
         command_name: str,
         payload: CommandPayload,
-        background_tasks: BackgroundTasks,
+        traceparent: Optional[str] = Header(None),
 ) -> None:
     module = current_module.get()
     if module is None:
         raise HTTPException(500)
 
     command_metadata.set(payload.metadata)
+    trace_context.set(payload.traceparent or traceparent)
 
-    background_tasks.add_task(
-        module.execute_command,
-        command_name,
-        jsonable_encoder(payload.arguments),
-    )
+    try:
+        module.submit_command(
+            command_name,
+            jsonable_encoder(payload.arguments),
+        )
+    except QueueFull:
+        # Metabot may retry the command later
+        raise HTTPException(503, 'Too many queued jobs')
 
 
 @router.post('/actions/{action_id}')
 async def execute_action(
         action_id: str,
         payload: ActionPayload,
-        background_tasks: BackgroundTasks,
+        traceparent: Optional[str] = Header(None),
 ) -> None:
     module = current_module.get()
     if module is None:
         raise HTTPException(500)
 
     action_metadata.set(payload.metadata)
-    background_tasks.add_task(module.execute_action, action_id)
+    trace_context.set(payload.traceparent or traceparent)
+    try:
+        module.submit_action(action_id)
+    except QueueFull:
+        raise HTTPException(503, 'Too many queued jobs')
+
+
+@router.get('/jobs', response_model=JobStats)
+async def get_jobs() -> JobStats:
+    module = current_module.get()
+    if module is None:
+        raise HTTPException(500)
+
+    return module.jobs.get_stats()
+
+
+async def require_admin(authorization: str = Header('')) -> None:
+    module = current_module.get()
+    if module is None:
+        raise HTTPException(500)
+
+    # Debug endpoints are disabled altogether unless an admin token is set
+    if not module.profiling_token:
+        raise HTTPException(404)
+    if not compare_digest(authorization, f'Bearer {module.profiling_token}'):
+        raise HTTPException(403)
+
+
+# Stacks of slow callbacks give away the file system layout of the module
+@router.get(
+    '/debug/loop',
+    response_model=LoopReport,
+    dependencies=[Depends(require_admin)],
+)
+async def get_loop() -> LoopReport:
+    module = current_module.get()
+    if module is None:
+        raise HTTPException(500)
+    if module.loop_monitor is None:
+        raise HTTPException(404, 'Loop monitor is disabled')
+
+    return module.loop_monitor.get_report()
+
+
+@router.post(
+    '/debug/profile',
+    response_model=ProfileStatus,
+    dependencies=[Depends(require_admin)],
+)
+async def start_profile(req: ProfileRequest) -> ProfileStatus:
+    module = current_module.get()
+    if module is None:
+        raise HTTPException(500)
+    return module.profiler.start(req)
+
+
+@router.get(
+    '/debug/profile/status',
+    response_model=ProfileStatus,
+    dependencies=[Depends(require_admin)],
+)
+async def get_profile_status() -> ProfileStatus:
+    module = current_module.get()
+    if module is None:
+        raise HTTPException(500)
+    if module.profiler.session is None:
+        raise HTTPException(404, 'No profile has been started')
+
+    return module.profiler.session.status
+
+
+@router.get('/debug/profile', dependencies=[Depends(require_admin)])
+async def get_profile(
+        format: str = Query(  # noqa A002
+            COLLAPSED,
+            regex=f'^({COLLAPSED}|{SPEEDSCOPE})$',
+        ),
+        mode: str = Query(WALL, regex=f'^({WALL}|{CPU})$'),
+) -> Union[PlainTextResponse, Dict[str, Any]]:
+    module = current_module.get()
+    if module is None:
+        raise HTTPException(500)
+    if module.profiler.session is None:
+        raise HTTPException(404, 'No profile has been started')
+
+    stacks = module.profiler.get_stacks(mode)
+    if format == SPEEDSCOPE:
+        return to_speedscope(stacks, f'{module.name} {mode}')
+    return PlainTextResponse(to_collapsed(stacks))
+
+
+@router.delete('/debug/profile', dependencies=[Depends(require_admin)])
+async def cancel_profile() -> None:
+    module = current_module.get()
+    if module is None:
+        raise HTTPException(500)
+    module.profiler.cancel()
@@ -0,0 +1,304 @@
+import asyncio
+import json
+import logging
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import time_ns
+from typing import Dict, Any, List, Optional, Tuple, Iterator
+
+from httpx import AsyncClient, Request, Response
+
+from fastapi_metabot.client.api_client import BaseMiddleware, Send
+from fastapi_metabot.utils import get_trace_headers, trace_context
+
+log = logging.getLogger(__name__)
+
+# Trace context is propagated in the W3C format,
+# https://www.w3.org/TR/trace-context/
+TRACEPARENT_HEADER = 'traceparent'
+
+# Span kinds and status codes of OTLP
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+PRODUCER = 4
+CONSUMER = 5
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: str
+    kind: int
+    start_ns: int
+    end_ns: int = 0
+    status: int = STATUS_OK
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def traceparent(self) -> str:
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def to_otlp(self) -> Dict[str, Any]:
+        # OTLP/JSON encodes ids as hex strings and 64 bit integers as strings
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': _otlp_attributes(self.attributes),
+            'status': {'code': self.status},
+        }
+
+
+current_span: ContextVar[Optional[Span]] = ContextVar(
+    'current_span',
+    default=None,
+)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {'key': key, 'value': _otlp_value(value)}
+        for key, value in attributes.items()
+    ]
+
+
+def _random_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+def _is_hex_id(value: str, length: int) -> bool:
+    try:
+        return len(value) == length and int(value, 16) != 0
+    except ValueError:
+        return False
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    # Returns the trace id and the parent span id,
+    # invalid headers start a new trace instead
+    if not value:
+        return None
+    parts = value.strip().lower().split('-')
+    if len(parts) < 4 or parts[0] == 'ff':
+        return None
+    _, trace_id, span_id, _ = parts[:4]
+    if not _is_hex_id(trace_id, 32) or not _is_hex_id(span_id, 16):
+        return None
+    return trace_id, span_id
+
+
+def get_traceparent() -> Optional[str]:
+    span = current_span.get()
+    return span.traceparent if span is not None else None
+
+
+def to_otlp_request(
+        spans: List[Span],
+        service_name: str,
+) -> Dict[str, Any]:
+    return {
+        'resourceSpans': [{
+            'resource': {
+                'attributes': _otlp_attributes({
+                    'service.name': service_name,
+                }),
+            },
+            'scopeSpans': [{
+                'scope': {'name': __name__},
+                'spans': [span.to_otlp() for span in spans],
+            }],
+        }],
+    }
+
+
+# Finished spans are exported in OTLP/JSON every interval, or as soon as
+# a batch is full, either as lines of a local file or to an OTLP/HTTP
+# collector (e.g. http://collector:4318/v1/traces). Without either of
+# them trace context is still propagated, but spans are dropped.
+class SpanExporter:
+    service_name: str
+    file_path: str
+    endpoint: str
+    interval: float
+    batch_size: int
+
+    _spans: List[Span]
+    _full: Optional[asyncio.Event]
+    _task: Optional[asyncio.Task]
+    _client: Optional[AsyncClient]
+
+    def __init__(
+            self,
+            service_name: str = 'fastapi_metabot',
+            file_path: str = '',
+            endpoint: str = '',
+            interval: float = 5,
+            batch_size: int = 512,
+    ) -> None:
+        self.service_name = service_name
+        self.file_path = file_path
+        self.endpoint = endpoint
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self._spans = []
+        self._full = None
+        self._task = None
+        self._client = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.file_path or self.endpoint)
+
+    def export(self, span: Span) -> None:
+        if not self.enabled:
+            return
+        self._spans.append(span)
+        if len(self._spans) >= self.batch_size and self._full is not None:
+            self._full.set()
+
+    async def start(self) -> None:
+        if not self.enabled:
+            return
+        if self.endpoint:
+            self._client = AsyncClient()
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._full = None
+
+        await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self) -> None:
+        assert self._full is not None
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        while self._spans:
+            spans = self._spans[:self.batch_size]
+            del self._spans[:self.batch_size]
+            body = json.dumps(to_otlp_request(spans, self.service_name))
+            try:
+                await self._send(body)
+            except Exception:
+                log.exception(f'Failed to export {len(spans)} spans')
+
+    async def _send(self, body: str) -> None:
+        if self.file_path:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._write, body)
+        if self.endpoint and self._client is not None:
+            resp = await self._client.post(
+                self.endpoint,
+                data=body,
+                headers={'Content-Type': 'application/json'},
+            )
+            resp.raise_for_status()
+
+    def _write(self, body: str) -> None:
+        with open(self.file_path, 'a') as file:
+            file.write(body + '\n')
+
+
+@contextmanager
+def start_span(
+        name: str,
+        kind: int = INTERNAL,
+        traceparent: Optional[str] = None,
+        exporter: Optional[SpanExporter] = None,
+        **attributes: Any,
+) -> Iterator[Span]:
+    # Spans continue the trace of a remote parent if there is one,
+    # then the trace of the current span, otherwise they start a new one
+    parent = parse_traceparent(traceparent)
+    if parent is None and (span := current_span.get()) is not None:
+        parent = span.trace_id, span.span_id
+    trace_id, parent_span_id = parent or (_random_id(16), '')
+
+    span = Span(
+        name=name,
+        trace_id=trace_id,
+        span_id=_random_id(8),
+        parent_span_id=parent_span_id,
+        kind=kind,
+        start_ns=time_ns(),
+        attributes=attributes,
+    )
+    token = current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.status = STATUS_ERROR
+        span.attributes['exception.type'] = type(e).__name__
+        raise
+    finally:
+        span.end_ns = time_ns()
+        current_span.reset(token)
+        if exporter is not None:
+            exporter.export(span)
+
+
+@contextmanager
+def handler_span(
+        name: str,
+        exporter: Optional[SpanExporter] = None,
+        **attributes: Any,
+) -> Iterator[Span]:
+    # Handlers continue the trace of the command or action sent by metabot,
+    # and requests they make to metabot carry the context of their span
+    with start_span(
+            name,
+            SERVER,
+            trace_context.get(),
+            exporter,
+            **attributes,
+    ) as span:
+        token = trace_context.set(span.traceparent)
+        try:
+            yield span
+        finally:
+            trace_context.reset(token)
+
+
+class TraceContextMiddleware(BaseMiddleware):
+    # Requests to metabot made while handling a command or action
+    # carry its trace context
+    async def __call__(self, request: Request, call_next: Send) -> Response:
+        for name, value in get_trace_headers().items():
+            request.headers.setdefault(name, value)
+        return await call_next(request)
@@ -1,8 +1,27 @@
+import asyncio
+import json
 from contextvars import ContextVar
-from typing import Optional, TYPE_CHECKING, Dict
+from typing import (
+    Optional,
+    TYPE_CHECKING,
+    Dict,
+    AsyncGenerator,
+    List,
+    Callable,
+    Tuple,
+)
+
+from fastapi.encoders import jsonable_encoder
+from httpx import Response
+
+from fastapi_metabot.client import AsyncApis
+from fastapi_metabot.client.exceptions import (
+    ApiException,
+    ResponseHandlingException,
+    UnexpectedResponse,
+)
+from fastapi_metabot.client.models import SlackRequest, SlackResponse
 
-from fastapi_metabot.client import SyncApis, AsyncApis
-from fastapi_metabot.client.models import SlackRequest
 
 if TYPE_CHECKING:
     from fastapi_metabot.models import CommandMetadata, ActionMetadata  # noqa
@@ -24,6 +43,26 @@ current_module: ContextVar[Optional['Module']] = ContextVar(
     default=None
 )
 
+# W3C traceparent of the command or action being handled, sent along
+# with requests to metabot so they join its trace
+trace_context: ContextVar[Optional[str]] = ContextVar(
+    'trace_context',
+    default=None
+)
+
+# Handlers running in worker processes send their Slack requests
+# through the module in the parent process
+parent_slack_request: ContextVar[Optional[Callable[[Dict], Dict]]] = (
+    ContextVar('parent_slack_request', default=None)
+)
+
+
+class SlackPaginationError(ApiException):
+    def __init__(self, status_code: int, error: str) -> None:
+        super().__init__(f'Slack pagination failed: {error}')
+        self.status_code = status_code
+        self.error = error
+
 
 def get_current_user_id() -> Optional[str]:
     if c := command_metadata.get():
@@ -43,29 +82,187 @@ def get_current_channel_id() -> Optional[str]:
     return None
 
 
-def slack_request(method: str, payload: Dict) -> Dict:
+def get_trace_headers() -> Dict[str, str]:
+    if traceparent := trace_context.get():
+        return {'traceparent': traceparent}
+    return {}
+
+
+def get_current_response_url() -> Optional[str]:
+    if c := command_metadata.get():
+        return c.response_url
+    elif a := action_metadata.get():
+        return a.response_url
+    return None
+
+
+def _build_response(
+        text: Optional[str],
+        blocks: Optional[List[Dict]],
+        in_channel: bool,
+        replace_original: bool,
+        delete_original: bool,
+) -> Tuple['Module', str, Dict]:
     module = current_module.get()
-    assert module is not None, 'Must be called from any Slack context'
+    response_url = get_current_response_url()
+    assert module is not None and response_url is not None, (
+        'Must be called from a Slack context with a response url'
+    )
+
+    if delete_original:
+        return module, response_url, {'delete_original': True}
+
+    response = {
+        'text': text,
+        'blocks': blocks,
+        'response_type': 'in_channel' if in_channel else 'ephemeral',
+        'replace_original': replace_original,
+    }
+    return module, response_url, {
+        key: value for key, value in response.items() if value is not None
+    }
+
+
+def _check_response(resp: Response) -> None:
+    if resp.status_code != 200:
+        raise UnexpectedResponse.for_response(resp)
 
-    api = SyncApis(module.metabot_client).metabot_api
-    resp = api.request_api_slack_post(
-        SlackRequest(
-            method=method,
-            payload=payload
+
+def respond(
+        text: Optional[str] = None,
+        blocks: Optional[List[Dict]] = None,
+        *,
+        in_channel: bool = False,
+        replace_original: bool = False,
+        delete_original: bool = False,
+) -> None:
+    # Replies go straight to Slack, without metabot or Web API rate limits
+    module, response_url, response = _build_response(
+        text,
+        blocks,
+        in_channel,
+        replace_original,
+        delete_original,
+    )
+    try:
+        resp = module.response_client.sync_client.post(
+            response_url,
+            json=response,
+        )
+    except Exception as e:
+        raise ResponseHandlingException(e)
+    _check_response(resp)
+
+
+async def async_respond(
+        text: Optional[str] = None,
+        blocks: Optional[List[Dict]] = None,
+        *,
+        in_channel: bool = False,
+        replace_original: bool = False,
+        delete_original: bool = False,
+) -> None:
+    module, response_url, response = _build_response(
+        text,
+        blocks,
+        in_channel,
+        replace_original,
+        delete_original,
+    )
+    try:
+        resp = await module.response_client.async_client.post(
+            response_url,
+            json=response,
         )
+    except Exception as e:
+        raise ResponseHandlingException(e)
+    _check_response(resp)
+
+
+def slack_request(
+        method: str,
+        payload: Dict,
+        bypass_cache: bool = False,
+        refresh_cache: bool = False,
+) -> Dict:
+    req = jsonable_encoder(SlackRequest(
+        method=method,
+        payload=payload,
+        bypass_cache=bypass_cache,
+        refresh_cache=refresh_cache,
+    ))
+    if forward := parent_slack_request.get():
+        return forward(req)
+
+    module = current_module.get()
+    assert module is not None, 'Must be called from any Slack context'
+
+    # Sync handlers run in threads without an event loop of their own
+    resp = module.metabot_client.request_sync(
+        type_=SlackResponse,
+        method='POST',
+        url='/api/slack/',
+        json=req,
+        headers=get_trace_headers(),
     )
     return resp.data
 
 
-async def async_slack_request(method: str, payload: Dict) -> Dict:
+async def async_slack_request(
+        method: str,
+        payload: Dict,
+        bypass_cache: bool = False,
+        refresh_cache: bool = False,
+) -> Dict:
+    req = SlackRequest(
+        method=method,
+        payload=payload,
+        bypass_cache=bypass_cache,
+        refresh_cache=refresh_cache,
+    )
+    if forward := parent_slack_request.get():
+        return await asyncio.get_event_loop().run_in_executor(
+            None,
+            forward,
+            jsonable_encoder(req),
+        )
+
     module = current_module.get()
     assert module is not None, 'Must be called from any Slack context'
 
+    if module.slack_batcher is not None:
+        return await module.slack_batcher.request(req)
+
     api = AsyncApis(module.metabot_client).metabot_api
-    resp = await api.request_api_slack_post(
-        SlackRequest(
-            method=method,
-            payload=payload
-        )
-    )
+    resp = await api.request_api_slack_post(req)
     return resp.data
+
+
+async def async_slack_paginate(
+        method: str,
+        payload: Dict,
+        limit: Optional[int] = None,
+) -> AsyncGenerator[Dict, None]:
+    module = current_module.get()
+    assert module is not None, 'Must be called from any Slack context'
+
+    # Metabot follows the cursors itself and sends items as soon as
+    # their page arrives, breaking out of the loop stops the pagination
+    lines = module.metabot_client.stream_lines(
+        method='POST',
+        url='/api/slack/paginate',
+        params={'limit': limit} if limit is not None else {},
+        json=jsonable_encoder(SlackRequest(method=method, payload=payload)),
+    )
+    try:
+        async for line in lines:
+            data = json.loads(line)
+            if 'detail' in data:
+                # Errors of the first page sent by older metabot versions
+                # come with a 200 as well
+                raise SlackPaginationError(400, data['detail'])
+            if 'error' in data:
+                raise SlackPaginationError(data['status_code'], data['error'])
+            yield data['item']
+    finally:
+        await lines.aclose()
@@ -4,9 +4,9 @@ from unittest.mock import MagicMock
 import pytest
 from fastapi import FastAPI
 from requests import Session
-from fastapi import BackgroundTasks
 from starlette.testclient import TestClient
 
+from fastapi_metabot.jobs import JobRunner
 from fastapi_metabot.models import ActionMetadata, CommandMetadata
 from fastapi_metabot.module import Module
 from fastapi_metabot.routes import router
@@ -79,7 +79,7 @@ def test_action_metadata() -> Dict:
 
 
 @pytest.fixture
-def mock_background_tasks(monkeypatch) -> MagicMock:
-    mock = MagicMock(name='add_task')
-    monkeypatch.setattr(BackgroundTasks, 'add_task', mock)
+def mock_submit_job(monkeypatch) -> MagicMock:
+    mock = MagicMock(name='submit')
+    monkeypatch.setattr(JobRunner, 'submit', mock)
     return mock
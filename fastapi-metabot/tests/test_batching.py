@@ -0,0 +1,109 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from fastapi_metabot.batching import SlackBatcher
+from fastapi_metabot.client import ApiClient
+from fastapi_metabot.client.api.metabot_api import AsyncMetabotApi
+from fastapi_metabot.client.exceptions import UnexpectedResponse
+from fastapi_metabot.client.models import (
+    SlackRequest,
+    SlackBatchRequest,
+    SlackBatchResponse,
+    SlackBatchResult,
+)
+from fastapi_metabot.module import Module
+from fastapi_metabot.utils import async_slack_request
+
+
+def _post_message(channel: str) -> SlackRequest:
+    return SlackRequest(
+        method='chat_postMessage',
+        payload={'channel': channel, 'text': 'test'},
+    )
+
+
+@pytest.mark.asyncio
+async def test_slack_batcher(monkeypatch) -> None:
+    mock_api = AsyncMock(
+        name='batch_api_slack_batch_post',
+        return_value=SlackBatchResponse(results=[
+            SlackBatchResult(status_code=200, data={'ok': True}),
+            SlackBatchResult(status_code=404, error='channel_not_found'),
+            SlackBatchResult(status_code=200, error='not_in_channel'),
+        ]),
+    )
+    monkeypatch.setattr(AsyncMetabotApi, 'batch_api_slack_batch_post', mock_api)
+
+    batcher = SlackBatcher(ApiClient(), delay=0.001, max_size=100)
+    results = await asyncio.gather(
+        batcher.request(_post_message('C1')),
+        batcher.request(_post_message('missing')),
+        batcher.request(_post_message('C2')),
+        return_exceptions=True,
+    )
+
+    mock_api.assert_awaited_once_with(SlackBatchRequest(requests=[
+        _post_message('C1'),
+        _post_message('missing'),
+        _post_message('C2'),
+    ]))
+    assert results[0] == {'ok': True}
+    assert isinstance(results[1], UnexpectedResponse)
+    assert results[1].status_code == 404
+    assert results[1].structured() == {'detail': 'channel_not_found'}
+    assert isinstance(results[2], UnexpectedResponse)
+    assert results[2].structured() == {'detail': 'not_in_channel'}
+
+
+@pytest.mark.asyncio
+async def test_slack_batcher_max_size(monkeypatch) -> None:
+    async def mock_batch(batch: SlackBatchRequest) -> SlackBatchResponse:
+        return SlackBatchResponse(results=[
+            SlackBatchResult(status_code=200, data=req.payload)
+            for req in batch.requests
+        ])
+
+    mock_api = AsyncMock(name='batch_api_slack_batch_post', wraps=mock_batch)
+    monkeypatch.setattr(AsyncMetabotApi, 'batch_api_slack_batch_post', mock_api)
+
+    # The delay is never reached, full batches are sent right away
+    batcher = SlackBatcher(ApiClient(), delay=60, max_size=2)
+    results = await asyncio.wait_for(asyncio.gather(*[
+        batcher.request(_post_message(f'C{i}')) for i in range(4)
+    ]), timeout=1)
+
+    assert mock_api.await_count == 2
+    assert [r['channel'] for r in results] == ['C0', 'C1', 'C2', 'C3']
+
+
+@pytest.mark.asyncio
+async def test_slack_batcher_failure(monkeypatch) -> None:
+    error = UnexpectedResponse(502, 'Bad Gateway', b'', {})
+    mock_api = AsyncMock(name='batch_api_slack_batch_post', side_effect=error)
+    monkeypatch.setattr(AsyncMetabotApi, 'batch_api_slack_batch_post', mock_api)
+
+    batcher = SlackBatcher(ApiClient(), delay=0.001, max_size=100)
+    with pytest.raises(UnexpectedResponse):
+        await batcher.request(_post_message('C1'))
+
+
+@pytest.mark.asyncio
+async def test_async_slack_request_batched(
+        set_current_module: Module,
+        monkeypatch
+) -> None:
+    mock_request = AsyncMock(name='request', return_value={'ok': True})
+    monkeypatch.setattr(SlackBatcher, 'request', mock_request)
+    set_current_module.slack_batcher = SlackBatcher(
+        set_current_module.metabot_client,
+        delay=0.001,
+        max_size=100,
+    )
+
+    assert await async_slack_request('chat_postMessage', {}) == {'ok': True}
+    mock_request.assert_awaited_once_with(SlackRequest(
+        method='chat_postMessage',
+        payload={},
+    ))
@@ -0,0 +1,90 @@
+import asyncio
+from contextvars import ContextVar
+from typing import List
+
+import pytest
+
+from fastapi_metabot.jobs import JobRunner
+from fastapi_metabot.models import JobStats
+
+request_id: ContextVar[str] = ContextVar('request_id', default='')
+
+
+@pytest.fixture
+async def job_runner() -> JobRunner:
+    runner = JobRunner(max_concurrency=1, max_queued=2)
+    await runner.start()
+    yield runner
+    await runner.stop()
+
+
+@pytest.mark.asyncio
+async def test_job_runner_priority(job_runner: JobRunner) -> None:
+    calls: List[str] = []
+    done = asyncio.Event()
+
+    async def job(name: str) -> None:
+        calls.append(f'{name}:{request_id.get()}')
+        if len(calls) == 3:
+            done.set()
+
+    # The only worker is busy, so the jobs wait in the queue
+    job_runner.submit(0, asyncio.sleep, 0.01)
+    await asyncio.sleep(0)
+    request_id.set('command')
+    job_runner.submit(2, job, 'command')
+    request_id.set('view')
+    job_runner.submit(0, job, 'view')
+    with pytest.raises(asyncio.QueueFull):
+        job_runner.submit(1, job, 'action')
+    await asyncio.sleep(0.02)
+    job_runner.submit(1, job, 'action')
+
+    await asyncio.wait_for(done.wait(), timeout=1)
+    assert calls == ['view:view', 'command:command', 'action:view']
+
+
+@pytest.mark.asyncio
+async def test_job_runner_failures(job_runner: JobRunner) -> None:
+    cancelled = asyncio.Event()
+
+    async def slow_job() -> None:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def failing_job() -> None:
+        raise ValueError
+
+    job_runner.submit(1, slow_job, timeout=0.01)
+    job_runner.submit(1, failing_job)
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    await asyncio.sleep(0.01)
+
+    stats = job_runner.get_stats()
+    assert stats.copy(update={'wait_seconds': 0, 'run_seconds': 0}) == (
+        JobStats(failed=1, timed_out=1)
+    )
+    assert stats.run_seconds >= 0.01
+
+
+@pytest.mark.asyncio
+async def test_job_runner_drains_on_stop() -> None:
+    runner = JobRunner(max_concurrency=1, max_queued=10, drain_timeout=0.1)
+    await runner.start()
+    calls: List[int] = []
+
+    async def job(i: int, delay: float) -> None:
+        await asyncio.sleep(delay)
+        calls.append(i)
+
+    runner.submit(2, job, 0, 0.01)
+    runner.submit(2, job, 1, 0.01)
+    runner.submit(2, job, 2, 0.2)
+    runner.submit(2, job, 3, 0)
+    await runner.stop()
+
+    assert calls == [0, 1]
+    assert runner.stats.discarded == 1
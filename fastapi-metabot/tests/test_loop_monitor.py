@@ -0,0 +1,58 @@
+import time
+
+from fastapi import FastAPI
+from requests import Session
+from starlette.testclient import TestClient
+
+from fastapi_metabot.module import Module
+
+TOKEN = 'secret'
+ADMIN_HEADERS = {'Authorization': f'Bearer {TOKEN}'}
+
+
+def test_loop_monitor() -> None:
+    lags = []
+    module = Module(
+        name='example',
+        module_url='http://localhost:8000',
+        metabot_url='http://localhost:8000',
+        heartbeat_delay=0,
+        loop_monitor=True,
+        loop_monitor_options={
+            'interval': 0.01,
+            'threshold': 0.05,
+            'on_lag': lags.append,
+        },
+        profiling_token=TOKEN,
+    )
+    app = FastAPI()
+    module.install(app)
+
+    @app.get('/block')
+    async def block_loop() -> None:
+        time.sleep(0.3)
+
+    with TestClient(app) as client:
+        client.get('/block')
+        time.sleep(0.05)
+        resp = client.get('/debug/loop')
+        assert resp.status_code == 403
+        resp = client.get('/debug/loop', headers=ADMIN_HEADERS)
+
+    assert resp.status_code == 200
+    report = resp.json()
+    assert report['stats']['max_lag_seconds'] >= 0.2
+    slow_callback, = report['slow_callbacks']
+    assert slow_callback['blocked_seconds'] >= 0.2
+    assert slow_callback['stack'][-1].endswith('block_loop')
+    assert max(lags) == report['stats']['max_lag_seconds']
+
+
+def test_loop_monitor_disabled(module: Module, test_client: Session) -> None:
+    # Without an admin token the endpoint doesn't exist either
+    resp = test_client.get('/debug/loop')
+    assert resp.status_code == 404
+
+    module.profiling_token = TOKEN
+    resp = test_client.get('/debug/loop', headers=ADMIN_HEADERS)
+    assert resp.status_code == 404
@@ -1,12 +1,20 @@
+import threading
 from asyncio import Task, sleep
-from typing import Any
+from typing import Any, Dict
 from unittest.mock import MagicMock, AsyncMock
 
 import pytest
+from fastapi import FastAPI
 from fastapi.encoders import jsonable_encoder
+from httpx import Headers, Response
+from starlette.testclient import TestClient
 
 from fastapi_metabot.client.api.metabot_api import AsyncMetabotApi
+from fastapi_metabot.client.api_client import SyncApis
+from fastapi_metabot.client.exceptions import UnexpectedResponse
+from fastapi_metabot.client.models import ModuleHeartbeat
 from fastapi_metabot.module import Module, Command
+from fastapi_metabot.utils import command_metadata
 
 
 def test_add_command(module: Module) -> None:
@@ -30,14 +38,15 @@ def test_add_command(module: Module) -> None:
         module.command(name, function=test, description=description)
 
 
-def test_add_converter(module: Module) -> None:
-    assert module._get_converter(int) == int  # noqa
+@pytest.mark.asyncio
+async def test_add_converter(module: Module) -> None:
+    assert await module._convert(int, '10') == 10  # noqa
 
     @module.converter(int)
     def convert_binary(binary_number: str) -> int:
         return int(binary_number, 2)
 
-    assert module._get_converter(int) == convert_binary  # noqa
+    assert await module._convert(int, '10') == 2  # noqa
 
     with pytest.raises(AssertionError):
         module.converter(int, converter=convert_binary)
@@ -123,6 +132,33 @@ async def test_execute_command(module: Module) -> None:
     mock.assert_called_once_with(arg='test')
 
 
+@pytest.mark.asyncio
+async def test_execute_command_in_thread(
+        module: Module,
+        test_command_metadata: Dict,
+) -> None:
+    name = 'test'
+    calls = []
+
+    @module.converter(int)
+    def convert_binary(binary_number: str) -> int:
+        calls.append(('converter', threading.current_thread()))
+        return int(binary_number, 2)
+
+    @module.command(name)
+    def func(arg: int) -> None:
+        metadata = command_metadata.get()
+        assert metadata is not None
+        calls.append((metadata.user_id, threading.current_thread(), arg))
+
+    await module.execute_command(name, {'arg': '101'})
+    (_, converter_thread), (user_id, command_thread, arg) = calls
+    assert converter_thread is not threading.main_thread()
+    assert command_thread is not threading.main_thread()
+    assert user_id == test_command_metadata['user_id']
+    assert arg == 5
+
+
 @pytest.mark.asyncio
 async def test_execute_command_async(module: Module) -> None:
     name = 'test'
@@ -206,6 +242,7 @@ def test_build_module_payload(module: Module) -> None:
         'name': module.name,
         'description': module.description,
         'url': module.module_url,
+        'endpoints': None,
         'commands': {
             command_name: {
                 'name': command_name,
@@ -234,6 +271,7 @@ def test_build_module_payload(module: Module) -> None:
 @pytest.mark.asyncio
 async def test_hearbeat(module: Module, monkeypatch) -> None:
     payload = module._build_module_payload()  # noqa
+    manifest_hash = module._hash_module_payload(payload)  # noqa
     mock_api = AsyncMock(name='register_module_api_modules_post')
 
     monkeypatch.setattr(
@@ -245,7 +283,112 @@ async def test_hearbeat(module: Module, monkeypatch) -> None:
     module._start_heartbeat()  # noqa
     assert isinstance(module._heartbeat, Task)  # noqa
     await sleep(0)
-    mock_api.assert_awaited_with(payload)
+    mock_api.assert_awaited_with(payload, manifest_hash)
 
     module._stop_heartbeat()  # noqa
     assert module._heartbeat is None  # noqa
+
+
+@pytest.mark.asyncio
+async def test_hearbeat_refresh(module: Module, monkeypatch) -> None:
+    module.heartbeat_delay = 0.01
+    payload = module._build_module_payload()  # noqa
+    manifest_hash = module._hash_module_payload(payload)  # noqa
+    mock_register = AsyncMock(name='register_module_api_modules_post')
+    mock_refresh = AsyncMock(
+        name='refresh_module_api_modules_module_name_heartbeat_post',
+        side_effect=[
+            None,
+            UnexpectedResponse(404, 'Not Found', b'', Headers()),
+            None,
+        ],
+    )
+
+    monkeypatch.setattr(
+        AsyncMetabotApi,
+        'register_module_api_modules_post',
+        mock_register
+    )
+    monkeypatch.setattr(
+        AsyncMetabotApi,
+        'refresh_module_api_modules_module_name_heartbeat_post',
+        mock_refresh
+    )
+
+    module._start_heartbeat()  # noqa
+    while mock_refresh.await_count < 3:
+        await sleep(0.01)
+    module._stop_heartbeat()  # noqa
+
+    mock_refresh.assert_awaited_with(
+        module.name,
+        ModuleHeartbeat(manifest_hash=manifest_hash, url=module.module_url),
+    )
+    # the initial registration and the one after the manifest was lost
+    assert mock_register.await_count == 2
+
+
+def test_hash_module_payload(module: Module) -> None:
+    payload = module._build_module_payload()  # noqa
+    manifest_hash = module._hash_module_payload(payload)  # noqa
+
+    module.module_url = 'http://replica:8000'
+    replica_payload = module._build_module_payload()  # noqa
+
+    module.action('action', function=lambda: None)
+    changed_payload = module._build_module_payload()  # noqa
+
+    assert manifest_hash == module._hash_module_payload(payload)  # noqa
+    assert manifest_hash == module._hash_module_payload(replica_payload)  # noqa
+    assert manifest_hash != module._hash_module_payload(changed_payload)  # noqa
+
+
+def test_client_lifecycle(app: FastAPI, module: Module) -> None:
+    assert module.metabot_client._async_client is None  # noqa
+
+    with TestClient(app):
+        async_client = module.metabot_client._async_client  # noqa
+        assert async_client is not None
+        assert module.metabot_client._sync_client is not None  # noqa
+        assert module.response_client._async_client is not None  # noqa
+
+    assert module.metabot_client._async_client is None  # noqa
+    assert module.metabot_client._sync_client is None  # noqa
+    assert module.response_client._async_client is None  # noqa
+    assert async_client.dispatch.is_closed
+
+
+def test_client_options() -> None:
+    module = Module(
+        name='example',
+        module_url='http://localhost:8000',
+        metabot_url='http://localhost:8000',
+        metabot_client_options={
+            'max_connections': 20,
+            'timeout': 60,
+            'connect_timeout': 1,
+            'http2': True,
+        },
+    )
+
+    client = module.metabot_client.async_client
+    assert client.dispatch.pool_limits.hard_limit == 20
+    assert client.dispatch.ssl.http2
+    assert client.timeout.read_timeout == 60
+    assert client.timeout.connect_timeout == 1
+
+
+def test_sync_api_uses_sync_client(module: Module) -> None:
+    client = module.metabot_client
+    client.sync_client.send = MagicMock(  # type: ignore
+        side_effect=lambda request: Response(
+            200, request=request, content=b'{"modules": {}}'
+        )
+    )
+
+    response = SyncApis(client).metabot_api.get_modules_api_modules_get()
+
+    assert response.modules == {}
+    request = client.sync_client.send.call_args[0][0]
+    assert request.url == 'http://localhost:8000/api/modules/'
+    assert client._async_client is None  # noqa
@@ -0,0 +1,106 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from unittest.mock import AsyncMock
+
+import pytest
+
+from fastapi_metabot.client.api.metabot_api import AsyncMetabotApi
+from fastapi_metabot.client.exceptions import (
+    ResponseHandlingException,
+    UnexpectedResponse,
+)
+from fastapi_metabot.client.models import SlackRequest, SlackResponse
+from fastapi_metabot.module import Module
+from fastapi_metabot.processes import ProcessRunner
+from fastapi_metabot.utils import (
+    get_current_user_id,
+    slack_request,
+    async_slack_request,
+)
+
+
+def sync_handler(text: str) -> Dict:
+    data = slack_request('chat_postMessage', {
+        'channel': get_current_user_id(),
+        'text': text,
+    })
+    return {'pid': os.getpid(), 'data': data}
+
+
+async def async_handler() -> Optional[int]:
+    try:
+        await async_slack_request('chat_postMessage', {'channel': 'missing'})
+    except UnexpectedResponse as e:
+        return e.status_code
+    except ResponseHandlingException:
+        return None
+    return 200
+
+
+@pytest.fixture
+async def process_runner() -> ProcessRunner:
+    runner = ProcessRunner(max_workers=1)
+    await runner.start()
+    yield runner
+    runner.stop()
+
+
+@pytest.mark.asyncio
+async def test_process_runner(
+        process_runner: ProcessRunner,
+        set_current_module: Module,
+        test_command_metadata: Dict,
+        monkeypatch
+) -> None:
+    mock_api = AsyncMock(
+        name='request_api_slack_post',
+        return_value=SlackResponse(data={'ok': True}),
+    )
+    monkeypatch.setattr(AsyncMetabotApi, 'request_api_slack_post', mock_api)
+
+    result = await process_runner.run(sync_handler, text='test')
+    assert result['pid'] != os.getpid()
+    assert result['data'] == {'ok': True}
+    mock_api.assert_awaited_once_with(SlackRequest(
+        method='chat_postMessage',
+        payload={'channel': test_command_metadata['user_id'], 'text': 'test'},
+    ))
+
+    mock_api.side_effect = UnexpectedResponse(404, 'Not Found', b'', {})
+    assert await process_runner.run(async_handler) == 404
+
+    # Any other error still gets back to the handler
+    mock_api.side_effect = RuntimeError('boom')
+    assert await process_runner.run(async_handler) is None
+
+
+@pytest.mark.asyncio
+async def test_process_runner_keeps_default_executor_free(
+        process_runner: ProcessRunner,
+        set_current_module: Module,
+        monkeypatch
+) -> None:
+    mock_api = AsyncMock(
+        name='request_api_slack_post',
+        return_value=SlackResponse(data={'ok': True}),
+    )
+    monkeypatch.setattr(AsyncMetabotApi, 'request_api_slack_post', mock_api)
+    loop = asyncio.get_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=1))
+
+    results = await asyncio.wait_for(asyncio.gather(*[
+        process_runner.run(sync_handler, text=str(i))
+        for i in range(3)
+    ]), timeout=30)
+    assert [x['data'] for x in results] == [{'ok': True}] * 3
+
+
+def test_process_executor(module: Module) -> None:
+    module.command('sync', executor='process', function=sync_handler)
+    module.view('async', executor='process', function=async_handler)
+    assert module._process_handlers == {sync_handler, async_handler}  # noqa
+
+    with pytest.raises(AssertionError):
+        module.action('test', executor='fork', function=sync_handler)
@@ -0,0 +1,99 @@
+import asyncio
+from time import monotonic
+
+import pytest
+from requests import Session
+
+from fastapi_metabot.models import ProfileRequest
+from fastapi_metabot.module import Module
+from fastapi_metabot.profiling import (
+    Profiler,
+    NOT_PROFILED,
+    to_collapsed,
+    to_speedscope,
+    WALL,
+    CPU,
+)
+
+TOKEN = 'secret'
+
+
+def busy(seconds: float) -> None:
+    deadline = monotonic() + seconds
+    while monotonic() < deadline:
+        pass
+
+
+def test_profiler() -> None:
+    profiler = Profiler()
+    assert profiler.profile(module='help', command='me') is NOT_PROFILED
+
+    profiler.start(ProfileRequest(command='me', interval=0.001))
+    assert profiler.profile(module='help', command='other') is NOT_PROFILED
+    with profiler.profile(module='help', command='me'):
+        assert profiler.profile(module='help', command='me') is NOT_PROFILED
+        busy(0.1)
+
+    status = profiler.session.status
+    assert (status.profiled, status.active, status.done) == (1, 0, True)
+    assert status.samples > 0
+    if (sampler := profiler.session.sampler) is not None:
+        sampler.join()
+
+    for mode in (WALL, CPU):
+        stacks = profiler.get_stacks(mode)
+        assert any('busy' in stack[-1] for stack in stacks)
+
+        name, weight = to_collapsed(stacks).splitlines()[0].rsplit(' ', 1)
+        assert name.startswith('MainThread;') and int(weight) >= 0
+
+        speedscope = to_speedscope(stacks, 'test')
+        profile, = speedscope['profiles']
+        assert len(profile['samples']) == len(profile['weights'])
+        assert profile['endValue'] == pytest.approx(sum(stacks.values()))
+
+
+def test_profile_disabled(module: Module, test_client: Session) -> None:
+    resp = test_client.post('/debug/profile', json={})
+    assert resp.status_code == 404
+    assert module.profiler.profile(command='test') is NOT_PROFILED
+
+
+def test_profile_command(
+        module: Module,
+        test_client: Session,
+) -> None:
+    module.profiling_token = TOKEN
+    headers = {'Authorization': f'Bearer {TOKEN}'}
+
+    @module.command('test')
+    async def profiled() -> None:
+        busy(0.1)
+
+    resp = test_client.post('/debug/profile', json={'command': 'test'})
+    assert resp.status_code == 403
+    resp = test_client.post(
+        '/debug/profile',
+        json={'command': 'test', 'interval': 0.001},
+        headers=headers,
+    )
+    assert resp.status_code == 200
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(module.execute_command('test', {}))
+    if (sampler := module.profiler.session.sampler) is not None:
+        sampler.join()
+
+    status = test_client.get('/debug/profile/status', headers=headers).json()
+    assert (status['profiled'], status['done']) == (1, True)
+
+    resp = test_client.get('/debug/profile', headers=headers)
+    assert resp.text == to_collapsed(module.profiler.get_stacks(WALL))
+    assert 'profiled' in resp.text
+
+    resp = test_client.get(
+        '/debug/profile',
+        params={'format': 'speedscope'},
+        headers=headers,
+    )
+    assert resp.json()['name'] == f'{module.name} wall'
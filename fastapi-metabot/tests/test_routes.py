@@ -1,15 +1,23 @@
+import asyncio
 from typing import Dict
 from unittest.mock import MagicMock
 
 from requests import Session
 
+from fastapi_metabot.jobs import (
+    VIEW_PRIORITY,
+    ACTION_PRIORITY,
+    COMMAND_PRIORITY,
+)
+from fastapi_metabot.models import JobStats
 from fastapi_metabot.module import Module
+from fastapi_metabot.utils import trace_context
 
 
 def test_commands_route(
         module: Module,
         test_client: Session,
-        mock_background_tasks: MagicMock,
+        mock_submit_job: MagicMock,
         test_command_metadata: Dict,
 ) -> None:
     name = 'test'
@@ -24,23 +32,25 @@ def test_commands_route(
         'metadata': test_command_metadata,
     })
     assert response.status_code == 200
-    mock_background_tasks.assert_called_once_with(
+    mock_submit_job.assert_called_once_with(
+        COMMAND_PRIORITY,
         module.execute_command,
         name,
-        args
+        args,
+        timeout=None,
     )
 
 
 def test_actions_route_action(
         module: Module,
         test_client: Session,
-        mock_background_tasks: MagicMock,
+        mock_submit_job: MagicMock,
         test_action_metadata: Dict,
 ) -> None:
     name = 'test'
     full_name = f'block_actions:{name}'
 
-    @module.action(name)
+    @module.action(name, timeout=5)
     async def func(arg: str) -> None:
         pass
 
@@ -48,16 +58,18 @@ def test_actions_route_action(
         'metadata': test_action_metadata,
     })
     assert response.status_code == 200
-    mock_background_tasks.assert_called_once_with(
+    mock_submit_job.assert_called_once_with(
+        ACTION_PRIORITY,
         module.execute_action,
-        full_name
+        full_name,
+        timeout=5,
     )
 
 
 def test_actions_route_view(
         module: Module,
         test_client: Session,
-        mock_background_tasks: MagicMock,
+        mock_submit_job: MagicMock,
         test_action_metadata: Dict,
 ) -> None:
     name = 'test'
@@ -71,12 +83,36 @@ def test_actions_route_view(
         'metadata': test_action_metadata,
     })
     assert response.status_code == 200
-    mock_background_tasks.assert_called_once_with(
+    mock_submit_job.assert_called_once_with(
+        VIEW_PRIORITY,
         module.execute_action,
-        full_name
+        full_name,
+        timeout=None,
     )
 
 
+def test_commands_route_queue_full_503(
+        module: Module,
+        test_client: Session,
+        test_command_metadata: Dict,
+        monkeypatch,
+) -> None:
+    mock = MagicMock(name='submit_command', side_effect=asyncio.QueueFull)
+    monkeypatch.setattr(module, 'submit_command', mock)
+
+    response = test_client.post('/commands/test', json={
+        'arguments': {},
+        'metadata': test_command_metadata,
+    })
+    assert response.status_code == 503
+
+
+def test_jobs_route(module: Module, test_client: Session) -> None:
+    response = test_client.get('/jobs')
+    assert response.status_code == 200
+    assert response.json() == JobStats().dict()
+
+
 def test_commands_route_empty_module_500(
         test_command_metadata: Dict,
         test_client: Session,
@@ -96,3 +132,53 @@ def test_actions_route_empty_module_500(
         'metadata': test_action_metadata,
     })
     assert response.status_code == 500
+
+
+def test_commands_route_trace_context(
+        module: Module,
+        test_client: Session,
+        mock_submit_job: MagicMock,
+        test_command_metadata: Dict,
+) -> None:
+    traceparent = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+    submitted_in = []
+    mock_submit_job.side_effect = lambda *args, **kwargs: (
+        submitted_in.append(trace_context.get())
+    )
+
+    @module.command('test')
+    async def func() -> None:
+        pass
+
+    response = test_client.post('/commands/test', json={
+        'arguments': {},
+        'metadata': test_command_metadata,
+    }, headers={'traceparent': traceparent})
+    assert response.status_code == 200
+    assert submitted_in == [traceparent]
+
+
+def test_actions_route_payload_trace_context(
+        module: Module,
+        test_client: Session,
+        mock_submit_job: MagicMock,
+        test_action_metadata: Dict,
+) -> None:
+    # Metabot sends the trace context in the payload as well,
+    # which is used when the header doesn't make it through
+    traceparent = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+    submitted_in = []
+    mock_submit_job.side_effect = lambda *args, **kwargs: (
+        submitted_in.append(trace_context.get())
+    )
+
+    @module.action('test')
+    async def func() -> None:
+        pass
+
+    response = test_client.post('/actions/block_actions:test', json={
+        'metadata': test_action_metadata,
+        'traceparent': traceparent,
+    })
+    assert response.status_code == 200
+    assert submitted_in == [traceparent]
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+from httpx import Request, Response
+
+from fastapi_metabot.module import Module
+from fastapi_metabot.tracing import SERVER, STATUS_ERROR, SpanExporter
+from fastapi_metabot.utils import trace_context
+
+TRACEPARENT = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+
+
+async def _echo_headers(request: Request) -> Response:
+    content = json.dumps(dict(request.headers)).encode('utf-8')
+    return Response(200, request=request, content=content)
+
+
+@pytest.mark.asyncio
+async def test_trace_context_middleware(module: Module) -> None:
+    request = Request('POST', 'http://metabot/api/slack/')
+    response = await module.metabot_client.middleware(request, _echo_headers)
+    assert 'traceparent' not in response.json()
+
+    token = trace_context.set(TRACEPARENT)
+    try:
+        response = await module.metabot_client.middleware(
+            Request('POST', 'http://metabot/api/slack/'),
+            _echo_headers,
+        )
+    finally:
+        trace_context.reset(token)
+    assert response.json()['traceparent'] == TRACEPARENT
+
+
+@pytest.mark.asyncio
+async def test_handler_span(module: Module, tmp_path) -> None:
+    module.span_exporter = SpanExporter(
+        service_name=module.name,
+        file_path=str(tmp_path / 'traces.json'),
+    )
+    handled_in = []
+
+    @module.command('test')
+    async def test() -> None:
+        handled_in.append(trace_context.get())
+
+    @module.action('fail')
+    async def fail() -> None:
+        raise ValueError
+
+    token = trace_context.set(TRACEPARENT)
+    try:
+        await module.execute_command('test', {})
+        with pytest.raises(ValueError):
+            await module.execute_action('block_actions:fail')
+    finally:
+        trace_context.reset(token)
+
+    span, failed = module.span_exporter._spans  # noqa
+    assert span.name == 'command example test'
+    assert span.kind == SERVER
+    assert span.traceparent.split('-')[1] == TRACEPARENT.split('-')[1]
+    assert span.parent_span_id == TRACEPARENT.split('-')[2]
+    # Requests to metabot made by the handler are children of its span
+    assert handled_in == [span.traceparent]
+    assert failed.status == STATUS_ERROR
+
+    await module.span_exporter.flush()
+    with open(module.span_exporter.file_path) as file:
+        resource = json.loads(file.readline())['resourceSpans'][0]['resource']
+    assert resource['attributes'] == [
+        {'key': 'service.name', 'value': {'stringValue': 'example'}},
+    ]
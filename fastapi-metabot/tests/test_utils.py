@@ -1,19 +1,26 @@
-from typing import Dict
+import json
+from typing import Dict, Any, AsyncGenerator
 from unittest.mock import MagicMock, AsyncMock
 
 import pytest
+from fastapi.encoders import jsonable_encoder
+from httpx import Request, Response
 
-from fastapi_metabot.client.api.metabot_api import (
-    SyncMetabotApi,
-    AsyncMetabotApi,
-)
-from fastapi_metabot.client.models import SlackRequest
+from fastapi_metabot.client.api.metabot_api import AsyncMetabotApi
+from fastapi_metabot.client.api_client import ApiClient
+from fastapi_metabot.client.exceptions import UnexpectedResponse
+from fastapi_metabot.client.models import SlackRequest, SlackResponse
 from fastapi_metabot.module import Module
 from fastapi_metabot.utils import (
     get_current_user_id,
     get_current_channel_id,
     slack_request,
     async_slack_request,
+    async_slack_paginate,
+    SlackPaginationError,
+    get_current_response_url,
+    respond,
+    async_respond,
 )
 
 
@@ -55,22 +62,114 @@ def test_get_current_channel_id_no_context() -> None:
     assert channel_id is None
 
 
+def test_get_current_response_url_command(
+        test_command_metadata: Dict,
+) -> None:
+    response_url = get_current_response_url()
+    assert response_url == test_command_metadata['response_url']
+
+
+def test_get_current_response_url_no_context() -> None:
+    response_url = get_current_response_url()
+    assert response_url is None
+
+
+def test_respond(
+        set_current_module: Module,
+        test_command_metadata: Dict,
+        monkeypatch
+) -> None:
+    response_url = test_command_metadata['response_url']
+    mock_post = MagicMock(
+        name='post',
+        return_value=Response(200, request=Request('POST', response_url)),
+    )
+    monkeypatch.setattr(
+        set_current_module.response_client.sync_client,
+        'post',
+        mock_post,
+    )
+
+    respond('test', in_channel=True, replace_original=True)
+    mock_post.assert_called_once_with(response_url, json={
+        'text': 'test',
+        'response_type': 'in_channel',
+        'replace_original': True,
+    })
+
+
+@pytest.mark.asyncio
+async def test_async_respond(
+        set_current_module: Module,
+        test_command_metadata: Dict,
+        monkeypatch
+) -> None:
+    response_url = test_command_metadata['response_url']
+    mock_post = AsyncMock(
+        name='post',
+        return_value=Response(200, request=Request('POST', response_url)),
+    )
+    monkeypatch.setattr(
+        set_current_module.response_client.async_client,
+        'post',
+        mock_post,
+    )
+
+    await async_respond(delete_original=True)
+    mock_post.assert_awaited_once_with(response_url, json={
+        'delete_original': True,
+    })
+
+    blocks = [{'type': 'divider'}]
+    mock_post.return_value = Response(
+        404,
+        request=Request('POST', response_url),
+        content=b'expired_url',
+    )
+    with pytest.raises(UnexpectedResponse):
+        await async_respond('test', blocks)
+    mock_post.assert_awaited_with(response_url, json={
+        'text': 'test',
+        'blocks': blocks,
+        'response_type': 'ephemeral',
+        'replace_original': False,
+    })
+
+    # Blocks don't need a fallback text
+    mock_post.return_value = Response(
+        200,
+        request=Request('POST', response_url),
+    )
+    await async_respond(blocks=blocks)
+    mock_post.assert_awaited_with(response_url, json={
+        'blocks': blocks,
+        'response_type': 'ephemeral',
+        'replace_original': False,
+    })
+
+
 def test_slack_request(set_current_module: Module, monkeypatch) -> None:
-    mock_api = MagicMock(name='request_api_slack_post')
+    mock_request = MagicMock(name='request_sync')
     monkeypatch.setattr(
-        SyncMetabotApi,
-        'request_api_slack_post',
-        mock_api
+        set_current_module.metabot_client,
+        'request_sync',
+        mock_request
     )
 
     method = 'chat_postMessage'
     payload = {'text': 'test', 'channel': '#general'}
 
     slack_request(method, payload)
-    mock_api.assert_called_once_with(SlackRequest(
-        method=method,
-        payload=payload,
-    ))
+    mock_request.assert_called_once_with(
+        type_=SlackResponse,
+        method='POST',
+        url='/api/slack/',
+        json=jsonable_encoder(SlackRequest(
+            method=method,
+            payload=payload,
+        )),
+        headers={},
+    )
 
 
 @pytest.mark.asyncio
@@ -93,3 +192,77 @@ async def test_async_slack_request(
         method=method,
         payload=payload,
     ))
+
+
+@pytest.mark.asyncio
+async def test_async_slack_request_refresh_cache(
+        set_current_module: Module,
+        monkeypatch
+) -> None:
+    mock_api = AsyncMock(name='request_api_slack_post')
+    monkeypatch.setattr(
+        AsyncMetabotApi,
+        'request_api_slack_post',
+        mock_api
+    )
+
+    await async_slack_request('users_info', {'user': 'U1'}, refresh_cache=True)
+    mock_api.assert_awaited_once_with(SlackRequest(
+        method='users_info',
+        payload={'user': 'U1'},
+        refresh_cache=True,
+    ))
+
+
+@pytest.mark.asyncio
+async def test_async_slack_paginate(
+        set_current_module: Module,
+        monkeypatch
+) -> None:
+    calls = []
+
+    async def mock_stream_lines(
+            _,
+            **kwargs: Any
+    ) -> AsyncGenerator[str, None]:
+        calls.append(kwargs)
+        for i in range(3):
+            yield json.dumps({'item': {'id': f'U{i}'}}) + '\n'
+        yield json.dumps({'status_code': 429, 'error': 'ratelimited'})
+
+    monkeypatch.setattr(ApiClient, 'stream_lines', mock_stream_lines)
+
+    items = []
+    async for item in async_slack_paginate('users_list', {}, limit=2):
+        items.append(item)
+        if len(items) == 2:
+            break
+    assert items == [{'id': 'U0'}, {'id': 'U1'}]
+    assert calls[0]['url'] == '/api/slack/paginate'
+    assert calls[0]['params'] == {'limit': 2}
+    assert calls[0]['json']['method'] == 'users_list'
+
+    with pytest.raises(SlackPaginationError) as e:
+        async for item in async_slack_paginate('users_list', {}):
+            pass
+    assert e.value.status_code == 429
+    assert e.value.error == 'ratelimited'
+
+
+@pytest.mark.asyncio
+async def test_async_slack_paginate_detail(
+        set_current_module: Module,
+        monkeypatch
+) -> None:
+    async def mock_stream_lines(
+            _,
+            **kwargs: Any
+    ) -> AsyncGenerator[str, None]:
+        yield json.dumps({'detail': 'invalid_cursor'})
+
+    monkeypatch.setattr(ApiClient, 'stream_lines', mock_stream_lines)
+
+    with pytest.raises(SlackPaginationError) as e:
+        async for item in async_slack_paginate('users_list', {}):
+            pass
+    assert e.value.error == 'invalid_cursor'
@@ -0,0 +1,348 @@
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import os
+import socket
+import subprocess  # noqa S404
+import sys
+from hashlib import sha256
+from time import monotonic, time, sleep
+from typing import Dict, List, Optional, Any
+from urllib.parse import urlencode
+
+from benchmarks.stubs import (
+    Server,
+    MODULE_NAME,
+    COMMAND_NAME,
+    ACTION_ID,
+    get_free_port,
+    get_manifest,
+    create_module_app,
+    create_slack_app,
+)
+from benchmarks.stats import (
+    Recorder,
+    Report,
+    format_report,
+    load_baseline,
+    save_baseline,
+    compare,
+)
+
+SIGNING_SECRET = 'benchmark'
+COMMANDS = 'commands'
+ACTIONS = 'actions'
+MIXED = 'mixed'
+BASELINES_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+
+log = logging.getLogger('benchmarks')
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Drive signed Slack requests through Metabot, a stub '
+                    'module and a stub Slack Web API, and report latency '
+                    'of every stage.',
+    )
+    parser.add_argument('--scenario', choices=(COMMANDS, ACTIONS, MIXED),
+                        default=MIXED)
+    parser.add_argument('--rate', type=float, default=50,
+                        help='Slack requests per second')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds of measured load')
+    parser.add_argument('--warmup', type=float, default=2,
+                        help='seconds of load before measuring')
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='seconds to wait for replies after the load')
+    parser.add_argument('--queue', action='store_true',
+                        help='dispatch through the Redis stream queue')
+    parser.add_argument('--slack-rate-limit-share', type=float,
+                        default=1000,
+                        help='multiplier of the Slack rate limits')
+    parser.add_argument('--redis-url',
+                        help='Redis to use, a new one is started otherwise')
+    parser.add_argument('--redis-server', default='redis-server',
+                        help='binary used to start Redis')
+    parser.add_argument('--baseline',
+                        help='defaults to baselines/<scenario>.json')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed p95 and p99 slowdown against the '
+                             'baseline, 0.25 is 25%%')
+    parser.add_argument('--min-delta', type=float, default=0.5,
+                        help='slowdowns of less milliseconds are ignored')
+    parser.add_argument('--output', help='also write the report to a file')
+    return parser.parse_args()
+
+
+def start_redis(binary: str) -> 'subprocess.Popen[bytes]':
+    # Registry and circuit breaker state live in Lua scripts,
+    # so an in-process fake can't stand in for Redis
+    port = get_free_port()
+    process = subprocess.Popen(  # noqa S603
+        [binary, '--port', str(port), '--save', '', '--appendonly', 'no'],
+        stdout=subprocess.DEVNULL,
+    )
+    os.environ['REDIS_URL'] = f'redis://127.0.0.1:{port}'
+
+    deadline = monotonic() + 5
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return process
+        except OSError:
+            if monotonic() > deadline or process.poll() is not None:
+                process.terminate()
+                raise RuntimeError(f'Failed to start {binary}')
+            sleep(0.05)
+
+
+def sign(body: bytes) -> Dict[str, str]:
+    timestamp = str(int(time()))
+    digest = hmac.new(
+        SIGNING_SECRET.encode('utf-8'),
+        f'v0:{timestamp}:'.encode('utf-8') + body,
+        sha256,
+    ).hexdigest()
+    return {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'X-Slack-Request-Timestamp': timestamp,
+        'X-Slack-Signature': f'v0={digest}',
+    }
+
+
+def command_body(request_id: str) -> bytes:
+    return urlencode({
+        'token': 'benchmark',
+        'command': '/meta',
+        'response_url': 'http://127.0.0.1/response',
+        'trigger_id': f'trigger.{request_id}',
+        'user_id': 'UBENCH',
+        'user_name': 'bench',
+        'team_id': 'TBENCH',
+        'channel_id': 'CBENCH',
+        'text': f'{MODULE_NAME} {COMMAND_NAME} {request_id}',
+    }).encode('utf-8')
+
+
+def action_body(request_id: str) -> bytes:
+    return urlencode({'payload': json.dumps({
+        'token': 'benchmark',
+        'type': 'block_actions',
+        'trigger_id': f'trigger.{request_id}',
+        'response_url': 'http://127.0.0.1/response',
+        'user': {'id': 'UBENCH'},
+        'channel': {'id': 'CBENCH'},
+        'actions': [{'action_id': ACTION_ID, 'value': request_id}],
+    })}).encode('utf-8')
+
+
+class LoadGenerator:
+    # Requests are sent on schedule whether or not earlier ones have been
+    # answered, so that a slow Metabot shows up as latency instead of
+    # as a lower request rate
+    metabot_url: str
+    scenario: str
+    recorder: Recorder
+    received_at: Dict[str, float]
+    sent_at: Dict[str, float]
+
+    def __init__(
+            self,
+            metabot_url: str,
+            scenario: str,
+            recorder: Recorder,
+            received_at: Dict[str, float],
+    ) -> None:
+        self.metabot_url = metabot_url
+        self.scenario = scenario
+        self.recorder = recorder
+        self.received_at = received_at
+        self.sent_at = {}
+
+    async def run(
+            self,
+            session: Any,
+            prefix: str,
+            rate: float,
+            duration: float,
+    ) -> None:
+        started_at = monotonic()
+        tasks: List[asyncio.Task] = []
+        for i in range(int(rate * duration)):
+            if (delay := started_at + i / rate - monotonic()) > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(
+                self._send(session, f'{prefix}{i}', self._kind(i)),
+            ))
+        await asyncio.gather(*tasks)
+
+    def _kind(self, i: int) -> str:
+        if self.scenario == MIXED:
+            return (COMMANDS, ACTIONS)[i % 2]
+        return self.scenario
+
+    async def _send(self, session: Any, request_id: str, kind: str) -> None:
+        body = (command_body if kind == COMMANDS else action_body)(request_id)
+        self.sent_at[request_id] = started_at = monotonic()
+        try:
+            async with session.post(
+                    f'{self.metabot_url}/slack/{kind}',
+                    data=body,
+                    headers=sign(body),
+            ) as resp:
+                await resp.read()
+                failed = resp.status != 200
+        except Exception:
+            log.exception('Slack request failed')
+            failed = True
+        self.recorder.record('slack_ingress', monotonic() - started_at)
+        if failed:
+            self.recorder.errors['slack_ingress'] += 1
+
+    async def wait_for_replies(self, timeout: float) -> None:
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            if all(x in self.received_at for x in self.sent_at):
+                break
+            await asyncio.sleep(0.05)
+
+        for request_id, sent_at in self.sent_at.items():
+            if (received_at := self.received_at.get(request_id)) is None:
+                self.recorder.errors['end_to_end'] += 1
+            else:
+                self.recorder.record('end_to_end', received_at - sent_at)
+        self.sent_at = {}
+
+
+def instrument(recorder: Recorder) -> None:
+    from metabot.api.routes.slack import SlackProxy
+    from metabot.lib.dispatchers import CommandDispatcher, ActionDispatcher
+    from metabot.lib.storage import Storage
+
+    recorder.instrument(CommandDispatcher, '_parse_payload', 'parse_payload')
+    recorder.instrument(Storage, 'get_module', 'storage_lookup')
+    recorder.instrument(Storage, 'get_modules_by_actions', 'storage_lookup')
+    recorder.instrument(CommandDispatcher, '_trigger_command', 'module_post')
+    recorder.instrument(ActionDispatcher, '_trigger_action', 'module_post')
+    recorder.instrument(SlackProxy, 'request', 'proxy_call')
+
+
+async def run(args: argparse.Namespace) -> Report:
+    from aiohttp import ClientSession, TCPConnector
+
+    from metabot.main import app
+
+    recorder = Recorder()
+    instrument(recorder)
+    received_at: Dict[str, float] = {}
+
+    slack = Server(create_slack_app(received_at))
+    metabot = Server(app)
+    module = Server(create_module_app(metabot.url))
+    servers = [slack, module, metabot]
+    try:
+        for server in servers:
+            await server.start()
+        app.state.slack.base_url = f'{slack.url}/api/'
+
+        async with ClientSession(connector=TCPConnector(limit=0)) as session:
+            async with session.post(
+                    f'{metabot.url}/api/modules/',
+                    json=get_manifest(module.url),
+            ) as resp:
+                resp.raise_for_status()
+
+            load = LoadGenerator(
+                metabot.url,
+                args.scenario,
+                recorder,
+                received_at,
+            )
+            if args.warmup:
+                await load.run(session, 'warmup', args.rate, args.warmup)
+                await load.wait_for_replies(args.timeout)
+                recorder.durations.clear()
+                recorder.errors.clear()
+
+            await load.run(session, '', args.rate, args.duration)
+            await load.wait_for_replies(args.timeout)
+    finally:
+        for server in reversed(servers):
+            await server.stop()
+        recorder.restore()
+
+    return recorder.report(args.duration)
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    # Settings are read by Metabot on import
+    os.environ['SLACK_SIGNING_SECRET'] = SIGNING_SECRET
+    os.environ['SLACK_API_TOKEN'] = 'xoxb-benchmark'
+    os.environ['DISPATCH_QUEUE'] = 'true' if args.queue else 'false'
+    # The stub Slack API has no rate limits, Metabot's own throttling
+    # would otherwise dominate every proxied request
+    os.environ['SLACK_RATE_LIMIT_SHARE'] = str(args.slack_rate_limit_share)
+    redis: Optional['subprocess.Popen[bytes]'] = None
+    if args.redis_url:
+        os.environ['REDIS_URL'] = args.redis_url
+    else:
+        redis = start_redis(args.redis_server)
+
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if redis is not None:
+            redis.terminate()
+            redis.wait()
+
+    print(format_report(report))  # noqa T001
+    settings = {
+        'scenario': args.scenario,
+        'rate': args.rate,
+        'duration': args.duration,
+        'queue': args.queue,
+        'slack_rate_limit_share': args.slack_rate_limit_share,
+    }
+    if args.output:
+        save_baseline(args.output, settings, report)
+
+    baseline_path = args.baseline or os.path.join(
+        BASELINES_DIR,
+        f'{args.scenario}.json',
+    )
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        save_baseline(baseline_path, settings, report)
+        print(f'Saved the baseline to {baseline_path}')  # noqa T001
+        return 0
+    if not os.path.exists(baseline_path):
+        return 0
+
+    baseline = load_baseline(baseline_path)
+    if baseline['settings'] != settings:
+        # Numbers of other settings aren't comparable
+        print(  # noqa T001
+            f'Baseline settings differ, not comparing: {baseline["settings"]}'
+        )
+        return 0
+    regressions = compare(
+        baseline['stages'],
+        report,
+        args.tolerance,
+        args.min_delta,
+    )
+    for regression in regressions:
+        print(f'Regression in {regression}')  # noqa T001
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
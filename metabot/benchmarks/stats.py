@@ -0,0 +1,131 @@
+import json
+from collections import defaultdict
+from functools import wraps
+from math import ceil
+from time import perf_counter
+from typing import DefaultDict, Dict, List, Any, Tuple, Callable
+
+PERCENTILES = (50, 95, 99)
+# Percentiles compared with the baseline
+COMPARED = ('p95', 'p99')
+
+Report = Dict[str, Dict[str, float]]
+
+
+def percentile(values: List[float], p: float) -> float:
+    # Nearest rank of sorted values
+    if not values:
+        return 0
+    return values[max(ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class Recorder:
+    durations: DefaultDict[str, List[float]]
+    errors: DefaultDict[str, int]
+
+    _patched: List[Tuple[Any, str, Callable]]
+
+    def __init__(self) -> None:
+        self.durations = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._patched = []
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.durations[stage].append(seconds)
+
+    def instrument(self, owner: Any, name: str, stage: str) -> None:
+        # Coroutine methods of the app are timed wherever they are called
+        original = getattr(owner, name)
+        recorder = self
+
+        @wraps(original)
+        async def timed(*args: Any, **kwargs: Any) -> Any:
+            started_at = perf_counter()
+            try:
+                return await original(*args, **kwargs)
+            except Exception:
+                recorder.errors[stage] += 1
+                raise
+            finally:
+                recorder.record(stage, perf_counter() - started_at)
+
+        setattr(owner, name, timed)
+        self._patched.append((owner, name, original))
+
+    def restore(self) -> None:
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+        self._patched = []
+
+    def report(self, elapsed: float) -> Report:
+        report = {}
+        for stage, durations in self.durations.items():
+            values = sorted(durations)
+            report[stage] = {
+                'count': len(values),
+                'errors': self.errors[stage],
+                'throughput': len(values) / elapsed if elapsed else 0,
+                **{
+                    f'p{p}': percentile(values, p) * 1000
+                    for p in PERCENTILES
+                },
+                'max': values[-1] * 1000 if values else 0,
+            }
+        return report
+
+
+def format_report(report: Report) -> str:
+    header = (
+        f'{"stage":<16} {"count":>7} {"errors":>6} {"req/s":>8} '
+        f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}'
+    )
+    lines = [header, '-' * len(header)]
+    for stage, x in sorted(report.items()):
+        lines.append(
+            f'{stage:<16} {x["count"]:>7.0f} {x["errors"]:>6.0f} '
+            f'{x["throughput"]:>8.1f} {x["p50"]:>8.2f} {x["p95"]:>8.2f} '
+            f'{x["p99"]:>8.2f} {x["max"]:>8.2f}'
+        )
+    return '\n'.join(lines)
+
+
+def load_baseline(path: str) -> Dict[str, Any]:
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_baseline(path: str, settings: Dict[str, Any], report: Report) -> None:
+    with open(path, 'w') as file:
+        json.dump({'settings': settings, 'stages': report}, file, indent=2)
+        file.write('\n')
+
+
+def compare(
+        baseline: Report,
+        report: Report,
+        tolerance: float,
+        min_delta: float = 0,
+) -> List[str]:
+    # Stages which got slower than the baseline allows, or went missing.
+    # Differences of less than min_delta milliseconds are noise.
+    regressions = []
+    for stage, expected in sorted(baseline.items()):
+        if (actual := report.get(stage)) is None:
+            regressions.append(f'{stage}: missing')
+            continue
+        for key in COMPARED:
+            limit = max(
+                expected[key] * (1 + tolerance),
+                expected[key] + min_delta,
+            )
+            if actual[key] > limit:
+                regressions.append(
+                    f'{stage}: {key} {actual[key]:.2f} ms, '
+                    f'baseline {expected[key]:.2f} ms'
+                )
+        if actual['errors'] > expected['errors']:
+            regressions.append(
+                f'{stage}: {actual["errors"]:.0f} errors, '
+                f'baseline {expected["errors"]:.0f}'
+            )
+    return regressions
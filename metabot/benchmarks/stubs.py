@@ -0,0 +1,154 @@
+import asyncio
+import json
+import socket
+from time import monotonic
+from typing import Dict, Set, Optional, Any
+from urllib.parse import parse_qs
+
+import uvicorn
+from aiohttp import ClientSession
+from fastapi import FastAPI
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+MODULE_NAME = 'bench'
+COMMAND_NAME = 'ping'
+ACTION_ID = 'bench_button'
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    # Serves an ASGI app on the running event loop
+    url: str
+
+    _server: uvicorn.Server
+    _task: Optional[asyncio.Task]
+
+    def __init__(self, app: Any, port: Optional[int] = None) -> None:
+        port = port or get_free_port()
+        self.url = f'http://127.0.0.1:{port}'
+        self._server = uvicorn.Server(uvicorn.Config(
+            app,
+            host='127.0.0.1',
+            port=port,
+            log_level='warning',
+            access_log=False,
+        ))
+        # Signals are left to the benchmark
+        self._server.install_signal_handlers = lambda: None  # type: ignore
+        self._task = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            if self._task.done():
+                self._task.result()
+                raise RuntimeError(f'Failed to start a server at {self.url}')
+            await asyncio.sleep(0.01)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._server.should_exit = True
+            await self._task
+            self._task = None
+
+
+def get_manifest(url: str) -> Dict[str, Any]:
+    return {
+        'name': MODULE_NAME,
+        'description': 'Benchmark module',
+        'url': url,
+        'commands': {
+            COMMAND_NAME: {
+                'name': COMMAND_NAME,
+                'description': 'Reply with the id',
+                'arguments': [{'name': 'id'}],
+            },
+        },
+        'actions': [f'block_actions:{ACTION_ID}'],
+    }
+
+
+def create_module_app(metabot_url: str) -> FastAPI:
+    # Acknowledges commands and actions right away, then replies through
+    # the Slack proxy of metabot with the id of the request, like
+    # fastapi_metabot modules do
+    app = FastAPI()
+    tasks: Set[asyncio.Task] = set()
+    session: Dict[str, ClientSession] = {}
+
+    @app.on_event('startup')
+    async def startup() -> None:
+        session['metabot'] = ClientSession()
+
+    @app.on_event('shutdown')
+    async def shutdown() -> None:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await session['metabot'].close()
+
+    async def reply(channel: str, text: str) -> None:
+        async with session['metabot'].post(f'{metabot_url}/api/slack/', json={
+            'method': 'chat_postMessage',
+            'payload': {'channel': channel, 'text': text},
+        }) as resp:
+            resp.raise_for_status()
+
+    def schedule_reply(channel: str, text: str) -> None:
+        task = asyncio.create_task(reply(channel, text))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    @app.post('/commands/{name}')
+    async def command(name: str, request: Request) -> Dict:
+        payload = await request.json()
+        schedule_reply(
+            payload['metadata']['channel_id'],
+            payload['arguments']['id'],
+        )
+        return {}
+
+    @app.post('/actions/{action_id}')
+    async def action(action_id: str, request: Request) -> Dict:
+        metadata = (await request.json())['metadata']
+        schedule_reply(
+            metadata['channel']['id'],
+            metadata['actions'][0]['value'],
+        )
+        return {}
+
+    return app
+
+
+def create_slack_app(received_at: Dict[str, float]) -> FastAPI:
+    # Answers every Web API method, and notes when the message
+    # of every request arrives
+    app = FastAPI()
+
+    @app.post('/api/{method}')
+    async def api(method: str, request: Request) -> JSONResponse:
+        body = await request.body()
+        if request.headers.get('content-type', '').startswith(
+                'application/json'
+        ):
+            payload = json.loads(body)
+        else:
+            payload = {
+                key: values[0]
+                for key, values in parse_qs(body.decode('utf-8')).items()
+            }
+        if text := payload.get('text'):
+            received_at[text] = monotonic()
+        return JSONResponse({
+            'ok': True,
+            'channel': payload.get('channel'),
+            'ts': f'{monotonic():.6f}',
+        })
+
+    return app
@@ -1,8 +1,10 @@
 from fastapi import APIRouter
 
-from metabot.api.routes import modules, slack
+from metabot.api.routes import modules, slack, pools, debug
 
 router = APIRouter()
 
 router.include_router(modules.router, prefix='/modules')
 router.include_router(slack.router, prefix='/slack')
+router.include_router(pools.router, prefix='/pools')
+router.include_router(debug.router, prefix='/debug')
@@ -0,0 +1,81 @@
+from typing import Optional, Union, Dict, Any
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi_metabot.loop_monitor import LoopMonitor
+from fastapi_metabot.models import LoopReport, ProfileRequest, ProfileStatus
+from fastapi_metabot.profiling import (
+    to_collapsed,
+    to_speedscope,
+    WALL,
+    CPU,
+    COLLAPSED,
+    SPEEDSCOPE,
+)
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+from metabot.lib.profiling import profiler, require_admin
+
+router = APIRouter()
+
+
+async def get_loop_monitor(request: Request) -> Optional[LoopMonitor]:
+    return request.app.state.loop_monitor
+
+
+# Stacks of slow callbacks give away the file system layout of metabot
+@router.get(
+    '/loop',
+    response_model=LoopReport,
+    dependencies=[Depends(require_admin)],
+)
+async def get_loop(
+        monitor: Optional[LoopMonitor] = Depends(get_loop_monitor),
+) -> LoopReport:
+    if monitor is None:
+        raise HTTPException(404, 'Loop monitor is disabled')
+    return monitor.get_report()
+
+
+@router.post(
+    '/profile',
+    response_model=ProfileStatus,
+    dependencies=[Depends(require_admin)],
+)
+async def start_profile(req: ProfileRequest) -> ProfileStatus:
+    return profiler.start(req)
+
+
+@router.get(
+    '/profile/status',
+    response_model=ProfileStatus,
+    dependencies=[Depends(require_admin)],
+)
+async def get_profile_status() -> ProfileStatus:
+    if profiler.session is None:
+        raise HTTPException(404, 'No profile has been started')
+    return profiler.session.status
+
+
+@router.get('/profile', dependencies=[Depends(require_admin)])
+async def get_profile(
+        format: str = Query(  # noqa A002
+            COLLAPSED,
+            regex=f'^({COLLAPSED}|{SPEEDSCOPE})$',
+        ),
+        mode: str = Query(WALL, regex=f'^({WALL}|{CPU})$'),
+) -> Union[PlainTextResponse, Dict[str, Any]]:
+    # Samples are served as soon as there are any,
+    # the status tells whether all requests have been profiled
+    if profiler.session is None:
+        raise HTTPException(404, 'No profile has been started')
+
+    stacks = profiler.get_stacks(mode)
+    if format == SPEEDSCOPE:
+        return to_speedscope(stacks, f'metabot {mode}')
+    return PlainTextResponse(to_collapsed(stacks))
+
+
+@router.delete('/profile', dependencies=[Depends(require_admin)])
+async def cancel_profile() -> None:
+    profiler.cancel()
@@ -0,0 +1,31 @@
+from typing import Dict
+
+from aiohttp import ClientSession
+from fastapi import APIRouter, Depends
+from starlette.responses import Response
+
+from metabot.lib.http import get_sessions, get_pool_stats
+from metabot.lib.metrics import (
+    CONTENT_TYPE,
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_LIMIT,
+    render_metrics,
+)
+
+router = APIRouter()
+
+
+@router.get('/metrics', include_in_schema=False)
+async def get_metrics(
+        sessions: Dict[str, ClientSession] = Depends(get_sessions),
+) -> Response:
+    # Pool usage is only sampled when scraped
+    for name, session in sessions.items():
+        stats = get_pool_stats(session)
+        HTTP_POOL_LIMIT.labels(pool=name).set(stats.limit)
+        for state in ('acquired', 'idle', 'waiting'):
+            HTTP_POOL_CONNECTIONS.labels(pool=name, state=state).set(
+                getattr(stats, state),
+            )
+
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
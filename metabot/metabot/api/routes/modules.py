@@ -1,10 +1,10 @@
-from typing import Dict
+from typing import Dict, Optional
 
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 
 from metabot.lib.storage import Storage, get_storage
-from metabot.models.module import SAMPLE_MODULE, Module
+from metabot.models.module import SAMPLE_MODULE, Module, ModuleHeartbeat
 
 router = APIRouter()
 
@@ -44,7 +44,28 @@ async def get_module_by_name(
 @router.post('/', response_model=Module)
 async def register_module(
         module: Module,
+        manifest_hash: Optional[str] = None,
         storage: Storage = Depends(get_storage),
 ) -> Module:
-    await storage.add_or_replace_module(module)
+    await storage.add_or_replace_module(module, manifest_hash)
     return module
+
+
+@router.post('/{module_name}/heartbeat', response_model=ModuleHeartbeat)
+async def refresh_module(
+        module_name: str,
+        heartbeat: ModuleHeartbeat,
+        storage: Storage = Depends(get_storage),
+) -> ModuleHeartbeat:
+    refreshed = await storage.refresh_module(
+        module_name,
+        heartbeat.manifest_hash,
+        heartbeat.url,
+    )
+    if not refreshed:
+        raise HTTPException(
+            status_code=404,
+            detail='Module not found or its manifest has changed',
+        )
+
+    return heartbeat
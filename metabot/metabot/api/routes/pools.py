@@ -0,0 +1,19 @@
+from typing import Dict
+
+from aiohttp import ClientSession
+from fastapi import APIRouter, Depends
+
+from metabot.lib.http import get_sessions, get_pool_stats
+from metabot.models.http import PoolStats
+
+router = APIRouter()
+
+
+@router.get('/', response_model=Dict[str, PoolStats])
+async def get_pools(
+        sessions: Dict[str, ClientSession] = Depends(get_sessions),
+) -> Dict[str, PoolStats]:
+    return {
+        name: get_pool_stats(session)
+        for name, session in sessions.items()
+    }
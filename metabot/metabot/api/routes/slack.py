@@ -1,11 +1,40 @@
-from typing import Dict
+import asyncio
+import json
+import logging
+from typing import Dict, AsyncIterator, Union, List, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 from slack import WebClient
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
 
-from metabot.lib.slack import slack_request, get_slack
-from metabot.models.slack import SlackRequest
+from metabot.core.config import SLACK_PAGE_SIZE
+from metabot.lib.cache import SlackCache, get_slack_cache
+from metabot.lib.metrics import (
+    track,
+    SLACK_PROXY_SECONDS,
+    SLACK_PROXY_IN_FLIGHT,
+    SLACK_PROXY_ERRORS,
+)
+from metabot.lib.scheduler import SlackScheduler, get_slack_scheduler
+from metabot.lib.singleflight import SingleFlight, get_slack_singleflight
+from metabot.lib.slack import (
+    READ_ONLY_METHODS,
+    PAGINATED_METHODS,
+    slack_request,
+    get_slack,
+    get_request_key,
+)
+from metabot.models.slack import (
+    SlackRequest,
+    SlackBucketStats,
+    SlackBatchRequest,
+    SlackBatchResult,
+    SlackBatchResponse,
+)
+
+log = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -14,10 +43,194 @@ class SlackResponse(BaseModel):
     data: Dict
 
 
+class SlackProxy:
+    slack: WebClient
+    scheduler: SlackScheduler
+    cache: SlackCache
+    singleflight: SingleFlight
+
+    def __init__(
+            self,
+            slack: WebClient = Depends(get_slack),
+            scheduler: SlackScheduler = Depends(get_slack_scheduler),
+            cache: SlackCache = Depends(get_slack_cache),
+            singleflight: SingleFlight = Depends(get_slack_singleflight),
+    ) -> None:
+        self.slack = slack
+        self.scheduler = scheduler
+        self.cache = cache
+        self.singleflight = singleflight
+
+    async def request(self, req: SlackRequest) -> Dict:
+        method = req.method.value
+        try:
+            with track(
+                    SLACK_PROXY_SECONDS,
+                    SLACK_PROXY_IN_FLIGHT,
+                    method=method,
+            ):
+                return await self._request(req)
+        except HTTPException as e:
+            SLACK_PROXY_ERRORS.labels(
+                method=method,
+                status_code=e.status_code,
+            ).inc()
+            raise
+
+    async def _request(self, req: SlackRequest) -> Dict:
+        if (data := await self.cache.get_response(req)) is not None:
+            return data
+
+        async def call() -> Dict:
+            response = await slack_request(self.slack, req, self.scheduler)
+            await self.cache.store_response(req, response.data)
+            return response.data
+
+        # Identical reads which arrive while the first one is still in
+        # flight, e.g. before it could be cached, share its Slack request
+        if req.method in READ_ONLY_METHODS:
+            return await self.singleflight.do(get_request_key(req), call)
+        return await call()
+
+    async def batch_request(self, req: SlackRequest) -> SlackBatchResult:
+        try:
+            data = await self.request(req)
+        except HTTPException as e:
+            return SlackBatchResult(status_code=e.status_code, error=e.detail)
+        except Exception:
+            # A single broken request shouldn't fail the rest of the batch
+            log.exception(f'Slack batch request {req.method.value} failed')
+            return SlackBatchResult(status_code=500, error='internal_error')
+        return SlackBatchResult(status_code=200, data=data)
+
+
 @router.post('/', response_model=SlackResponse)
 async def request(
         req: SlackRequest,
-        slack: WebClient = Depends(get_slack),
+        proxy: SlackProxy = Depends(),
 ) -> SlackResponse:
-    response = await slack_request(slack, req)
-    return SlackResponse(data=response.data)
+    return SlackResponse(data=await proxy.request(req))
+
+
+async def _stream_results(
+        request: Request,
+        tasks: 'List[asyncio.Task[SlackBatchResult]]',
+) -> AsyncIterator[str]:
+    # Requests which haven't finished by the time the client goes away
+    # are cancelled
+    try:
+        for task in tasks:
+            result = await task
+            yield result.json() + '\n'
+            if await request.is_disconnected():
+                return
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@router.post('/batch', response_model=SlackBatchResponse)
+async def batch(
+        batch_req: SlackBatchRequest,
+        request: Request,
+        stream: bool = False,
+        proxy: SlackProxy = Depends(),
+) -> Union[SlackBatchResponse, StreamingResponse]:
+    # All requests run concurrently, the scheduler keeps them within
+    # Slack rate limits
+    tasks = [
+        asyncio.create_task(proxy.batch_request(req))
+        for req in batch_req.requests
+    ]
+    if stream:
+        # Every result is sent as a separate line as soon as it and all
+        # the results before it are ready
+        return StreamingResponse(
+            _stream_results(request, tasks),
+            media_type='application/x-ndjson',
+        )
+    return SlackBatchResponse(results=await asyncio.gather(*tasks))
+
+
+def _page_request(
+        req: SlackRequest,
+        remaining: Optional[int],
+        cursor: Optional[str] = None,
+) -> SlackRequest:
+    payload = dict(req.payload)
+    if 'limit' not in payload:
+        payload['limit'] = min(SLACK_PAGE_SIZE, remaining or SLACK_PAGE_SIZE)
+    if cursor:
+        payload['cursor'] = cursor
+    return req.copy(update={'payload': payload})
+
+
+def _page_error(req: SlackRequest, e: Exception) -> Dict:
+    if isinstance(e, HTTPException):
+        return {'status_code': e.status_code, 'error': e.detail}
+    # Without the error line clients would take the items they've
+    # got so far for the complete listing
+    log.exception(f'Slack pagination {req.method.value} failed')
+    return {'status_code': 500, 'error': 'internal_error'}
+
+
+async def _stream_pages(
+        request: Request,
+        proxy: SlackProxy,
+        req: SlackRequest,
+        page: Dict,
+        limit: Optional[int],
+) -> AsyncIterator[str]:
+    items_key = PAGINATED_METHODS[req.method]
+    sent = 0
+    while True:
+        for item in page.get(items_key, []):
+            yield json.dumps({'item': item}) + '\n'
+            sent += 1
+            if limit is not None and sent >= limit:
+                return
+
+        metadata = page.get('response_metadata') or {}
+        if not (cursor := metadata.get('next_cursor')):
+            return
+        # Clients stop reading once they've got enough items,
+        # there's no point in fetching any more pages for them
+        if await request.is_disconnected():
+            return
+
+        remaining = limit - sent if limit is not None else None
+        try:
+            page = await proxy.request(_page_request(req, remaining, cursor))
+        except Exception as e:
+            # The response has already started, so the error goes last
+            yield json.dumps(_page_error(req, e)) + '\n'
+            return
+
+
+@router.post('/paginate')
+async def paginate(
+        req: SlackRequest,
+        request: Request,
+        limit: Optional[int] = Query(None, gt=0),
+        proxy: SlackProxy = Depends(),
+) -> StreamingResponse:
+    if req.method not in PAGINATED_METHODS:
+        raise HTTPException(422, f'{req.method.value} is not paginated')
+
+    # Errors of the first page still get their own status codes,
+    # Slack API errors get a 400 rather than Slack's 200
+    page = await proxy.request(_page_request(req, limit))
+    return StreamingResponse(
+        _stream_pages(request, proxy, req, page, limit),
+        media_type='application/x-ndjson',
+    )
+
+
+@router.get(
+    '/queues',
+    response_model=Dict[str, Dict[str, SlackBucketStats]],
+)
+async def get_queues(
+        scheduler: SlackScheduler = Depends(get_slack_scheduler),
+) -> Dict[str, Dict[str, SlackBucketStats]]:
+    return scheduler.get_stats()
@@ -1,4 +1,5 @@
 from starlette.config import Config
+from starlette.datastructures import CommaSeparatedStrings
 
 APP_TITLE = 'MetaBot'
 API_PREFIX = '/api'
@@ -9,8 +10,111 @@ config = Config('.env')
 SLACK_SIGNING_SECRET = config('SLACK_SIGNING_SECRET')
 SLACK_API_TOKEN = config('SLACK_API_TOKEN')
 REDIS_URL = config('REDIS_URL')
+SLACK_DEDUPLICATION_SECONDS = config(
+    'SLACK_DEDUPLICATION_SECONDS',
+    cast=int,
+    default=300,
+)
+SLACK_RATE_LIMIT_SHARE = config(
+    'SLACK_RATE_LIMIT_SHARE',
+    cast=float,
+    default=1,
+)
+SLACK_RATE_LIMIT_RETRIES = config(
+    'SLACK_RATE_LIMIT_RETRIES',
+    cast=int,
+    default=3,
+)
+SLACK_MAX_QUEUE_SECONDS = config(
+    'SLACK_MAX_QUEUE_SECONDS',
+    cast=float,
+    default=3,
+)
+SLACK_CACHE_TTLS = config(
+    'SLACK_CACHE_TTLS',
+    cast=CommaSeparatedStrings,
+    default='users_info=300, conversations_info=300, users_list=600, '
+            'team_info=3600, emoji_list=3600',
+)
+SLACK_CACHE_SIZE = config('SLACK_CACHE_SIZE', cast=int, default=1024)
+SLACK_BATCH_SIZE = config('SLACK_BATCH_SIZE', cast=int, default=1000)
+SLACK_PAGE_SIZE = config('SLACK_PAGE_SIZE', cast=int, default=200)
 MODULE_EXPIRATION_SECONDS = config(
     'MODULE_EXPIRATION_SECONDS',
     cast=int,
     default=30,
 )
+DISPATCH_BALANCER = config('DISPATCH_BALANCER', default='round_robin')
+DISPATCH_LIMIT = config('DISPATCH_LIMIT', cast=int, default=100)
+DISPATCH_LIMIT_PER_HOST = config(
+    'DISPATCH_LIMIT_PER_HOST',
+    cast=int,
+    default=20,
+)
+DISPATCH_KEEPALIVE_TIMEOUT = config(
+    'DISPATCH_KEEPALIVE_TIMEOUT',
+    cast=float,
+    default=30,
+)
+DISPATCH_CONNECT_TIMEOUT = config(
+    'DISPATCH_CONNECT_TIMEOUT',
+    cast=float,
+    default=2,
+)
+DISPATCH_READ_TIMEOUT = config('DISPATCH_READ_TIMEOUT', cast=float, default=5)
+DISPATCH_DNS_CACHE_TTL = config('DISPATCH_DNS_CACHE_TTL', cast=int, default=60)
+BREAKER_WINDOW_SECONDS = config(
+    'BREAKER_WINDOW_SECONDS',
+    cast=float,
+    default=30,
+)
+BREAKER_MIN_REQUESTS = config('BREAKER_MIN_REQUESTS', cast=int, default=5)
+BREAKER_ERROR_RATE = config('BREAKER_ERROR_RATE', cast=float, default=0.5)
+BREAKER_SLOW_CALL_SECONDS = config(
+    'BREAKER_SLOW_CALL_SECONDS',
+    cast=float,
+    default=3,
+)
+BREAKER_OPEN_SECONDS = config('BREAKER_OPEN_SECONDS', cast=float, default=30)
+DISPATCH_QUEUE = config('DISPATCH_QUEUE', cast=bool, default=False)
+DISPATCH_QUEUE_WORKERS = config(
+    'DISPATCH_QUEUE_WORKERS',
+    cast=int,
+    default=10,
+)
+DISPATCH_QUEUE_MAX_ATTEMPTS = config(
+    'DISPATCH_QUEUE_MAX_ATTEMPTS',
+    cast=int,
+    default=5,
+)
+DISPATCH_QUEUE_RETRY_DELAY = config(
+    'DISPATCH_QUEUE_RETRY_DELAY',
+    cast=float,
+    default=15,
+)
+DISPATCH_QUEUE_MAX_LENGTH = config(
+    'DISPATCH_QUEUE_MAX_LENGTH',
+    cast=int,
+    default=100000,
+)
+TRACING_FILE = config('TRACING_FILE', default='')
+TRACING_ENDPOINT = config('TRACING_ENDPOINT', default='')
+TRACING_EXPORT_INTERVAL = config(
+    'TRACING_EXPORT_INTERVAL',
+    cast=float,
+    default=5,
+)
+TRACING_BATCH_SIZE = config('TRACING_BATCH_SIZE', cast=int, default=512)
+LOOP_MONITOR = config('LOOP_MONITOR', cast=bool, default=False)
+LOOP_MONITOR_INTERVAL = config(
+    'LOOP_MONITOR_INTERVAL',
+    cast=float,
+    default=0.1,
+)
+LOOP_MONITOR_THRESHOLD = config(
+    'LOOP_MONITOR_THRESHOLD',
+    cast=float,
+    default=0.1,
+)
+LOOP_MONITOR_RECORDS = config('LOOP_MONITOR_RECORDS', cast=int, default=100)
+PROFILING_TOKEN = config('PROFILING_TOKEN', default='')
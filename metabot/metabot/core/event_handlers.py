@@ -5,48 +5,101 @@ from typing import Callable
 import aioredis
 from aiohttp import ClientSession
 from fastapi import FastAPI
+from fastapi_metabot.loop_monitor import LoopMonitor
 from slack import WebClient
 from slackers.hooks import commands, actions
 
-from metabot.core.config import SLACK_API_TOKEN, REDIS_URL
+from metabot.core.config import (
+    SLACK_API_TOKEN,
+    REDIS_URL,
+    DISPATCH_BALANCER,
+    DISPATCH_QUEUE,
+    LOOP_MONITOR,
+    LOOP_MONITOR_INTERVAL,
+    LOOP_MONITOR_THRESHOLD,
+    LOOP_MONITOR_RECORDS,
+)
+from metabot.lib.balancers import BALANCERS
+from metabot.lib.breakers import CircuitBreaker
+from metabot.lib.cache import SlackCache
 from metabot.lib.dispatchers import ActionDispatcher, CommandDispatcher
+from metabot.lib.http import create_dispatch_session
+from metabot.lib.metrics import EVENT_LOOP_LAG_SECONDS
+from metabot.lib.queues import DispatchQueue
+from metabot.lib.scheduler import SlackScheduler
+from metabot.lib.singleflight import SingleFlight
 from metabot.lib.storage import Storage
+from metabot.lib.tracing import exporter
 
 log = logging.getLogger(__name__)
 
 
 def start_app_handler(app: FastAPI) -> Callable:
     async def startup() -> None:
+        app.state.loop_monitor = None
+        if LOOP_MONITOR:
+            app.state.loop_monitor = LoopMonitor(
+                interval=LOOP_MONITOR_INTERVAL,
+                threshold=LOOP_MONITOR_THRESHOLD,
+                max_records=LOOP_MONITOR_RECORDS,
+                on_lag=EVENT_LOOP_LAG_SECONDS.observe,
+            )
+            await app.state.loop_monitor.start()
+        await exporter.start()
         app.state.session = ClientSession()
         app.state.slack = WebClient(
             token=SLACK_API_TOKEN,
             run_async=True,
             session=app.state.session,
         )
+        app.state.slack_scheduler = SlackScheduler()
+        app.state.slack_singleflight = SingleFlight()
+        app.state.dispatch_session = create_dispatch_session()
         app.state.redis = await aioredis.create_redis_pool(REDIS_URL)
+        app.state.slack_cache = SlackCache(app.state.redis)
         app.state.storage = Storage(app.state.redis)
+        await app.state.storage.start()
+        app.state.balancer = BALANCERS[DISPATCH_BALANCER]()
+        app.state.breaker = CircuitBreaker(app.state.redis)
 
         app.state.command_dispatcher = CommandDispatcher(app)
-        commands.on('meta', app.state.command_dispatcher.dispatch)
-
         app.state.action_dispatcher = ActionDispatcher(app)
+        dispatch_command = app.state.command_dispatcher.dispatch
+        dispatch_actions = app.state.action_dispatcher.dispatch
+
+        app.state.dispatch_queue = None
+        if DISPATCH_QUEUE:
+            app.state.dispatch_queue = DispatchQueue(app)
+            await app.state.dispatch_queue.start()
+            dispatch_command = app.state.dispatch_queue.enqueue_command
+            dispatch_actions = app.state.dispatch_queue.enqueue_actions
+
+        commands.on('meta', dispatch_command)
         for action in (
             'block_actions',
             'message_actions',
             'view_submission',
             'view_closed',
         ):
-            actions.on(action, app.state.action_dispatcher.dispatch)
+            actions.on(action, dispatch_actions)
 
     return startup
 
 
 def stop_app_handler(app: FastAPI) -> Callable:
     async def shutdown() -> None:
+        if app.state.dispatch_queue is not None:
+            await app.state.dispatch_queue.stop()
+        await app.state.storage.stop()
+
         app.state.redis.close()
         await app.state.redis.wait_closed()
 
         await app.state.session.close()
+        await app.state.dispatch_session.close()
+        await exporter.stop()
+        if app.state.loop_monitor is not None:
+            await app.state.loop_monitor.stop()
         # Wait 250 ms for the underlying SSL connections to close
         await asyncio.sleep(0.250)
 
@@ -0,0 +1,101 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import count
+from time import monotonic
+from typing import Dict, Iterator, List, Type, DefaultDict
+
+from metabot.core.config import DISPATCH_READ_TIMEOUT
+from metabot.models.module import Module
+
+
+class Balancer(ABC):
+    # Latency recorded for failed requests at the least
+    failure_latency: float = DISPATCH_READ_TIMEOUT
+    in_flight: Dict[str, int]
+
+    def __init__(self) -> None:
+        self.in_flight = {}
+
+    @abstractmethod
+    def choose(self, module: Module) -> str:
+        pass
+
+    def observe(self, endpoint: str, elapsed: float) -> None:
+        pass
+
+    @contextmanager
+    def endpoint(self, module: Module) -> Iterator[str]:
+        endpoint = self.choose(module)
+        self.in_flight[endpoint] = self.in_flight.get(endpoint, 0) + 1
+        started_at = monotonic()
+        failed = False
+        try:
+            yield endpoint
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.in_flight[endpoint] -= 1
+            if not self.in_flight[endpoint]:
+                del self.in_flight[endpoint]
+            elapsed = monotonic() - started_at
+            if failed:
+                # Replicas which refuse connections fail quickly,
+                # that shouldn't make them look like the fastest ones
+                elapsed = max(elapsed, self.failure_latency)
+            self.observe(endpoint, elapsed)
+
+
+class RoundRobinBalancer(Balancer):
+    _counters: DefaultDict[str, Iterator[int]]
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._counters = defaultdict(count)
+
+    def _rotated(self, module: Module) -> List[str]:
+        endpoints = module.endpoints or [module.url]
+        shift = next(self._counters[module.name]) % len(endpoints)
+        return endpoints[shift:] + endpoints[:shift]
+
+    def choose(self, module: Module) -> str:
+        return self._rotated(module)[0]
+
+
+class LeastInFlightBalancer(RoundRobinBalancer):
+    def choose(self, module: Module) -> str:
+        # Ties are broken in round-robin order
+        return min(
+            self._rotated(module),
+            key=lambda x: self.in_flight.get(x, 0),
+        )
+
+
+class EwmaLatencyBalancer(RoundRobinBalancer):
+    alpha: float = 0.3
+    latency: Dict[str, float]
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.latency = {}
+
+    def _cost(self, endpoint: str) -> float:
+        # Endpoints without any latency yet are tried first, busy endpoints
+        # are penalized until their requests finish
+        latency = self.latency.get(endpoint, 0)
+        return latency * (self.in_flight.get(endpoint, 0) + 1)
+
+    def choose(self, module: Module) -> str:
+        return min(self._rotated(module), key=self._cost)
+
+    def observe(self, endpoint: str, elapsed: float) -> None:
+        latency = self.latency.get(endpoint, elapsed)
+        self.latency[endpoint] = latency + self.alpha * (elapsed - latency)
+
+
+BALANCERS: Dict[str, Type[Balancer]] = {
+    'round_robin': RoundRobinBalancer,
+    'least_in_flight': LeastInFlightBalancer,
+    'ewma_latency': EwmaLatencyBalancer,
+}
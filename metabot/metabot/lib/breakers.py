@@ -0,0 +1,149 @@
+import logging
+from time import time
+
+from aioredis import Redis, RedisError
+
+from metabot.core.config import (
+    BREAKER_WINDOW_SECONDS,
+    BREAKER_MIN_REQUESTS,
+    BREAKER_ERROR_RATE,
+    BREAKER_SLOW_CALL_SECONDS,
+    BREAKER_OPEN_SECONDS,
+)
+from metabot.lib.lua import LuaScript
+
+log = logging.getLogger(__name__)
+
+BREAKER_KEY_PREFIX = 'breaker:'
+
+# Every module has a breaker hash, shared by all Metabot replicas. It holds
+# the breaker state (closed, open or half_open), the request and failure
+# counters of the current window and the deadline of the open state or of
+# the half-open probe. A missing hash is a closed breaker.
+
+# ARGV: now, open seconds
+# Returns 1 if the request may go through. Once the breaker has been open
+# for long enough, a single probe request is let through and the breaker
+# becomes half-open. If the probe never reports back, another one is let
+# through after the same delay.
+ALLOW_REQUEST = LuaScript("""
+local state = redis.call('HGET', KEYS[1], 'state')
+if not state or state == 'closed' then
+    return 1
+end
+local now = tonumber(ARGV[1])
+if tonumber(redis.call('HGET', KEYS[1], 'until')) > now then
+    return 0
+end
+redis.call(
+    'HSET', KEYS[1],
+    'state', 'half_open',
+    'until', now + tonumber(ARGV[2])
+)
+return 1
+""")
+
+# ARGV: now, 1 if the request has failed and 0 otherwise, window seconds,
+# minimum requests, error rate, open seconds
+# Returns the new breaker state
+RECORD_RESULT = LuaScript("""
+local now = tonumber(ARGV[1])
+local failed = tonumber(ARGV[2])
+local open_seconds = tonumber(ARGV[6])
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+
+local function open()
+    redis.call('DEL', KEYS[1])
+    redis.call(
+        'HSET', KEYS[1],
+        'state', 'open',
+        'until', now + open_seconds
+    )
+    return 'open'
+end
+
+if state == 'half_open' then
+    if failed == 1 then
+        state = open()
+    else
+        redis.call('DEL', KEYS[1])
+        return 'closed'
+    end
+elseif state == 'closed' then
+    local window_start = tonumber(redis.call('HGET', KEYS[1], 'window_start'))
+    if not window_start or now - window_start >= tonumber(ARGV[3]) then
+        redis.call(
+            'HSET', KEYS[1],
+            'state', 'closed',
+            'window_start', now,
+            'requests', 0,
+            'failures', 0
+        )
+    end
+    local requests = redis.call('HINCRBY', KEYS[1], 'requests', 1)
+    local failures = redis.call('HINCRBY', KEYS[1], 'failures', failed)
+    if requests >= tonumber(ARGV[4])
+            and failures / requests >= tonumber(ARGV[5]) then
+        state = open()
+    end
+end
+
+-- Breakers of modules which are no longer used disappear on their own
+redis.call(
+    'EXPIRE', KEYS[1],
+    math.ceil(tonumber(ARGV[3]) + 2 * open_seconds)
+)
+return state
+""")
+
+
+class CircuitBreaker:
+    redis: Redis
+
+    def __init__(self, redis: Redis) -> None:
+        self.redis = redis
+
+    @staticmethod
+    def _key(module_name: str) -> str:
+        return BREAKER_KEY_PREFIX + module_name
+
+    async def allow(self, module_name: str) -> bool:
+        # The breaker fails open, Redis being down shouldn't take down
+        # every module with it
+        try:
+            return bool(await ALLOW_REQUEST(
+                self.redis,
+                keys=[self._key(module_name)],
+                args=[time(), BREAKER_OPEN_SECONDS],
+            ))
+        except RedisError:
+            log.exception(f'Failed to check the breaker of {module_name}')
+            return True
+
+    async def record(
+            self,
+            module_name: str,
+            elapsed: float,
+            failed: bool = False,
+    ) -> None:
+        # Slow requests hold on to connections just like failed ones do
+        failed = failed or elapsed >= BREAKER_SLOW_CALL_SECONDS
+        try:
+            state = await RECORD_RESULT(
+                self.redis,
+                keys=[self._key(module_name)],
+                args=[
+                    time(),
+                    int(failed),
+                    BREAKER_WINDOW_SECONDS,
+                    BREAKER_MIN_REQUESTS,
+                    BREAKER_ERROR_RATE,
+                    BREAKER_OPEN_SECONDS,
+                ],
+            )
+        except RedisError:
+            log.exception(f'Failed to update the breaker of {module_name}')
+            return
+
+        if failed and state == b'open':
+            log.warning(f'Breaker of {module_name} is open')
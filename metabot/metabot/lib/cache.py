@@ -0,0 +1,105 @@
+import json
+import logging
+from collections import OrderedDict
+from time import time
+from typing import Dict, Optional, Tuple, Any
+
+from aioredis import Redis, RedisError
+from starlette.requests import Request
+
+from metabot.core.config import SLACK_CACHE_TTLS, SLACK_CACHE_SIZE
+from metabot.lib.slack import get_request_key
+from metabot.models.slack import SlackRequest, SlackMethod
+
+log = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = 'slack:cache:'
+
+# Read-only Slack methods whose responses are cached, along with their TTLs
+CACHE_TTLS: Dict[SlackMethod, int] = {
+    SlackMethod(method): int(ttl)
+    for method, ttl in (x.split('=') for x in SLACK_CACHE_TTLS)
+}
+
+
+async def get_slack_cache(request: Request) -> 'SlackCache':
+    return request.app.state.slack_cache
+
+
+class SlackCache:
+    redis: Redis
+
+    # Least recently used entries go first,
+    # cache key -> (expiration timestamp, response data)
+    _local: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]'
+
+    def __init__(self, redis: Redis) -> None:
+        self.redis = redis
+        self._local = OrderedDict()
+
+    def _get_local(self, key: str) -> Optional[Dict[str, Any]]:
+        if cached := self._local.get(key):
+            expires_at, data = cached
+            if expires_at > time():
+                self._local.move_to_end(key)
+                return data
+            del self._local[key]
+        return None
+
+    def _set_local(
+            self,
+            key: str,
+            expires_at: float,
+            data: Dict[str, Any],
+    ) -> None:
+        self._local[key] = (expires_at, data)
+        self._local.move_to_end(key)
+        while len(self._local) > SLACK_CACHE_SIZE:
+            self._local.popitem(last=False)
+
+    async def get_response(
+            self,
+            req: SlackRequest,
+    ) -> Optional[Dict[str, Any]]:
+        if req.method not in CACHE_TTLS:
+            return None
+        if req.bypass_cache or req.refresh_cache:
+            return None
+
+        key = CACHE_KEY_PREFIX + get_request_key(req)
+        if (data := self._get_local(key)) is not None:
+            return data
+
+        try:
+            raw = await self.redis.get(key)
+        except RedisError:
+            log.exception('Failed to get a cached Slack response')
+            return None
+        if raw is None:
+            return None
+
+        # Entries keep their expiration timestamp,
+        # so that the local copy doesn't outlive the shared one
+        expires_at, data = json.loads(raw)
+        self._set_local(key, expires_at, data)
+        return data
+
+    async def store_response(
+            self,
+            req: SlackRequest,
+            data: Dict[str, Any],
+    ) -> None:
+        if (ttl := CACHE_TTLS.get(req.method)) is None or req.bypass_cache:
+            return
+
+        key = CACHE_KEY_PREFIX + get_request_key(req)
+        expires_at = time() + ttl
+        self._set_local(key, expires_at, data)
+        try:
+            await self.redis.set(
+                key,
+                json.dumps([expires_at, data]),
+                expire=ttl,
+            )
+        except RedisError:
+            log.exception('Failed to cache a Slack response')
@@ -0,0 +1,63 @@
+import logging
+from hashlib import sha256
+from typing import Optional
+
+from aioredis import RedisError
+from fastapi import Depends, Header
+from slackers.verification import verify_signature, check_timeout
+from starlette.requests import Request
+from starlette.responses import Response
+
+from metabot.core.config import SLACK_DEDUPLICATION_SECONDS
+
+log = logging.getLogger(__name__)
+
+DEDUPLICATION_KEY_PREFIX = 'slack:requests:'
+
+
+class DuplicateSlackRequest(Exception):
+    pass
+
+
+async def deduplicate_slack_request(
+        request: Request,
+        x_slack_retry_num: Optional[int] = Header(None),
+        x_slack_retry_reason: Optional[str] = Header(None),
+        _signature: None = Depends(verify_signature),
+        _timeout: None = Depends(check_timeout),
+) -> None:
+    # Slack retries requests which weren't acknowledged in time with the
+    # very same body, which includes the trigger id of interactions.
+    # Only signed requests are remembered, so that nobody else can make
+    # Metabot drop them.
+    if not SLACK_DEDUPLICATION_SECONDS:
+        return
+
+    body = await request.body()
+    key = DEDUPLICATION_KEY_PREFIX + sha256(body).hexdigest()
+    try:
+        is_new = await request.app.state.redis.set(
+            key,
+            x_slack_retry_num or 0,
+            expire=SLACK_DEDUPLICATION_SECONDS,
+            exist=request.app.state.redis.SET_IF_NOT_EXIST,
+        )
+    except RedisError:
+        # Handling a request twice is better than not handling it at all
+        log.exception('Failed to deduplicate a Slack request')
+        return
+
+    if not is_new:
+        log.info(
+            f'Dropping a duplicate Slack request to {request.url.path} '
+            f'(retry {x_slack_retry_num}, reason {x_slack_retry_reason})'
+        )
+        raise DuplicateSlackRequest
+
+
+async def duplicate_slack_request_handler(
+        request: Request,
+        exc: DuplicateSlackRequest,
+) -> Response:
+    # Slack only needs to know that the original request has been received
+    return Response()
@@ -1,14 +1,27 @@
 import asyncio
 import logging
 from shlex import split
-from typing import Dict, Tuple, List, Iterable, Any, Set
+from time import monotonic, time
+from typing import Dict, Tuple, List, Iterable, Any, Set, Optional
 
 from aiohttp import ClientSession, ClientError
 from fastapi import FastAPI
 from slack import WebClient
+from slack.errors import SlackApiError
 
+from metabot.lib.balancers import Balancer
+from metabot.lib.breakers import CircuitBreaker
+from metabot.lib.metrics import (
+    track_since,
+    DISPATCH_SECONDS,
+    DISPATCH_IN_FLIGHT,
+)
+from metabot.lib.profiling import profiler
+from metabot.lib.scheduler import SlackScheduler, SlackQueueTimeout
 from metabot.lib.storage import Storage
+from metabot.lib.tracing import start_span, inject_headers, CLIENT
 from metabot.models.module import Module, Command
+from metabot.models.slack import SlackMethod
 
 log = logging.getLogger(__name__)
 
@@ -16,12 +29,33 @@ log = logging.getLogger(__name__)
 class ActionDispatcher:
     session: ClientSession
     storage: Storage
+    balancer: Balancer
 
     def __init__(self, app: FastAPI) -> None:
-        self.session = app.state.session
+        self.session = app.state.dispatch_session
         self.storage = app.state.storage
+        self.balancer = app.state.balancer
 
     async def dispatch(self, payload: Dict[str, Any]) -> None:
+        await self._trigger_all_actions(
+            self.get_action_ids(payload),
+            payload,
+            time(),
+        )
+
+    async def deliver(
+            self,
+            action_id: str,
+            payload: Dict[str, Any],
+            received_at: Optional[float] = None,
+    ) -> None:
+        if received_at is None:
+            received_at = time()
+        if module := await self.storage.get_module_by_action(action_id):
+            await self._trigger_action(module, action_id, payload, received_at)
+
+    @staticmethod
+    def get_action_ids(payload: Dict[str, Any]) -> Set[str]:
         action_ids = set()
 
         if actions := payload.get('actions'):
@@ -37,65 +71,147 @@ class ActionDispatcher:
             if view_callback_id := view.get("callback_id"):
                 action_ids.add(f'{payload["type"]}:{view_callback_id}')
 
-        await self._trigger_all_actions(action_ids, payload)
+        return action_ids
 
     async def _trigger_all_actions(
             self,
             action_ids: Set[str],
             payload: Dict[str, Any],
+            received_at: float,
     ) -> None:
-        futures = []
-        for action_id in action_ids:
-            module = await self.storage.get_module_by_action(action_id)
-            if module is not None:
-                futures.append(
-                    self._trigger_action(module, action_id, payload)
-                )
-        await asyncio.gather(*futures)
+        modules = await self.storage.get_modules_by_actions(action_ids)
+        await asyncio.gather(*(
+            self._trigger_action(module, action_id, payload, received_at)
+            for action_id, module in modules.items()
+        ))
 
     async def _trigger_action(
             self,
             module: Module,
             action_id: str,
-            metadata: Dict[str, Any]
+            metadata: Dict[str, Any],
+            received_at: float,
     ) -> None:
-        payload = {
+        payload: Dict[str, Any] = {
             'metadata': metadata,
         }
-        url = f'{module.url}/actions/{action_id}'
-        async with self.session.post(url, json=payload) as resp:
-            resp.raise_for_status()
+        metric_labels = {
+            'kind': 'action',
+            'module': module.name,
+            'name': action_id,
+        }
+        with track_since(
+                DISPATCH_SECONDS,
+                received_at,
+                **metric_labels,
+        ), profiler.profile(module=module.name, action=action_id):
+            in_flight = DISPATCH_IN_FLIGHT.labels(**metric_labels)
+            with in_flight.track_inprogress(), start_span(
+                    f'action {action_id}',
+                    CLIENT,
+                    **{'metabot.module': module.name},
+            ) as span:
+                # The trace context goes along in the payload as well,
+                # in case proxies in between drop the header
+                payload['traceparent'] = span.traceparent
+                with self.balancer.endpoint(module) as endpoint:
+                    url = f'{endpoint}/actions/{action_id}'
+                    async with self.session.post(
+                            url,
+                            json=payload,
+                            headers=inject_headers(),
+                    ) as resp:
+                        span.attributes['http.status_code'] = resp.status
+                        resp.raise_for_status()
 
 
 class CommandDispatcher:
     session: ClientSession
     slack: WebClient
+    slack_scheduler: SlackScheduler
     storage: Storage
+    balancer: Balancer
+    breaker: CircuitBreaker
 
     def __init__(self, app: FastAPI) -> None:
-        self.session = app.state.session
+        self.session = app.state.dispatch_session
         self.slack = app.state.slack
+        self.slack_scheduler = app.state.slack_scheduler
         self.storage = app.state.storage
+        self.balancer = app.state.balancer
+        self.breaker = app.state.breaker
 
     async def dispatch(self, payload: Dict[str, str]) -> None:
+        try:
+            await self.deliver(payload)
+        except (ClientError, asyncio.TimeoutError):
+            log.exception('Module request failed')
+            await self.fail(payload)
+
+    async def deliver(
+            self,
+            payload: Dict[str, str],
+            received_at: Optional[float] = None,
+    ) -> None:
+        # The latency of commands covers their lookup, the circuit breaker
+        # and the time spent in the dispatch queue, if any
+        with track_since(
+                DISPATCH_SECONDS,
+                received_at,
+                kind='command',
+                module='',
+                name='',
+        ) as metric_labels:
+            await self._deliver(payload, metric_labels)
+
+    async def _deliver(
+            self,
+            payload: Dict[str, str],
+            metric_labels: Dict[str, str],
+    ) -> None:
         try:
             module, command, arguments = await self._parse_payload(payload)
         except ValueError as e:
+            metric_labels['outcome'] = 'invalid'
             return await self._error(
                 payload,
                 str(e)
             )
 
-        try:
-            await self._trigger_command(module, command, arguments, payload)
-        except ClientError:
-            log.exception('Module request failed')
-            await self._error(
+        metric_labels.update(module=module.name, name=command.name)
+        if not await self.breaker.allow(module.name):
+            metric_labels['outcome'] = 'unavailable'
+            return await self._error(
                 payload,
-                'Command execution failed. '
-                'Please consult with the administrator.'
+                f'Module `{module.name}` is unavailable at the moment. '
+                'Please try again later.'
             )
 
+        with profiler.profile(module=module.name, command=command.name):
+            started_at = monotonic()
+            try:
+                await self._trigger_command(
+                    module,
+                    command,
+                    arguments,
+                    payload,
+                )
+            except (ClientError, asyncio.TimeoutError):
+                await self.breaker.record(
+                    module.name,
+                    monotonic() - started_at,
+                    failed=True,
+                )
+                raise
+            await self.breaker.record(module.name, monotonic() - started_at)
+
+    async def fail(self, payload: Dict[str, str]) -> None:
+        await self._error(
+            payload,
+            'Command execution failed. '
+            'Please consult with the administrator.'
+        )
+
     async def _parse_payload(
             self,
             payload: Dict[str, str],
@@ -149,16 +265,38 @@ class CommandDispatcher:
             arguments: List[str],
             metadata: Dict[str, str],
     ) -> None:
-        payload = {
+        payload: Dict[str, Any] = {
             'arguments': {
                 arg.name: value
                 for arg, value in zip(command.arguments, arguments)
             },
             'metadata': metadata,
         }
-        url = f'{module.url}/commands/{command.name}'
-        async with self.session.post(url, json=payload) as resp:
-            resp.raise_for_status()
+        in_flight = DISPATCH_IN_FLIGHT.labels(
+            kind='command',
+            module=module.name,
+            name=command.name,
+        )
+        with in_flight.track_inprogress():
+            with start_span(
+                    f'command {module.name} {command.name}',
+                    CLIENT,
+                    **{
+                        'metabot.module': module.name,
+                        'slack.user_id': metadata.get('user_id', ''),
+                        'slack.channel_id': metadata.get('channel_id', ''),
+                    },
+            ) as span:
+                payload['traceparent'] = span.traceparent
+                with self.balancer.endpoint(module) as endpoint:
+                    url = f'{endpoint}/commands/{command.name}'
+                    async with self.session.post(
+                            url,
+                            json=payload,
+                            headers=inject_headers(),
+                    ) as resp:
+                        span.attributes['http.status_code'] = resp.status
+                        resp.raise_for_status()
 
     async def _error(self, payload: Dict[str, str], message: str) -> None:
         channel = payload['channel_id']
@@ -167,11 +305,25 @@ class CommandDispatcher:
             f'Error triggered by user {user} in channel {channel}. '
             f'Sending ephemeral error message: {message}'
         )
-        await self.slack.chat_postEphemeral(
-            channel=channel,
-            user=user,
-            text=message,
-        )
+        try:
+            await self.slack_scheduler.request(
+                self.slack,
+                SlackMethod.CHAT_POSTEPHEMERAL,
+                {
+                    'channel': channel,
+                    'user': user,
+                    'text': message,
+                },
+            )
+        except (
+                SlackApiError,
+                SlackQueueTimeout,
+                ClientError,
+                asyncio.TimeoutError,
+        ):
+            # The command has been handled either way, failing it would
+            # only make queued commands send the error message again
+            log.exception('Failed to send the error message')
 
     @staticmethod
     def _format_strings(strings: Iterable[str]) -> str:
@@ -0,0 +1,65 @@
+from collections import defaultdict
+from typing import DefaultDict, Dict
+
+from aiohttp import ClientSession, TCPConnector, ClientTimeout
+from aiohttp.client_reqrep import ConnectionKey
+from starlette.requests import Request
+
+from metabot.core.config import (
+    DISPATCH_LIMIT,
+    DISPATCH_LIMIT_PER_HOST,
+    DISPATCH_KEEPALIVE_TIMEOUT,
+    DISPATCH_CONNECT_TIMEOUT,
+    DISPATCH_READ_TIMEOUT,
+    DISPATCH_DNS_CACHE_TTL,
+)
+from metabot.models.http import PoolStats, HostPoolStats
+
+
+async def get_sessions(request: Request) -> Dict[str, ClientSession]:
+    return {
+        'slack': request.app.state.session,
+        'dispatch': request.app.state.dispatch_session,
+    }
+
+
+def create_dispatch_session() -> ClientSession:
+    # Module dispatch gets its own connection pool,
+    # so that it can't starve Slack API calls and vice versa
+    connector = TCPConnector(
+        limit=DISPATCH_LIMIT,
+        limit_per_host=DISPATCH_LIMIT_PER_HOST,
+        keepalive_timeout=DISPATCH_KEEPALIVE_TIMEOUT,
+        use_dns_cache=DISPATCH_DNS_CACHE_TTL > 0,
+        ttl_dns_cache=DISPATCH_DNS_CACHE_TTL,
+    )
+    timeout = ClientTimeout(
+        connect=DISPATCH_CONNECT_TIMEOUT,
+        sock_read=DISPATCH_READ_TIMEOUT,
+    )
+    return ClientSession(connector=connector, timeout=timeout)
+
+
+def _host(key: ConnectionKey) -> str:
+    return f'{key.host}:{key.port}'
+
+
+def get_pool_stats(session: ClientSession) -> PoolStats:
+    # aiohttp doesn't expose pool usage publicly
+    connector = session.connector
+    hosts: DefaultDict[str, HostPoolStats] = defaultdict(HostPoolStats)
+    for key, acquired in connector._acquired_per_host.items():  # noqa
+        hosts[_host(key)].acquired = len(acquired)
+    for key, idle in connector._conns.items():  # noqa
+        hosts[_host(key)].idle = len(idle)
+    for key, waiters in connector._waiters.items():  # noqa
+        hosts[_host(key)].waiting = len(waiters)
+
+    return PoolStats(
+        limit=connector.limit,
+        limit_per_host=connector.limit_per_host,
+        acquired=len(connector._acquired),  # noqa
+        idle=sum(x.idle for x in hosts.values()),
+        waiting=sum(x.waiting for x in hosts.values()),
+        hosts=hosts,
+    )
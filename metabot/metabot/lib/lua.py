@@ -0,0 +1,26 @@
+from hashlib import sha1
+from typing import Any, List
+
+from aioredis import Redis, ReplyError
+
+
+class LuaScript:
+    source: str
+    digest: str
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.digest = sha1(source.encode('utf-8')).hexdigest()  # noqa S303
+
+    async def __call__(
+            self,
+            redis: Redis,
+            keys: List[str],
+            args: List[Any],
+    ) -> Any:
+        try:
+            return await redis.evalsha(self.digest, keys=keys, args=args)
+        except ReplyError as e:
+            if not str(e).startswith('NOSCRIPT'):
+                raise
+            return await redis.eval(self.source, keys=keys, args=args)
@@ -0,0 +1,108 @@
+from contextlib import contextmanager
+from time import monotonic, time
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def track(
+        histogram: Histogram,
+        in_flight: Gauge,
+        **labels: str,
+) -> Iterator[None]:
+    # The histogram gets an extra outcome label, ok or error
+    started_at = monotonic()
+    outcome = 'error'
+    try:
+        with in_flight.labels(**labels).track_inprogress():
+            yield
+        outcome = 'ok'
+    finally:
+        histogram.labels(outcome=outcome, **labels).observe(
+            monotonic() - started_at,
+        )
+
+
+@contextmanager
+def track_since(
+        histogram: Histogram,
+        started_at: Optional[float] = None,
+        **labels: str,
+) -> Iterator[Dict[str, str]]:
+    # Observes the time since started_at (a wall clock time, so that it can
+    # be passed between replicas), or since entering the block. Labels which
+    # are only known within the block are set on the yielded dict, an
+    # exception sets the outcome to error
+    if started_at is None:
+        started_at = time()
+    labels = {'outcome': 'ok', **labels}
+    try:
+        yield labels
+    except BaseException:
+        labels['outcome'] = 'error'
+        raise
+    finally:
+        histogram.labels(**labels).observe(max(time() - started_at, 0))
+
+
+def render_metrics() -> bytes:
+    return generate_latest(REGISTRY)
+
+
+DISPATCH_SECONDS = Histogram(
+    'metabot_dispatch_seconds',
+    'Time from receiving commands and actions to their delivery to modules, '
+    'including queueing, module lookups and circuit breakers',
+    ['kind', 'module', 'name', 'outcome'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+DISPATCH_IN_FLIGHT = Gauge(
+    'metabot_dispatch_in_flight',
+    'Commands and actions being delivered to modules',
+    ['kind', 'module', 'name'],
+)
+REDIS_SECONDS = Histogram(
+    'metabot_redis_seconds',
+    'Time spent on Redis calls of the module registry',
+    ['operation'],
+)
+SLACK_PROXY_SECONDS = Histogram(
+    'metabot_slack_proxy_seconds',
+    'Time spent on Slack requests proxied for modules',
+    ['method', 'outcome'],
+)
+SLACK_PROXY_IN_FLIGHT = Gauge(
+    'metabot_slack_proxy_in_flight',
+    'Slack requests being proxied for modules',
+    ['method'],
+)
+SLACK_PROXY_ERRORS = Counter(
+    'metabot_slack_proxy_errors',
+    'Failed Slack requests proxied for modules',
+    ['method', 'status_code'],
+)
+HTTP_POOL_CONNECTIONS = Gauge(
+    'metabot_http_pool_connections',
+    'Connections of aiohttp pools, along with requests waiting for one',
+    ['pool', 'state'],
+)
+HTTP_POOL_LIMIT = Gauge(
+    'metabot_http_pool_limit',
+    'Connection limits of aiohttp pools',
+    ['pool'],
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    'metabot_event_loop_lag_seconds',
+    'Delay of callbacks behind their schedule on the event loop',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
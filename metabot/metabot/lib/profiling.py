@@ -0,0 +1,20 @@
+from hmac import compare_digest
+
+from fastapi import Header, HTTPException
+from fastapi_metabot.profiling import Profiler
+
+from metabot.core.config import PROFILING_TOKEN
+
+# The sampling profiler is shared with the SDK, metabot only adds
+# the admin check of its debug endpoints
+
+
+async def require_admin(authorization: str = Header('')) -> None:
+    # Debug endpoints are disabled altogether unless an admin token is set
+    if not PROFILING_TOKEN:
+        raise HTTPException(404)
+    if not compare_digest(authorization, f'Bearer {PROFILING_TOKEN}'):
+        raise HTTPException(403)
+
+
+profiler = Profiler()
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import os
+from socket import gethostname
+from time import time
+from typing import Dict, Any, List, Optional, Tuple, Set
+
+import aioredis
+from aioredis import Redis, RedisError, ReplyError
+from fastapi import FastAPI
+
+from metabot.core.config import (
+    REDIS_URL,
+    DISPATCH_QUEUE_WORKERS,
+    DISPATCH_QUEUE_MAX_ATTEMPTS,
+    DISPATCH_QUEUE_RETRY_DELAY,
+    DISPATCH_QUEUE_MAX_LENGTH,
+)
+from metabot.lib.dispatchers import ActionDispatcher, CommandDispatcher
+from metabot.lib.tracing import start_span, get_traceparent, CONSUMER
+
+log = logging.getLogger(__name__)
+
+QUEUE_STREAM = 'dispatch:queue'
+DEAD_LETTER_STREAM = 'dispatch:dead'
+CONSUMER_GROUP = 'dispatch'
+READ_TIMEOUT_MS = 1000
+PENDING_BATCH_SIZE = 100
+
+COMMAND = 'command'
+ACTION = 'action'
+
+# Stream message id and its fields
+Message = Tuple[bytes, Dict[bytes, bytes]]
+
+
+# Slack hooks only add messages to the queue stream, the delivery workers
+# of all Metabot replicas share them through a consumer group. A failed
+# delivery is left pending and is retried once it has been idle for the
+# retry delay, which doubles with every attempt. Retries are only claimed
+# by a worker right before it delivers them, so that a message which waits
+# for a busy worker can't be claimed and delivered again in the meantime.
+# Deliveries which are still failing after the last attempt go to the dead
+# letter stream. Pending messages of replicas which went away are claimed
+# the same way, so nothing is lost on restarts.
+class DispatchQueue:
+    redis: Redis
+    command_dispatcher: CommandDispatcher
+    action_dispatcher: ActionDispatcher
+    consumer: str
+
+    _blocking_redis: Optional[Redis]
+    # Ids and attempts of pending messages to retry
+    _retries: 'asyncio.Queue[Tuple[bytes, int]]'
+    # Ids of messages waiting for a retry or being delivered
+    _local: Set[bytes]
+    _tasks: List[asyncio.Task]
+
+    def __init__(self, app: FastAPI) -> None:
+        self.redis = app.state.redis
+        self.command_dispatcher = app.state.command_dispatcher
+        self.action_dispatcher = app.state.action_dispatcher
+        self.consumer = f'{gethostname()}:{os.getpid()}'
+
+        self._blocking_redis = None
+        self._retries = asyncio.Queue()
+        self._local = set()
+        self._tasks = []
+
+    async def start(self) -> None:
+        if not DISPATCH_QUEUE_WORKERS:
+            return
+
+        try:
+            await self.redis.xgroup_create(
+                QUEUE_STREAM,
+                CONSUMER_GROUP,
+                latest_id='0',
+                mkstream=True,
+            )
+        except ReplyError as e:
+            if not str(e).startswith('BUSYGROUP'):
+                raise
+
+        # Blocking reads get connections of their own, one per worker,
+        # otherwise they would hold up every other Redis command
+        self._blocking_redis = await aioredis.create_redis_pool(
+            REDIS_URL,
+            minsize=1,
+            maxsize=DISPATCH_QUEUE_WORKERS,
+        )
+        self._tasks = [
+            asyncio.create_task(self._reclaim()),
+            *(
+                asyncio.create_task(self._work())
+                for _ in range(DISPATCH_QUEUE_WORKERS)
+            ),
+        ]
+
+    async def stop(self) -> None:
+        # Messages which haven't been delivered yet are left pending
+        # and will be claimed by another replica
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self._blocking_redis is not None:
+            self._blocking_redis.close()
+            await self._blocking_redis.wait_closed()
+            self._blocking_redis = None
+
+    async def _add(self, stream: str, fields: Dict[str, Any]) -> None:
+        # Deliveries continue the trace of the Slack request
+        if 'traceparent' not in fields and (
+                traceparent := get_traceparent()
+        ) is not None:
+            fields['traceparent'] = traceparent
+        # Deliveries are timed from the moment metabot received them
+        fields.setdefault('received_at', time())
+        await self.redis.xadd(
+            stream,
+            fields,
+            max_len=DISPATCH_QUEUE_MAX_LENGTH,
+        )
+
+    async def enqueue_command(self, payload: Dict[str, str]) -> None:
+        await self._add(QUEUE_STREAM, {
+            'kind': COMMAND,
+            'payload': json.dumps(payload),
+        })
+
+    async def enqueue_actions(self, payload: Dict[str, Any]) -> None:
+        # Every action gets a message of its own, so that a failing module
+        # doesn't make the others receive the same action twice
+        for action_id in self.action_dispatcher.get_action_ids(payload):
+            await self._add(QUEUE_STREAM, {
+                'kind': ACTION,
+                'action_id': action_id,
+                'payload': json.dumps(payload),
+            })
+
+    @staticmethod
+    def _retry_delay_ms(attempts: int) -> int:
+        return int(DISPATCH_QUEUE_RETRY_DELAY * 1000 * 2 ** (attempts - 1))
+
+    async def _reclaim(self) -> None:
+        while True:
+            await asyncio.sleep(DISPATCH_QUEUE_RETRY_DELAY / 2)
+            try:
+                await self._find_retries()
+            except Exception:
+                log.exception('Failed to reclaim pending dispatch messages')
+
+    async def _find_retries(self) -> None:
+        pending = await self.redis.xpending(
+            QUEUE_STREAM,
+            CONSUMER_GROUP,
+            '-',
+            '+',
+            PENDING_BATCH_SIZE,
+        )
+        for message_id, _, idle_ms, attempts in pending:
+            if message_id in self._local:
+                continue
+            if idle_ms >= self._retry_delay_ms(attempts):
+                self._local.add(message_id)
+                self._retries.put_nowait((message_id, attempts))
+
+    async def _claim(
+            self,
+            message_id: bytes,
+            attempts: int,
+    ) -> Optional[Message]:
+        # Claiming only succeeds for a single replica, and only if the
+        # message is still idle, i.e. nobody has claimed it in the meantime
+        claimed = await self.redis.xclaim(
+            QUEUE_STREAM,
+            CONSUMER_GROUP,
+            self.consumer,
+            self._retry_delay_ms(attempts),
+            message_id,
+        )
+        for message in claimed:
+            if attempts < DISPATCH_QUEUE_MAX_ATTEMPTS:
+                return message
+            await self._dead_letter(message, attempts)
+        return None
+
+    async def _dead_letter(self, message: Message, attempts: int) -> None:
+        message_id, fields = message
+        log.error(
+            f'Dispatch message {message_id.decode("utf-8")} '
+            f'failed {attempts} times'
+        )
+        await self._add(DEAD_LETTER_STREAM, {
+            **{key.decode('utf-8'): value for key, value in fields.items()},
+            'message_id': message_id,
+            'attempts': attempts,
+        })
+        await self.redis.xack(QUEUE_STREAM, CONSUMER_GROUP, message_id)
+
+        if fields[b'kind'] == COMMAND.encode('utf-8'):
+            await self.command_dispatcher.fail(json.loads(fields[b'payload']))
+
+    async def _deliver(self, fields: Dict[bytes, bytes]) -> None:
+        payload = json.loads(fields[b'payload'])
+        kind = fields[b'kind'].decode('utf-8')
+        traceparent = fields.get(b'traceparent', b'').decode('utf-8')
+        received_at = float(fields.get(b'received_at', time()))
+        with start_span(f'deliver {kind}', CONSUMER, traceparent):
+            if kind == COMMAND:
+                await self.command_dispatcher.deliver(payload, received_at)
+            else:
+                await self.action_dispatcher.deliver(
+                    fields[b'action_id'].decode('utf-8'),
+                    payload,
+                    received_at,
+                )
+
+    async def _next_message(self) -> Optional[Message]:
+        while not self._retries.empty():
+            message_id, attempts = self._retries.get_nowait()
+            self._local.discard(message_id)
+            if (message := await self._claim(message_id, attempts)) is not None:
+                return message
+
+        # Workers only read a message once they are idle, so that messages
+        # don't wait in this replica while others could deliver them
+        assert self._blocking_redis is not None
+        messages = await self._blocking_redis.xread_group(
+            CONSUMER_GROUP,
+            self.consumer,
+            [QUEUE_STREAM],
+            timeout=READ_TIMEOUT_MS,
+            count=1,
+            latest_ids=['>'],
+        )
+        for _, message_id, fields in messages:
+            return message_id, fields
+        return None
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                message = await self._next_message()
+            except RedisError:
+                log.exception('Failed to read the dispatch queue')
+                await asyncio.sleep(READ_TIMEOUT_MS / 1000)
+                continue
+
+            if message is None:
+                continue
+
+            message_id, fields = message
+            self._local.add(message_id)
+            try:
+                await self._deliver(fields)
+                await self.redis.xack(QUEUE_STREAM, CONSUMER_GROUP, message_id)
+            except Exception:
+                # The message stays pending and is retried later on
+                log.exception(
+                    f'Failed to deliver dispatch message '
+                    f'{message_id.decode("utf-8")}'
+                )
+            finally:
+                self._local.discard(message_id)
@@ -0,0 +1,280 @@
+import asyncio
+import logging
+from hashlib import sha256
+from heapq import heappush, heappop
+from itertools import count
+from time import monotonic
+from typing import Dict, Tuple, List, Optional, Any, Iterator
+
+from slack import WebClient
+from slack.errors import SlackApiError
+from slack.web.slack_response import SlackResponse
+from starlette.requests import Request
+
+from metabot.core.config import (
+    SLACK_RATE_LIMIT_SHARE,
+    SLACK_RATE_LIMIT_RETRIES,
+    SLACK_MAX_QUEUE_SECONDS,
+)
+from metabot.lib.tracing import start_span, CLIENT
+from metabot.models.slack import SlackMethod, SlackBucketStats
+
+log = logging.getLogger(__name__)
+
+# Requests per minute allowed by Slack for every tier of Web API methods
+# https://api.slack.com/docs/rate-limits
+TIER_LIMITS = {
+    'tier1': 1,
+    'tier2': 20,
+    'tier3': 50,
+    'tier4': 100,
+    # chat.postMessage is limited to a message per second per channel
+    'special': 60,
+}
+# Tiers which are limited per channel rather than per workspace
+CHANNEL_TIERS = {'special'}
+DEFAULT_TIER = 'tier3'
+METHOD_TIERS = {
+    SlackMethod.CHAT_POSTMESSAGE: 'special',
+    SlackMethod.CHAT_POSTEPHEMERAL: 'tier4',
+    SlackMethod.CONVERSATIONS_LIST: 'tier2',
+    SlackMethod.CONVERSATIONS_MEMBERS: 'tier4',
+    SlackMethod.EMOJI_LIST: 'tier2',
+    SlackMethod.FILES_UPLOAD: 'tier2',
+    SlackMethod.SEARCH_ALL: 'tier2',
+    SlackMethod.SEARCH_FILES: 'tier2',
+    SlackMethod.SEARCH_MESSAGES: 'tier2',
+    SlackMethod.USERGROUPS_LIST: 'tier2',
+    SlackMethod.USERS_INFO: 'tier4',
+    SlackMethod.USERS_LIST: 'tier2',
+    SlackMethod.USERS_PROFILE_GET: 'tier4',
+    SlackMethod.VIEWS_OPEN: 'tier4',
+    SlackMethod.VIEWS_PUBLISH: 'tier4',
+    SlackMethod.VIEWS_PUSH: 'tier4',
+    SlackMethod.VIEWS_UPDATE: 'tier4',
+}
+
+# Replies to users go first, their trigger ids and response urls expire
+# in a few seconds, while bulk messages can wait. Priorities only order
+# requests waiting in the same bucket, e.g. views.open ahead of users.info.
+# Buckets never wait for each other, so ephemeral messages (tier4) don't
+# queue behind bulk direct messages (per channel) in the first place.
+INTERACTIVE_PRIORITY = 0
+DEFAULT_PRIORITY = 1
+INTERACTIVE_METHODS = {
+    SlackMethod.CHAT_POSTEPHEMERAL,
+    SlackMethod.DIALOG_OPEN,
+    SlackMethod.VIEWS_OPEN,
+    SlackMethod.VIEWS_PUSH,
+    SlackMethod.VIEWS_UPDATE,
+}
+
+# Each tier allows bursts of 10 seconds worth of requests
+BURST_SECONDS = 10
+# Idle buckets are dropped once there are more of them,
+# e.g. after direct messages to a lot of users
+MAX_IDLE_BUCKETS = 1000
+
+
+class SlackQueueTimeout(Exception):
+    # Raised instead of waiting in a bucket for longer than callers do
+    retry_after: float
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f'Rate limited, retry in {retry_after:.1f} seconds')
+        self.retry_after = retry_after
+
+
+async def get_slack_scheduler(request: Request) -> 'SlackScheduler':
+    return request.app.state.slack_scheduler
+
+
+class TokenBucket:
+    rate: float
+    capacity: float
+    tokens: float
+    updated_at: float
+    blocked_until: float
+    rate_limited: int
+
+    # (priority, sequence number, future of the waiting request)
+    _waiters: List[Tuple[int, int, asyncio.Future]]
+    _sequence: Iterator[int]
+    _drainer: Optional[asyncio.Task]
+
+    def __init__(self, requests_per_minute: float) -> None:
+        self.rate = requests_per_minute / 60
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated_at = monotonic()
+        self.blocked_until = 0
+        self.rate_limited = 0
+
+        self._waiters = []
+        self._sequence = count()
+        self._drainer = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def idle(self) -> bool:
+        self.delay()
+        return not self._waiters and self.tokens >= self.capacity
+
+    def delay(self) -> float:
+        now = monotonic()
+        elapsed, self.updated_at = now - self.updated_at, now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, monotonic() + seconds)
+        self.tokens = 0
+        self.rate_limited += 1
+
+    def estimate(self, priority: int) -> float:
+        # Seconds until a new request of the given priority gets a token
+        self.delay()
+        blocked_for = max(0.0, self.blocked_until - monotonic())
+        ahead = sum(
+            1 for x, _, future in self._waiters
+            if x <= priority and not future.done()
+        )
+        return max(blocked_for, (ahead + 1 - self.tokens) / self.rate)
+
+    async def acquire(
+            self,
+            priority: int,
+            max_wait: Optional[float] = None,
+    ) -> None:
+        if not self._waiters and not self.delay():
+            self.tokens -= 1
+            return
+
+        if max_wait is not None:
+            if (wait := self.estimate(priority)) > max_wait:
+                raise SlackQueueTimeout(wait)
+
+        future = asyncio.get_event_loop().create_future()
+        heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.create_task(self._drain())
+        # Requests of a higher priority may still get ahead of this one
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            raise SlackQueueTimeout(self.estimate(priority))
+
+    async def _drain(self) -> None:
+        while self._waiters:
+            if delay := self.delay():
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heappop(self._waiters)
+            # Requests which were cancelled while waiting don't use tokens
+            if not future.done():
+                self.tokens -= 1
+                future.set_result(None)
+
+
+class SlackScheduler:
+    max_wait: float
+
+    # (workspace, tier, channel of per channel tiers) -> token bucket
+    _buckets: Dict[Tuple[str, str, str], TokenBucket]
+    _workspaces: Dict[str, str]
+
+    def __init__(self, max_wait: float = SLACK_MAX_QUEUE_SECONDS) -> None:
+        self.max_wait = max_wait
+        self._buckets = {}
+        self._workspaces = {}
+
+    def _workspace(self, slack: WebClient) -> str:
+        # Rate limits apply to every workspace token separately,
+        # tokens themselves shouldn't end up in the stats
+        if slack.token not in self._workspaces:
+            digest = sha256(slack.token.encode('utf-8')).hexdigest()
+            self._workspaces[slack.token] = digest[:12]
+        return self._workspaces[slack.token]
+
+    def _bucket(
+            self,
+            workspace: str,
+            method: SlackMethod,
+            payload: Dict[str, Any],
+    ) -> TokenBucket:
+        tier = METHOD_TIERS.get(method, DEFAULT_TIER)
+        channel = ''
+        if tier in CHANNEL_TIERS:
+            channel = str(payload.get('channel', ''))
+
+        key = workspace, tier, channel
+        if key not in self._buckets:
+            if len(self._buckets) >= MAX_IDLE_BUCKETS:
+                self._prune()
+            self._buckets[key] = TokenBucket(
+                TIER_LIMITS[tier] * SLACK_RATE_LIMIT_SHARE
+            )
+        return self._buckets[key]
+
+    def _prune(self) -> None:
+        # Idle buckets are no different from new ones
+        for key, bucket in list(self._buckets.items()):
+            if bucket.idle:
+                del self._buckets[key]
+
+    async def request(
+            self,
+            slack: WebClient,
+            method: SlackMethod,
+            payload: Dict[str, Any],
+    ) -> SlackResponse:
+        bucket = self._bucket(self._workspace(slack), method, payload)
+        if method in INTERACTIVE_METHODS:
+            priority = INTERACTIVE_PRIORITY
+        else:
+            priority = DEFAULT_PRIORITY
+
+        with start_span(f'slack {method.value}', CLIENT) as span:
+            retries = 0
+            while True:
+                await bucket.acquire(priority, self.max_wait)
+                try:
+                    return await getattr(slack, method.value)(**payload)
+                except SlackApiError as e:
+                    if e.response.status_code != 429:
+                        raise
+                    if retries >= SLACK_RATE_LIMIT_RETRIES:
+                        raise
+                    retry_after = float(
+                        e.response.headers.get('Retry-After', 1)
+                    )
+
+                log.warning(
+                    f'Slack rate limited {method.value}, '
+                    f'retrying in {retry_after} seconds'
+                )
+                bucket.block(retry_after)
+                retries += 1
+                span.attributes['slack.retries'] = retries
+
+    def get_stats(self) -> Dict[str, Dict[str, SlackBucketStats]]:
+        stats: Dict[str, Dict[str, SlackBucketStats]] = {}
+        for (workspace, tier, channel), bucket in self._buckets.items():
+            bucket.delay()
+            name = f'{tier}:{channel}' if channel else tier
+            stats.setdefault(workspace, {})[name] = SlackBucketStats(
+                waiting=bucket.waiting,
+                tokens=bucket.tokens,
+                blocked_for=max(0.0, bucket.blocked_until - monotonic()),
+                rate_limited=bucket.rate_limited,
+            )
+        return stats
@@ -0,0 +1,33 @@
+import asyncio
+from typing import Dict, Callable, Awaitable, TypeVar, Generic
+
+from starlette.requests import Request
+
+T = TypeVar('T')
+
+
+async def get_slack_singleflight(request: Request) -> 'SingleFlight':
+    return request.app.state.slack_singleflight
+
+
+class SingleFlight(Generic[T]):
+    # key -> future of the call in flight
+    _calls: Dict[str, 'asyncio.Future[T]']
+
+    def __init__(self) -> None:
+        self._calls = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        # Concurrent calls with the same key wait for the first one
+        # and share its result or exception
+        if key not in self._calls:
+            future = asyncio.ensure_future(call())
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+            self._calls[key] = future
+
+        # The call goes on for the others if one of its callers is cancelled
+        return await asyncio.shield(self._calls[key])
@@ -1,4 +1,7 @@
+import json
 import logging
+from hashlib import sha256
+from math import ceil
 
 from fastapi import HTTPException
 from slack import WebClient
@@ -6,19 +9,79 @@ from slack.errors import SlackApiError
 from slack.web.slack_response import SlackResponse
 from starlette.requests import Request
 
-from metabot.models.slack import SlackRequest
+from metabot.lib.scheduler import SlackScheduler, SlackQueueTimeout
+from metabot.models.slack import SlackRequest, SlackMethod
 
 log = logging.getLogger(__name__)
 
+# Methods which only read data from Slack, going by their names
+READ_ONLY_SUFFIXES = {
+    'get',
+    'getPermalink',
+    'getPresence',
+    'history',
+    'identity',
+    'info',
+    'list',
+    'lookupByEmail',
+    'members',
+    'replies',
+    'teamInfo',
+}
+READ_ONLY_METHODS = {
+    method for method in SlackMethod
+    if method.value.rsplit('_', 1)[-1] in READ_ONLY_SUFFIXES
+    or method.value.startswith('search_')
+}
+
+# Methods with cursor-based pagination, along with the key of their items
+PAGINATED_METHODS = {
+    SlackMethod.ADMIN_TEAMS_LIST: 'teams',
+    SlackMethod.CHAT_SCHEDULEDMESSAGES_LIST: 'scheduled_messages',
+    SlackMethod.CONVERSATIONS_HISTORY: 'messages',
+    SlackMethod.CONVERSATIONS_LIST: 'channels',
+    SlackMethod.CONVERSATIONS_MEMBERS: 'members',
+    SlackMethod.CONVERSATIONS_REPLIES: 'messages',
+    SlackMethod.FILES_REMOTE_LIST: 'files',
+    SlackMethod.REACTIONS_LIST: 'items',
+    SlackMethod.STARS_LIST: 'items',
+    SlackMethod.USERS_CONVERSATIONS: 'channels',
+    SlackMethod.USERS_LIST: 'members',
+}
+
 
 async def get_slack(request: Request) -> WebClient:
     return request.app.state.slack
 
 
-async def slack_request(slack: WebClient, req: SlackRequest) -> SlackResponse:
+def get_request_key(req: SlackRequest) -> str:
+    # Payloads which only differ in key order share the same key
+    payload = json.dumps(req.payload, sort_keys=True, separators=(',', ':'))
+    digest = sha256(payload.encode('utf-8')).hexdigest()
+    return f'{req.method.value}:{digest}'
+
+
+async def slack_request(
+        slack: WebClient,
+        req: SlackRequest,
+        scheduler: SlackScheduler,
+) -> SlackResponse:
     try:
-        method = getattr(slack, req.method.value)
-        return await method(**req.payload)
+        return await scheduler.request(slack, req.method, req.payload)
     except SlackApiError as e:
         log.exception('Slack request failed')
-        raise HTTPException(e.response.status_code, e.response.get('error'))
+        # Slack answers most errors with a 200 and ok set to false,
+        # they shouldn't look like successful responses to callers
+        status_code = e.response.status_code
+        if status_code < 400:
+            status_code = 400
+        raise HTTPException(status_code, e.response.get('error'))
+    except SlackQueueTimeout as e:
+        # Callers would give up on the request before it is sent,
+        # and retrying it then would post the same message twice
+        log.warning(f'Slack request {req.method.value} rejected: {e}')
+        raise HTTPException(
+            429,
+            'ratelimited',
+            headers={'Retry-After': str(ceil(e.retry_after))},
+        )
@@ -1,16 +1,152 @@
+import asyncio
 import json
 import logging
-from typing import Dict, Optional, List, AsyncIterator
+from hashlib import sha256
+from time import time
+from typing import Dict, Optional, List, Tuple, Iterable
 
-from aioredis import Redis
+from aioredis import Redis, RedisError
 from fastapi.encoders import jsonable_encoder
 from starlette.requests import Request
 
 from metabot.core.config import MODULE_EXPIRATION_SECONDS
+from metabot.lib.lua import LuaScript
+from metabot.lib.metrics import REDIS_SECONDS
 from metabot.models.module import Module
 
 log = logging.getLogger(__name__)
 
+MODULES_KEY = 'registry:modules'
+EXPIRY_KEY = 'registry:expiry'
+ACTIONS_KEY = 'registry:actions'
+HASHES_KEY = 'registry:hashes'
+ENDPOINTS_KEY_PREFIX = 'registry:endpoints:'
+REGISTRY_KEYS = [
+    MODULES_KEY,
+    EXPIRY_KEY,
+    ACTIONS_KEY,
+    HASHES_KEY,
+    ENDPOINTS_KEY_PREFIX,
+]
+INVALIDATION_CHANNEL = 'registry:invalidate'
+RESUBSCRIBE_DELAY_SECONDS = 1
+
+# Module manifests live in a hash, the endpoints of every module live in
+# their own sorted set scored by expiration timestamps. A module expires
+# along with its last endpoint, so the expiry sorted set keeps the latest
+# endpoint expiration of every module.
+# Every registry script takes the modules hash, the expiry sorted set,
+# the actions hash, the manifest hashes hash and the endpoints key prefix
+# as KEYS. Their ARGV always starts with the current timestamp.
+# The endpoint keys of modules are built from that prefix inside the
+# scripts rather than declared in KEYS, so the registry is not Redis
+# Cluster safe: all of its keys must live on a single node.
+REGISTRY_FUNCTIONS = """
+local function endpoints_key(name)
+    return KEYS[5] .. name
+end
+
+local function remove_actions(name)
+    local raw = redis.call('HGET', KEYS[1], name)
+    if raw then
+        for _, action in ipairs(cjson.decode(raw)['actions']) do
+            if redis.call('HGET', KEYS[3], action) == name then
+                redis.call('HDEL', KEYS[3], action)
+            end
+        end
+    end
+    return raw
+end
+
+local function add_endpoint(name, url, expires_at)
+    local key = endpoints_key(name)
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', ARGV[1])
+    local added = redis.call('ZADD', key, expires_at, url)
+    local latest = redis.call('ZRANGE', key, -1, -1, 'WITHSCORES')
+    redis.call('ZADD', KEYS[2], latest[2], name)
+    return added
+end
+
+local function get_module(name)
+    return {
+        name,
+        redis.call('HGET', KEYS[1], name),
+        redis.call(
+            'ZRANGEBYSCORE', endpoints_key(name),
+            '(' .. ARGV[1], '+inf', 'WITHSCORES'
+        ),
+    }
+end
+"""
+
+# Registrations and heartbeats also remove the modules which have expired
+# since, along with the actions which still point to them
+PRUNE_EXPIRED_MODULES = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, name in ipairs(expired) do
+    remove_actions(name)
+    redis.call('HDEL', KEYS[1], name)
+    redis.call('HDEL', KEYS[4], name)
+    redis.call('ZREM', KEYS[2], name)
+    redis.call('DEL', endpoints_key(name))
+end
+"""
+
+# ARGV: now, expires at, module name, manifest hash, url, encoded module,
+# *actions
+# Returns the previous encoded module and whether the endpoint is new
+REGISTER_MODULE = LuaScript(REGISTRY_FUNCTIONS + PRUNE_EXPIRED_MODULES + """
+local old = remove_actions(ARGV[3])
+redis.call('HSET', KEYS[1], ARGV[3], ARGV[6])
+redis.call('HSET', KEYS[4], ARGV[3], ARGV[4])
+for i = 7, #ARGV do
+    redis.call('HSET', KEYS[3], ARGV[i], ARGV[3])
+end
+return {old, add_endpoint(ARGV[3], ARGV[5], ARGV[2])}
+""")
+
+# Only pushes back the expiration if the stored manifest hash matches
+# ARGV: now, expires at, module name, manifest hash, url
+# Returns 0 on mismatch, 1 if refreshed and 2 if the endpoint is new
+REFRESH_MODULE = LuaScript(REGISTRY_FUNCTIONS + PRUNE_EXPIRED_MODULES + """
+if redis.call('HGET', KEYS[4], ARGV[3]) ~= ARGV[4] then
+    return 0
+end
+return 1 + add_endpoint(ARGV[3], ARGV[5], ARGV[2])
+""")
+
+# The read scripts return (module name, encoded module, flat list of
+# endpoints with their expiration timestamps) for every found module.
+
+# ARGV: now, *module names
+GET_MODULES = LuaScript(REGISTRY_FUNCTIONS + """
+local result = {}
+for i = 2, #ARGV do
+    table.insert(result, get_module(ARGV[i]))
+end
+return result
+""")
+
+# ARGV: now, *actions
+GET_MODULES_BY_ACTIONS = LuaScript(REGISTRY_FUNCTIONS + """
+local result = {}
+for i = 2, #ARGV do
+    local name = redis.call('HGET', KEYS[3], ARGV[i])
+    table.insert(result, name and get_module(name))
+end
+return result
+""")
+
+# ARGV only holds the current timestamp
+GET_ALL_MODULES = LuaScript(REGISTRY_FUNCTIONS + """
+local result = {}
+local names = redis.call('ZRANGEBYSCORE', KEYS[2], '(' .. ARGV[1], '+inf')
+for _, name in ipairs(names) do
+    table.insert(result, get_module(name))
+end
+return result
+""")
+
 
 async def get_storage(request: Request) -> 'Storage':
     return request.app.state.storage
@@ -19,56 +155,248 @@ async def get_storage(request: Request) -> 'Storage':
 class Storage:
     redis: Redis
 
+    # module name -> (expiration timestamp, decoded module)
+    _cache: Dict[str, Tuple[float, Module]]
+    # action -> module name, cleared on every invalidation since a changed
+    # module may have taken over actions of any other module
+    _actions: Dict[str, str]
+    _generation: int
+    _subscribed: bool
+    _listener: Optional[asyncio.Task]
+
     def __init__(self, redis: Redis) -> None:
         self.redis = redis
 
+        self._cache = {}
+        self._actions = {}
+        self._generation = 0
+        self._subscribed = False
+        self._listener = None
+
+    async def start(self) -> None:
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+        if self._subscribed:
+            self._subscribed = False
+            await self.redis.unsubscribe(INVALIDATION_CHANNEL)
+
+        self._invalidate()
+
+    async def _listen(self) -> None:
+        # The cache is only used while we are subscribed to invalidations,
+        # otherwise another replica could change a module behind our back
+        while True:
+            try:
+                channel, = await self.redis.subscribe(INVALIDATION_CHANNEL)
+                self._subscribed = True
+                self._invalidate()
+                async for module_name in channel.iter(encoding='utf-8'):
+                    self._invalidate(module_name)
+            except RedisError:
+                log.exception('Module invalidation subscription failed')
+
+            self._subscribed = False
+            self._invalidate()
+            await asyncio.sleep(RESUBSCRIBE_DELAY_SECONDS)
+
+    def _invalidate(self, module_name: Optional[str] = None) -> None:
+        # Bumping the generation prevents in-flight reads, which started
+        # before the invalidation, from putting stale modules into the cache
+        self._generation += 1
+        self._actions.clear()
+        if module_name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(module_name, None)
+
     @staticmethod
     def _encode_module(module: Module) -> str:
-        return json.dumps(jsonable_encoder(module))
+        # Endpoints are stored separately, so that replicas of the same
+        # module share a single manifest
+        manifest = jsonable_encoder(module, exclude={'url', 'endpoints'})
+        return json.dumps(manifest)
 
     @staticmethod
-    def _decode_module(raw_module: str) -> Module:
-        return Module.parse_raw(raw_module)
-
-    async def add_or_replace_module(self, module: Module) -> None:
-        tr = self.redis.multi_exec()
-        tr.set(
-            f'module:{module.name}',
-            self._encode_module(module),
-            expire=MODULE_EXPIRATION_SECONDS,
+    def _decode_module(raw_module: str, endpoints: List[str]) -> Module:
+        return Module(
+            **json.loads(raw_module),
+            url=endpoints[0],
+            endpoints=endpoints,
         )
-        for action in module.actions:
-            tr.set(
-                f'action:{action}',
-                module.name,
-                expire=MODULE_EXPIRATION_SECONDS,
+
+    async def add_or_replace_module(
+            self,
+            module: Module,
+            manifest_hash: Optional[str] = None,
+    ) -> None:
+        raw_module = self._encode_module(module)
+        if manifest_hash is None:
+            manifest_hash = sha256(raw_module.encode('utf-8')).hexdigest()
+        now = time()
+
+        with REDIS_SECONDS.labels(operation='register_module').time():
+            old_raw_module, endpoint_added = await REGISTER_MODULE(
+                self.redis,
+                keys=REGISTRY_KEYS,
+                args=[
+                    now,
+                    now + MODULE_EXPIRATION_SECONDS,
+                    module.name,
+                    manifest_hash,
+                    str(module.url),
+                    raw_module,
+                    *module.actions,
+                ],
             )
-        await tr.execute()
 
-    async def get_module(self, module_name: str) -> Optional[Module]:
-        raw_module = await self.redis.get(f'module:{module_name}')
-        if raw_module is None:
+        if endpoint_added or old_raw_module != raw_module.encode('utf-8'):
+            await self._publish_invalidation(module.name)
+
+    async def refresh_module(
+            self,
+            module_name: str,
+            manifest_hash: str,
+            url: str,
+    ) -> bool:
+        now = time()
+        with REDIS_SECONDS.labels(operation='refresh_module').time():
+            refreshed = await REFRESH_MODULE(
+                self.redis,
+                keys=REGISTRY_KEYS,
+                args=[
+                    now,
+                    now + MODULE_EXPIRATION_SECONDS,
+                    module_name,
+                    manifest_hash,
+                    str(url),
+                ],
+            )
+
+        if refreshed == 2:
+            await self._publish_invalidation(module_name)
+        return bool(refreshed)
+
+    async def _publish_invalidation(self, module_name: str) -> None:
+        self._invalidate(module_name)
+        with REDIS_SECONDS.labels(operation='publish_invalidation').time():
+            await self.redis.publish(INVALIDATION_CHANNEL, module_name)
+
+    def _get_cached_module(self, module_name: str) -> Optional[Module]:
+        if cached := self._cache.get(module_name):
+            expires_at, module = cached
+            if expires_at > time():
+                return module
+            del self._cache[module_name]
+        return None
+
+    def _load_module(
+            self,
+            result: Optional[List],
+            generation: int,
+    ) -> Optional[Module]:
+        if not result:
             return None
-        return self._decode_module(raw_module)
 
-    async def get_module_by_action(self, action: str) -> Optional[Module]:
-        module_name = await self.redis.get(f'action:{action}')
-        if module_name is None:
+        raw_name, raw_module, raw_endpoints = result
+        module_name = raw_name.decode('utf-8')
+        if module := self._get_cached_module(module_name):
+            return module
+
+        if raw_module is None or not raw_endpoints:
             return None
-        return await self.get_module(module_name.decode('utf-8'))
 
-    async def _module_keys(self) -> AsyncIterator[str]:
-        async for key in self.redis.iscan(match='module:*'):
-            yield key.decode('utf-8')
+        endpoints = sorted(x.decode('utf-8') for x in raw_endpoints[::2])
+        module = self._decode_module(raw_module.decode('utf-8'), endpoints)
+
+        # The cached module is only valid until its first endpoint expires
+        if self._subscribed and generation == self._generation:
+            expires_at = min(float(x) for x in raw_endpoints[1::2])
+            self._cache[module_name] = (expires_at, module)
+        return module
+
+    async def get_module(self, module_name: str) -> Optional[Module]:
+        if module := self._get_cached_module(module_name):
+            return module
+
+        generation = self._generation
+        with REDIS_SECONDS.labels(operation='get_module').time():
+            result, = await GET_MODULES(
+                self.redis,
+                keys=REGISTRY_KEYS,
+                args=[time(), module_name],
+            )
+        return self._load_module(result, generation)
+
+    async def get_module_by_action(self, action: str) -> Optional[Module]:
+        modules = await self.get_modules_by_actions([action])
+        return modules.get(action)
+
+    def _get_cached_modules_by_actions(
+            self,
+            actions: List[str],
+    ) -> Dict[str, Module]:
+        modules = {}
+        for action in actions:
+            if module_name := self._actions.get(action):
+                if module := self._get_cached_module(module_name):
+                    modules[action] = module
+        return modules
+
+    async def get_modules_by_actions(
+            self,
+            actions: Iterable[str],
+    ) -> Dict[str, Module]:
+        actions = list(actions)
+        if not actions:
+            return {}
+
+        # Action dispatch skips Redis when every action is cached
+        modules = self._get_cached_modules_by_actions(actions)
+        if all(x in modules for x in actions):
+            return modules
+
+        generation = self._generation
+        with REDIS_SECONDS.labels(operation='get_modules_by_actions').time():
+            results = await GET_MODULES_BY_ACTIONS(
+                self.redis,
+                keys=REGISTRY_KEYS,
+                args=[time(), *actions],
+            )
+
+        modules = {}
+        for action, result in zip(actions, results):
+            if module := self._load_module(result, generation):
+                modules[action] = module
+                if self._subscribed and generation == self._generation:
+                    self._actions[action] = module.name
+        return modules
 
     async def get_all_modules(self) -> Dict[str, Module]:
-        results = {}
-        async for key in self._module_keys():
-            raw_module = await self.redis.get(key)
-            if raw_module:
-                module = self._decode_module(raw_module)
-                results[module.name] = module
-        return results
+        generation = self._generation
+        with REDIS_SECONDS.labels(operation='get_all_modules').time():
+            results = await GET_ALL_MODULES(
+                self.redis,
+                keys=REGISTRY_KEYS,
+                args=[time()],
+            )
+
+        modules = {}
+        for result in results:
+            if module := self._load_module(result, generation):
+                modules[module.name] = module
+        return modules
 
     async def get_module_names(self) -> List[str]:
-        return [key.split(':')[-1] async for key in self._module_keys()]
+        with REDIS_SECONDS.labels(operation='get_module_names').time():
+            names = await self.redis.zrangebyscore(
+                EXPIRY_KEY,
+                min=time(),
+                exclude=self.redis.ZSET_EXCLUDE_MIN,
+                encoding='utf-8',
+            )
+        return list(names)
@@ -0,0 +1,98 @@
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Iterator
+
+from fastapi_metabot.tracing import (  # noqa F401
+    TRACEPARENT_HEADER,
+    INTERNAL,
+    SERVER,
+    CLIENT,
+    CONSUMER,
+    STATUS_ERROR,
+    Span,
+    SpanExporter,
+    get_traceparent,
+    parse_traceparent,
+    start_span as start_exported_span,
+)
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from metabot.core.config import (
+    TRACING_FILE,
+    TRACING_ENDPOINT,
+    TRACING_EXPORT_INTERVAL,
+    TRACING_BATCH_SIZE,
+)
+
+# Spans, their OTLP export and the W3C trace context are shared with
+# the SDK, so that modules continue the traces of metabot
+
+# Prometheus scrapes would bury everything else
+UNTRACED_PATHS = {'/metrics'}
+
+exporter = SpanExporter(
+    service_name='metabot',
+    file_path=TRACING_FILE,
+    endpoint=TRACING_ENDPOINT,
+    interval=TRACING_EXPORT_INTERVAL,
+    batch_size=TRACING_BATCH_SIZE,
+)
+
+
+def inject_headers() -> Dict[str, str]:
+    if (traceparent := get_traceparent()) is None:
+        return {}
+    return {TRACEPARENT_HEADER: traceparent}
+
+
+@contextmanager
+def start_span(
+        name: str,
+        kind: int = INTERNAL,
+        traceparent: Optional[str] = None,
+        **attributes: Any,
+) -> Iterator[Span]:
+    with start_exported_span(
+            name,
+            kind,
+            traceparent,
+            exporter,
+            **attributes,
+    ) as span:
+        yield span
+
+
+class TracingMiddleware:
+    # Every request gets a server span, requests of modules continue
+    # the trace of the command or action they are handling
+    app: ASGIApp
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+            self,
+            scope: Scope,
+            receive: Receive,
+            send: Send,
+    ) -> None:
+        if scope['type'] != 'http' or scope['path'] in UNTRACED_PATHS:
+            return await self.app(scope, receive, send)
+
+        with start_span(
+                f'{scope["method"]} {scope["path"]}',
+                SERVER,
+                Headers(scope=scope).get(TRACEPARENT_HEADER),
+                **{
+                    'http.method': scope['method'],
+                    'http.target': scope['path'],
+                },
+        ) as span:
+            async def send_with_status(message: Message) -> None:
+                if message['type'] == 'http.response.start':
+                    span.attributes['http.status_code'] = message['status']
+                    if message['status'] >= 500:
+                        span.status = STATUS_ERROR
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
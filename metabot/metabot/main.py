@@ -1,17 +1,35 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
 from slackers.server import router as slackers_router
 
 from metabot.core.config import APP_TITLE, API_PREFIX, SLACKERS_PREFIX
 from metabot.core.event_handlers import start_app_handler, stop_app_handler
 from metabot.api.router import router as api_router
+from metabot.api.routes.metrics import router as metrics_router
+from metabot.lib.deduplication import (
+    DuplicateSlackRequest,
+    deduplicate_slack_request,
+    duplicate_slack_request_handler,
+)
+from metabot.lib.tracing import TracingMiddleware
 
 app = FastAPI(title=APP_TITLE)
 
 app.add_event_handler('startup', start_app_handler(app))
 app.add_event_handler('shutdown', stop_app_handler(app))
+app.add_exception_handler(
+    DuplicateSlackRequest,
+    duplicate_slack_request_handler,
+)
+app.add_middleware(TracingMiddleware)
 
 for route in slackers_router.routes:
     route.include_in_schema = False
 
-app.include_router(slackers_router, prefix=SLACKERS_PREFIX, tags=['slack'])
+app.include_router(
+    slackers_router,
+    prefix=SLACKERS_PREFIX,
+    tags=['slack'],
+    dependencies=[Depends(deduplicate_slack_request)],
+)
 app.include_router(api_router, prefix=API_PREFIX, tags=['metabot'])
+app.include_router(metrics_router, tags=['metrics'])
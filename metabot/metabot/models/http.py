@@ -0,0 +1,18 @@
+from typing import Dict
+
+from pydantic import BaseModel
+
+
+class HostPoolStats(BaseModel):
+    acquired: int = 0
+    idle: int = 0
+    waiting: int = 0
+
+
+class PoolStats(BaseModel):
+    limit: int
+    limit_per_host: int
+    acquired: int
+    idle: int
+    waiting: int
+    hosts: Dict[str, HostPoolStats]
@@ -6,6 +6,7 @@ SAMPLE_MODULE = {
     'name': 'help',
     'description': 'Help module',
     'url': 'http://help-module:8000',
+    'endpoints': ['http://help-module:8000'],
     'commands': {
         'me': {
             'name': 'me',
@@ -52,6 +53,8 @@ class Module(BaseModel):
     name: str = Field(regex=r'[\w\d]+', min_length=1, max_length=255)
     description: Optional[str]
     url: AnyHttpUrl
+    # Filled in by Metabot with the URLs of all the live module replicas
+    endpoints: Optional[List[AnyHttpUrl]]
 
     commands: Dict[str, Command]
     actions: List[str] = Field(default_factory=list)
@@ -69,3 +72,8 @@ class Module(BaseModel):
         schema_extra = {
             'example': SAMPLE_MODULE
         }
+
+
+class ModuleHeartbeat(BaseModel):
+    manifest_hash: str = Field(min_length=1, max_length=255)
+    url: AnyHttpUrl
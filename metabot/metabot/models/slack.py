@@ -1,7 +1,9 @@
 from enum import Enum
-from typing import Dict
+from typing import Dict, List, Optional, Any
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from metabot.core.config import SLACK_BATCH_SIZE
 
 
 class SlackMethod(str, Enum):
@@ -176,3 +178,29 @@ class SlackMethod(str, Enum):
 class SlackRequest(BaseModel):
     method: SlackMethod
     payload: Dict
+    # Responses of read-only methods are cached. Bypassing the cache neither
+    # reads nor updates it, refreshing it skips reading only.
+    bypass_cache: bool = False
+    refresh_cache: bool = False
+
+
+class SlackBatchRequest(BaseModel):
+    requests: List[SlackRequest] = Field(..., max_items=SLACK_BATCH_SIZE)
+
+
+class SlackBatchResult(BaseModel):
+    status_code: int
+    data: Optional[Dict]
+    error: Optional[Any]
+
+
+class SlackBatchResponse(BaseModel):
+    # Results are in the same order as the requests
+    results: List[SlackBatchResult]
+
+
+class SlackBucketStats(BaseModel):
+    waiting: int
+    tokens: float
+    blocked_for: float
+    rate_limited: int
@@ -1,5 +1,6 @@
-from typing import Iterable, Dict, Callable
-from unittest.mock import AsyncMock
+import os
+from typing import Iterable, Dict, Callable, AsyncIterable
+from unittest.mock import AsyncMock, MagicMock
 
 import aioredis
 import mockaioredis
@@ -14,7 +15,11 @@ environ['SLACK_API_TOKEN'] = 'test'
 environ['REDIS_URL'] = 'redis://localhost'
 
 from metabot.models.module import Module  # noqa E402
+from metabot.lib.storage import Storage  # noqa E402
 from metabot.lib.dispatchers import CommandDispatcher, ActionDispatcher  # noqa E402
+from metabot.lib import profiling  # noqa E402
+
+ADMIN_TOKEN = 'secret'
 
 
 @pytest.fixture
@@ -24,6 +29,9 @@ def redis(monkeypatch) -> None:
         'create_redis_pool',
         mockaioredis.create_redis_pool
     )
+    # mockaioredis doesn't support pub/sub, so the module cache stays disabled
+    monkeypatch.setattr(Storage, 'start', AsyncMock(name='start'))
+    monkeypatch.setattr(Storage, 'stop', AsyncMock(name='stop'))
 
 
 @pytest.fixture
@@ -38,6 +46,13 @@ def test_client(app: FastAPI) -> Iterable[Session]:
         yield client
 
 
+@pytest.fixture
+def admin_headers(monkeypatch) -> Iterable[Dict]:
+    monkeypatch.setattr(profiling, 'PROFILING_TOKEN', ADMIN_TOKEN)
+    yield {'Authorization': f'Bearer {ADMIN_TOKEN}'}
+    profiling.profiler.cancel()
+
+
 @pytest.fixture
 def module() -> Module:
     return Module(**{
@@ -103,3 +118,25 @@ def command_dispatcher() -> CommandDispatcher:
 @pytest.fixture
 def action_dispatcher() -> ActionDispatcher:
     return ActionDispatcher(AsyncMock())
+
+
+@pytest.fixture
+def storage() -> Storage:
+    redis = MagicMock()
+    redis.evalsha = AsyncMock()
+    redis.publish = AsyncMock()
+    return Storage(redis)
+
+
+@pytest.fixture
+async def redis_storage() -> AsyncIterable[Storage]:
+    # The registry scripts only run on a real Redis, which is flushed
+    # before and after every test
+    if not (url := os.environ.get('TEST_REDIS_URL')):
+        pytest.skip('TEST_REDIS_URL is not set')
+    redis = await aioredis.create_redis_pool(url)
+    await redis.flushdb()
+    yield Storage(redis)
+    await redis.flushdb()
+    redis.close()
+    await redis.wait_closed()
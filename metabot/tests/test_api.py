@@ -1,12 +1,23 @@
-from typing import Dict
-from unittest.mock import AsyncMock
+import asyncio
+import hmac
+import json
+from hashlib import sha256
+from time import time
+from typing import Dict, Callable, Any
+from unittest.mock import AsyncMock, MagicMock
+from urllib.parse import urlencode
 
-from fastapi import FastAPI
+import pytest
+import slackers.server
+from fastapi import FastAPI, HTTPException
 from requests import Session
+from slack.errors import SlackApiError
 
 from metabot.api.routes import slack
+from metabot.core.config import DISPATCH_LIMIT, DISPATCH_LIMIT_PER_HOST
+from metabot.lib.scheduler import SlackScheduler, SlackQueueTimeout
 from metabot.models.module import Module
-from metabot.models.slack import SlackRequest
+from metabot.models.slack import SlackRequest, SlackBatchResult
 
 
 def test_slack_request_invalid_method_fails(test_client: Session) -> None:
@@ -36,12 +47,255 @@ def test_slack_request(
 
     resp = test_client.post('/api/slack/', json=payload)
 
-    mock.assert_awaited_once_with(app.state.slack, SlackRequest(**payload))
+    mock.assert_awaited_once_with(
+        app.state.slack,
+        SlackRequest(**payload),
+        app.state.slack_scheduler,
+    )
 
     assert resp.status_code == 200
     assert resp.json() == {'data': mock.return_value.data}
 
 
+def test_slack_request_queue_timeout(
+        test_client: Session,
+        monkeypatch
+) -> None:
+    monkeypatch.setattr(
+        SlackScheduler,
+        'request',
+        AsyncMock(side_effect=SlackQueueTimeout(1.5)),
+    )
+
+    resp = test_client.post('/api/slack/', json={
+        'method': 'chat_postMessage',
+        'payload': {'text': 'test', 'channel': '#general'}
+    })
+    assert resp.status_code == 429
+    assert resp.headers['Retry-After'] == '2'
+
+
+def test_slack_request_cached(
+        test_client: Session,
+        monkeypatch
+) -> None:
+    class MockSlackResponse:
+        data = {'ok': True, 'team': {'id': 'T012HADR6QP'}}
+
+    mock = AsyncMock(name='slack_request', return_value=MockSlackResponse())
+    monkeypatch.setattr(slack, 'slack_request', mock)
+    payload = {'method': 'team_info', 'payload': {}}
+
+    for _ in range(2):
+        resp = test_client.post('/api/slack/', json=payload)
+        assert resp.json() == {'data': MockSlackResponse.data}
+    mock.assert_awaited_once()
+
+    resp = test_client.post('/api/slack/', json={
+        **payload,
+        'refresh_cache': True,
+    })
+    assert resp.status_code == 200
+    assert mock.await_count == 2
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_slack_batch_request(
+        test_client: Session,
+        monkeypatch,
+        stream: bool,
+) -> None:
+    class MockSlackResponse:
+        data = {'ok': True}
+
+    async def mock_slack_request(_, req: SlackRequest, __) -> Any:
+        if req.payload.get('channel') == 'missing':
+            raise HTTPException(404, 'channel_not_found')
+        if req.payload.get('channel') == 'broken':
+            raise ConnectionResetError
+        return MockSlackResponse()
+
+    monkeypatch.setattr(slack, 'slack_request', mock_slack_request)
+    requests = [
+        {'method': 'chat_postMessage', 'payload': {'channel': channel}}
+        for channel in ('C1', 'missing', 'broken', 'C2')
+    ]
+
+    resp = test_client.post(
+        '/api/slack/batch',
+        params={'stream': stream},
+        json={'requests': requests},
+    )
+    assert resp.status_code == 200
+    if stream:
+        results = [json.loads(x) for x in resp.text.splitlines()]
+    else:
+        results = resp.json()['results']
+    assert results == [
+        {'status_code': 200, 'data': {'ok': True}, 'error': None},
+        {'status_code': 404, 'data': None, 'error': 'channel_not_found'},
+        {'status_code': 500, 'data': None, 'error': 'internal_error'},
+        {'status_code': 200, 'data': {'ok': True}, 'error': None},
+    ]
+
+
+def test_slack_batch_request_slack_error(
+        test_client: Session,
+        monkeypatch
+) -> None:
+    response = MagicMock(status_code=200)
+    response.get.return_value = 'channel_not_found'
+    monkeypatch.setattr(
+        SlackScheduler,
+        'request',
+        AsyncMock(side_effect=SlackApiError('channel_not_found', response)),
+    )
+
+    resp = test_client.post('/api/slack/batch', json={'requests': [{
+        'method': 'chat_postMessage',
+        'payload': {'channel': 'missing'},
+    }]})
+    assert resp.json()['results'] == [
+        {'status_code': 400, 'data': None, 'error': 'channel_not_found'},
+    ]
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_slack_batch_stream_cancelled_on_disconnect() -> None:
+    async def result(delay: float) -> SlackBatchResult:
+        await asyncio.sleep(delay)
+        return SlackBatchResult(status_code=200, data={})
+
+    tasks = [asyncio.create_task(result(x)) for x in (0, 10)]
+    request = MagicMock()
+    request.is_disconnected = AsyncMock(return_value=True)
+
+    lines = [x async for x in slack._stream_results(request, tasks)]
+    assert len(lines) == 1
+    await asyncio.sleep(0)
+    assert tasks[1].cancelled()
+
+
+def test_slack_paginate(test_client: Session, monkeypatch) -> None:
+    requests = []
+
+    class MockSlackResponse:
+        def __init__(self, data: Dict) -> None:
+            self.data = data
+
+    async def mock_slack_request(_, req: SlackRequest, __) -> Any:
+        requests.append(req.payload)
+        cursor = req.payload.get('cursor')
+        if cursor == 'broken':
+            raise HTTPException(429, 'ratelimited')
+        page = int(cursor or 0)
+        return MockSlackResponse({
+            'members': [{'id': f'U{page}{i}'} for i in range(2)],
+            'response_metadata': {
+                'next_cursor': 'broken' if page == 2 else str(page + 1)
+            },
+        })
+
+    monkeypatch.setattr(slack, 'slack_request', mock_slack_request)
+
+    resp = test_client.post(
+        '/api/slack/paginate',
+        params={'limit': 3},
+        json={'method': 'users_list', 'payload': {}},
+    )
+    assert resp.status_code == 200
+    assert [json.loads(x) for x in resp.text.splitlines()] == [
+        {'item': {'id': 'U00'}},
+        {'item': {'id': 'U01'}},
+        {'item': {'id': 'U10'}},
+    ]
+    assert requests == [{'limit': 3}, {'limit': 1, 'cursor': '1'}]
+
+    requests.clear()
+    resp = test_client.post(
+        '/api/slack/paginate',
+        json={'method': 'users_list', 'payload': {'limit': 2}},
+    )
+    lines = [json.loads(x) for x in resp.text.splitlines()]
+    assert len(lines) == 7
+    assert lines[-1] == {'status_code': 429, 'error': 'ratelimited'}
+    assert requests[-1] == {'limit': 2, 'cursor': 'broken'}
+
+    resp = test_client.post(
+        '/api/slack/paginate',
+        json={'method': 'chat_postMessage', 'payload': {}},
+    )
+    assert resp.status_code == 422
+
+
+def test_slack_paginate_errors(test_client: Session, monkeypatch) -> None:
+    response = MagicMock(status_code=200)
+    response.get.return_value = 'invalid_cursor'
+    monkeypatch.setattr(SlackScheduler, 'request', AsyncMock(
+        side_effect=SlackApiError('invalid_cursor', response),
+    ))
+
+    resp = test_client.post('/api/slack/paginate', json={
+        'method': 'users_list',
+        'payload': {'cursor': 'invalid'},
+    })
+    assert resp.status_code == 400
+    assert resp.json() == {'detail': 'invalid_cursor'}
+
+    class MockSlackResponse:
+        data = {
+            'members': [{'id': 'U0'}],
+            'response_metadata': {'next_cursor': 'timeout'},
+        }
+
+    async def mock_slack_request(_, req: SlackRequest, __) -> Any:
+        if req.payload.get('cursor') == 'timeout':
+            raise asyncio.TimeoutError
+        return MockSlackResponse()
+
+    monkeypatch.setattr(slack, 'slack_request', mock_slack_request)
+    resp = test_client.post('/api/slack/paginate', json={
+        'method': 'users_list',
+        'payload': {},
+    })
+    assert [json.loads(x) for x in resp.text.splitlines()] == [
+        {'item': {'id': 'U0'}},
+        {'status_code': 500, 'error': 'internal_error'},
+    ]
+
+
+def test_get_metrics(test_client: Session, monkeypatch) -> None:
+    async def mock_slack_request(_, req: SlackRequest, __) -> Any:
+        raise HTTPException(404, 'channel_not_found')
+
+    monkeypatch.setattr(slack, 'slack_request', mock_slack_request)
+    test_client.post('/api/slack/', json={
+        'method': 'conversations_kick',
+        'payload': {'channel': 'missing'},
+    })
+
+    resp = test_client.get('/metrics')
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('text/plain')
+    lines = resp.text.splitlines()
+    assert (
+        'metabot_slack_proxy_errors_total'
+        '{method="conversations_kick",status_code="404"} 1.0'
+    ) in lines
+    assert (
+        'metabot_slack_proxy_seconds_count'
+        '{method="conversations_kick",outcome="error"} 1.0'
+    ) in lines
+    assert 'metabot_http_pool_limit{pool="dispatch"} 100.0' in lines
+
+
+def test_get_slack_queues(test_client: Session) -> None:
+    resp = test_client.get('/api/slack/queues')
+    assert resp.status_code == 200
+    assert resp.json() == {}
+
+
 def test_get_all_modules(
         test_client: Session,
         app: FastAPI,
@@ -60,10 +314,19 @@ def test_get_all_modules(
     mock.assert_awaited_once_with()
 
 
-def test_get_module_by_name_404(test_client: Session) -> None:
+def test_get_module_by_name_404(
+        test_client: Session,
+        app: FastAPI,
+        monkeypatch
+) -> None:
+    mock = AsyncMock(name='get_module', return_value=None)
+    monkeypatch.setattr(app.state.storage, 'get_module', mock)
+
     resp = test_client.get('/api/modules/kek')
     assert resp.status_code == 404
 
+    mock.assert_awaited_once_with('kek')
+
 
 def test_get_module_by_name(
         test_client: Session,
@@ -94,4 +357,73 @@ def test_register_module(
     assert resp.status_code == 200
     assert resp.json() == module.dict()
 
-    mock.assert_awaited_once_with(module)
+    mock.assert_awaited_once_with(module, None)
+
+
+def test_refresh_module(
+        test_client: Session,
+        app: FastAPI,
+        monkeypatch
+) -> None:
+    mock = AsyncMock(name='refresh_module', return_value=True)
+    monkeypatch.setattr(app.state.storage, 'refresh_module', mock)
+    heartbeat = {'manifest_hash': 'abc', 'url': 'http://help-module:8000'}
+
+    resp = test_client.post('/api/modules/help/heartbeat', json=heartbeat)
+    assert resp.status_code == 200
+    assert resp.json() == heartbeat
+
+    mock.assert_awaited_once_with('help', 'abc', heartbeat['url'])
+
+    mock.return_value = False
+    resp = test_client.post('/api/modules/help/heartbeat', json=heartbeat)
+    assert resp.status_code == 404
+
+
+def test_get_pools(test_client: Session) -> None:
+    resp = test_client.get('/api/pools/')
+    assert resp.status_code == 200
+
+    pools = resp.json()
+    assert set(pools) == {'slack', 'dispatch'}
+    assert pools['dispatch']['limit'] == DISPATCH_LIMIT
+    assert pools['dispatch']['limit_per_host'] == DISPATCH_LIMIT_PER_HOST
+    assert pools['dispatch']['acquired'] == 0
+
+
+def test_slack_retries_deduplicated(
+        test_client: Session,
+        test_command_payload: Callable,
+        monkeypatch
+) -> None:
+    mock = MagicMock(name='emit')
+    monkeypatch.setattr(slackers.server, 'emit', mock)
+    body = urlencode({
+        **test_command_payload('help'),
+        'token': 'token',
+        'team_id': 'T012HADR6QP',
+        'team_domain': 'metabot',
+        'channel_name': 'general',
+        'user_name': 'user',
+        'response_url': 'https://hooks.slack.com/commands/1',
+        'trigger_id': '1.2.3',
+    })
+
+    def post(retry_num: int) -> int:
+        timestamp = str(int(time()))
+        signature = hmac.new(
+            b'test',
+            f'v0:{timestamp}:{body}'.encode('utf-8'),
+            sha256,
+        ).hexdigest()
+        resp = test_client.post('/slack/commands', data=body, headers={
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'X-Slack-Request-Timestamp': timestamp,
+            'X-Slack-Signature': f'v0={signature}',
+            **({'X-Slack-Retry-Num': str(retry_num)} if retry_num else {}),
+        })
+        return resp.status_code
+
+    assert post(0) == 200
+    assert post(1) == 200
+    mock.assert_called_once()
@@ -0,0 +1,86 @@
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+from metabot.lib.balancers import (
+    Balancer,
+    RoundRobinBalancer,
+    LeastInFlightBalancer,
+    EwmaLatencyBalancer,
+)
+from metabot.models.module import Module
+
+ENDPOINTS = ['http://help-1:8000', 'http://help-2:8000', 'http://help-3:8000']
+
+
+def _scaled(module: Module) -> Module:
+    return Module(**{**jsonable_encoder(module), 'endpoints': ENDPOINTS})
+
+
+def test_round_robin(module: Module) -> None:
+    balancer = RoundRobinBalancer()
+    module = _scaled(module)
+
+    chosen = [balancer.choose(module) for _ in range(len(ENDPOINTS) * 2)]
+    assert chosen == ENDPOINTS * 2
+
+
+def test_round_robin_without_endpoints(module: Module) -> None:
+    balancer = RoundRobinBalancer()
+    assert balancer.choose(module) == module.url
+
+
+def test_endpoint_tracks_in_flight(module: Module) -> None:
+    balancer = RoundRobinBalancer()
+    module = _scaled(module)
+
+    with balancer.endpoint(module) as endpoint:
+        assert balancer.in_flight == {endpoint: 1}
+    assert balancer.in_flight == {}
+
+
+def test_least_in_flight(module: Module) -> None:
+    balancer = LeastInFlightBalancer()
+    module = _scaled(module)
+    balancer.in_flight = {ENDPOINTS[0]: 2, ENDPOINTS[1]: 1}
+
+    assert balancer.choose(module) == ENDPOINTS[2]
+
+    balancer.in_flight[ENDPOINTS[2]] = 3
+    assert balancer.choose(module) == ENDPOINTS[1]
+
+
+def test_ewma_latency(module: Module) -> None:
+    balancer = EwmaLatencyBalancer()
+    module = _scaled(module)
+    balancer.observe(ENDPOINTS[0], 1.0)
+    balancer.observe(ENDPOINTS[1], 0.5)
+
+    # endpoints without latency are tried first
+    assert balancer.choose(module) == ENDPOINTS[2]
+
+    balancer.observe(ENDPOINTS[2], 0.1)
+    assert balancer.choose(module) == ENDPOINTS[2]
+
+    balancer.observe(ENDPOINTS[2], 2.0)
+    assert balancer.latency[ENDPOINTS[2]] == 0.1 + balancer.alpha * 1.9
+    assert balancer.choose(module) == ENDPOINTS[1]
+
+
+def test_ewma_latency_failures(module: Module) -> None:
+    balancer = EwmaLatencyBalancer()
+    module = _scaled(module)
+    for endpoint in ENDPOINTS:
+        balancer.observe(endpoint, 0.5)
+
+    with pytest.raises(ConnectionRefusedError):
+        with balancer.endpoint(module) as failing:
+            raise ConnectionRefusedError
+
+    assert balancer.latency[failing] > 0.5
+    chosen = [balancer.choose(module) for _ in range(len(ENDPOINTS) * 2)]
+    assert failing not in chosen
+
+
+def test_balancer_is_abstract() -> None:
+    with pytest.raises(TypeError):
+        Balancer()  # type: ignore
@@ -0,0 +1,54 @@
+import pytest
+
+from benchmarks.stats import Recorder, percentile, compare
+
+
+def test_percentile() -> None:
+    values = [float(x) for x in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([1.0], 95) == 1
+    assert percentile([], 50) == 0
+
+
+class Stage:
+    async def run(self, fail: bool) -> str:
+        if fail:
+            raise ValueError
+        return 'ok'
+
+
+@pytest.mark.asyncio
+async def test_recorder() -> None:
+    recorder = Recorder()
+    recorder.instrument(Stage, 'run', 'stage')
+    try:
+        assert await Stage().run(False) == 'ok'
+        with pytest.raises(ValueError):
+            await Stage().run(True)
+    finally:
+        recorder.restore()
+    await Stage().run(False)
+
+    report = recorder.report(elapsed=2)
+    assert report['stage']['count'] == 2
+    assert report['stage']['errors'] == 1
+    assert report['stage']['throughput'] == 1
+    assert report['stage']['p50'] <= report['stage']['max']
+
+
+def test_compare() -> None:
+    baseline = {
+        'fast': {'p95': 0.1, 'p99': 0.2, 'errors': 0},
+        'slow': {'p95': 10, 'p99': 20, 'errors': 0},
+        'gone': {'p95': 1, 'p99': 1, 'errors': 0},
+    }
+    report = {
+        'fast': {'p95': 0.3, 'p99': 0.4, 'errors': 0},
+        'slow': {'p95': 12, 'p99': 30, 'errors': 1},
+    }
+    assert compare(baseline, report, tolerance=0.25, min_delta=0.5) == [
+        'gone: missing',
+        'slow: p99 30.00 ms, baseline 20.00 ms',
+        'slow: 1 errors, baseline 0',
+    ]
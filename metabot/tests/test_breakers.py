@@ -0,0 +1,57 @@
+from unittest.mock import MagicMock, AsyncMock
+
+import pytest
+from aioredis import RedisError
+
+from metabot.lib.breakers import CircuitBreaker
+
+
+@pytest.fixture
+def breaker() -> CircuitBreaker:
+    redis = MagicMock()
+    redis.evalsha = AsyncMock()
+    return CircuitBreaker(redis)
+
+
+@pytest.mark.parametrize('result, allowed', [
+    (0, False),
+    (1, True),
+])
+@pytest.mark.asyncio
+async def test_allow(
+        breaker: CircuitBreaker,
+        result: int,
+        allowed: bool,
+) -> None:
+    breaker.redis.evalsha.return_value = result
+    assert await breaker.allow('help') is allowed
+    assert breaker.redis.evalsha.call_args[1]['keys'] == ['breaker:help']
+
+
+@pytest.mark.asyncio
+async def test_allow_fails_open(breaker: CircuitBreaker) -> None:
+    breaker.redis.evalsha.side_effect = RedisError
+    assert await breaker.allow('help')
+
+
+@pytest.mark.parametrize('elapsed, failed, recorded', [
+    (0.1, False, 0),
+    (0.1, True, 1),
+    (60, False, 1),
+])
+@pytest.mark.asyncio
+async def test_record(
+        breaker: CircuitBreaker,
+        elapsed: float,
+        failed: bool,
+        recorded: int,
+) -> None:
+    breaker.redis.evalsha.return_value = b'closed'
+    await breaker.record('help', elapsed, failed)
+    assert breaker.redis.evalsha.call_args[1]['args'][1] == recorded
+
+
+@pytest.mark.asyncio
+async def test_record_ignores_redis_errors(breaker: CircuitBreaker) -> None:
+    breaker.redis.evalsha.side_effect = RedisError
+    await breaker.record('help', 0.1, failed=True)
@@ -0,0 +1,85 @@
+from typing import Dict
+from unittest.mock import MagicMock, AsyncMock
+
+import mockaioredis
+import pytest
+from aioredis import RedisError
+
+from metabot.lib.cache import SlackCache
+from metabot.models.slack import SlackRequest
+
+
+@pytest.fixture
+async def cache() -> SlackCache:
+    redis = await mockaioredis.create_redis_pool('redis://localhost')
+    return SlackCache(redis)
+
+
+@pytest.fixture
+def users_info() -> SlackRequest:
+    return SlackRequest(
+        method='users_info',
+        payload={'user': 'U012HADR6QP', 'include_locale': True},
+    )
+
+
+@pytest.fixture
+def data() -> Dict:
+    return {'ok': True, 'user': {'id': 'U012HADR6QP'}}
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_cache_shared(
+        cache: SlackCache,
+        users_info: SlackRequest,
+        data: Dict,
+) -> None:
+    assert await cache.get_response(users_info) is None
+    await cache.store_response(users_info, data)
+    cache._local.clear()
+
+    reordered = SlackRequest(
+        method='users_info',
+        payload={'include_locale': True, 'user': 'U012HADR6QP'},
+    )
+    assert await cache.get_response(reordered) == data
+    assert len(cache._local) == 1
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_cache_local(
+        cache: SlackCache,
+        users_info: SlackRequest,
+        data: Dict,
+) -> None:
+    await cache.store_response(users_info, data)
+    cache.redis = MagicMock()
+    cache.redis.get = AsyncMock(side_effect=RedisError)
+
+    assert await cache.get_response(users_info) == data
+    cache.redis.get.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_cache_flags(
+        cache: SlackCache,
+        users_info: SlackRequest,
+        data: Dict,
+) -> None:
+    bypass = users_info.copy(update={'bypass_cache': True})
+    await cache.store_response(bypass, data)
+    assert await cache.get_response(users_info) is None
+
+    refresh = users_info.copy(update={'refresh_cache': True})
+    await cache.store_response(refresh, data)
+    assert await cache.get_response(refresh) is None
+    assert await cache.get_response(users_info) == data
+
+
+@pytest.mark.asyncio
+async def test_cache_read_only_methods(cache: SlackCache, data: Dict) -> None:
+    req = SlackRequest(method='chat_postMessage', payload={'text': 'test'})
+    await cache.store_response(req, data)
+    assert await cache.get_response(req) is None
@@ -1,9 +1,16 @@
+import asyncio
 from typing import Callable, Dict
-from unittest.mock import AsyncMock
+from time import time
+from unittest.mock import AsyncMock, ANY, MagicMock
 
 import pytest
 
+from prometheus_client import REGISTRY
+
+from metabot.lib.balancers import RoundRobinBalancer
 from metabot.lib.dispatchers import CommandDispatcher, ActionDispatcher
+from metabot.lib.scheduler import SlackQueueTimeout
+from metabot.lib.tracing import start_span
 from metabot.models.module import Module
 
 
@@ -27,6 +34,130 @@ async def test_command_dispatcher_dispatch(
     )
 
 
+@pytest.mark.asyncio
+async def test_command_dispatcher_dispatch_timeout(
+        command_dispatcher: CommandDispatcher,
+        module: Module,
+        test_command_payload: Callable,
+        monkeypatch
+) -> None:
+    mock_trigger = AsyncMock(side_effect=asyncio.TimeoutError)
+    mock_error = AsyncMock()
+    monkeypatch.setattr(command_dispatcher, '_trigger_command', mock_trigger)
+    monkeypatch.setattr(command_dispatcher, '_error', mock_error)
+    command_dispatcher.storage.get_module.return_value = module
+    payload = test_command_payload('help me 123')
+
+    await command_dispatcher.dispatch(payload)
+    mock_error.assert_awaited_once()
+    assert command_dispatcher.breaker.record.call_args[1]['failed']
+
+
+@pytest.mark.asyncio
+async def test_command_dispatcher_dispatch_breaker_open(
+        command_dispatcher: CommandDispatcher,
+        module: Module,
+        test_command_payload: Callable,
+        monkeypatch
+) -> None:
+    mock_trigger = AsyncMock()
+    mock_error = AsyncMock()
+    monkeypatch.setattr(command_dispatcher, '_trigger_command', mock_trigger)
+    monkeypatch.setattr(command_dispatcher, '_error', mock_error)
+    command_dispatcher.storage.get_module.return_value = module
+    command_dispatcher.breaker.allow.return_value = False
+
+    await command_dispatcher.dispatch(test_command_payload('help me 123'))
+    mock_trigger.assert_not_awaited()
+    mock_error.assert_awaited_once()
+    command_dispatcher.breaker.record.assert_not_awaited()
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_command_dispatcher_error_not_sent(
+        command_dispatcher: CommandDispatcher,
+        test_command_payload: Callable,
+) -> None:
+    scheduler = command_dispatcher.slack_scheduler
+    scheduler.request.side_effect = SlackQueueTimeout(1)
+
+    await command_dispatcher._error(test_command_payload('help'), 'Error')
+    scheduler.request.assert_awaited_once()
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_command_dispatcher_trigger_trace_context(
+        command_dispatcher: CommandDispatcher,
+        module: Module,
+        test_command_payload: Callable,
+) -> None:
+    command_dispatcher.balancer = RoundRobinBalancer()
+    command_dispatcher.session = MagicMock()
+    post = command_dispatcher.session.post
+    post.return_value.__aenter__.return_value = MagicMock(status=200)
+
+    with start_span('request') as parent:
+        await command_dispatcher._trigger_command(
+            module,
+            module.commands['me'],
+            ['123'],
+            test_command_payload('help me 123'),
+        )
+
+    # The payload and the header carry the same context of the client span
+    traceparent = post.call_args[1]['json']['traceparent']
+    assert traceparent == post.call_args[1]['headers']['traceparent']
+    assert traceparent.split('-')[1] == parent.trace_id
+    assert traceparent != parent.traceparent
+
+
+def _dispatch_seconds(suffix: str, **labels: str) -> float:
+    return REGISTRY.get_sample_value(
+        f'metabot_dispatch_seconds_{suffix}',
+        {'kind': 'command', **labels},
+    ) or 0
+
+
+@pytest.mark.asyncio
+async def test_command_dispatcher_deliver_latency(
+        command_dispatcher: CommandDispatcher,
+        module: Module,
+        test_command_payload: Callable,
+        monkeypatch
+) -> None:
+    monkeypatch.setattr(command_dispatcher, '_trigger_command', AsyncMock())
+    monkeypatch.setattr(command_dispatcher, '_error', AsyncMock())
+    command_dispatcher.storage.get_module.return_value = module
+    labels = {'module': module.name, 'name': 'me'}
+    ok_sum = _dispatch_seconds('sum', outcome='ok', **labels)
+    unavailable = _dispatch_seconds('count', outcome='unavailable', **labels)
+    invalid = _dispatch_seconds('count', outcome='invalid', module='', name='')
+
+    # Time spent in the dispatch queue counts as well
+    await command_dispatcher.deliver(
+        test_command_payload('help me 123'),
+        time() - 5,
+    )
+    command_dispatcher.breaker.allow.return_value = False
+    await command_dispatcher.deliver(test_command_payload('help me 123'))
+    await command_dispatcher.deliver(test_command_payload(''))
+
+    assert _dispatch_seconds('sum', outcome='ok', **labels) - ok_sum >= 5
+    assert _dispatch_seconds(
+        'count',
+        outcome='unavailable',
+        **labels,
+    ) == unavailable + 1
+    assert _dispatch_seconds(
+        'count',
+        outcome='invalid',
+        module='',
+        name='',
+    ) == invalid + 1
+
+
 # noinspection PyProtectedMember
 @pytest.mark.asyncio
 async def test_command_dispatcher_parse(
@@ -85,7 +216,8 @@ async def test_action_dispatcher_dispatch_actions(
 
     mock.assert_awaited_once_with(
         {'block_actions:action_id', 'block_actions:callback_id'},
-        test_action_payload
+        test_action_payload,
+        ANY,
     )
 
 
@@ -102,7 +234,8 @@ async def test_action_dispatcher_dispatch_views(
 
     mock.assert_awaited_once_with(
         {'view_submission:callback_id'},
-        test_view_payload
+        test_view_payload,
+        ANY,
     )
 
 
@@ -115,14 +248,43 @@ async def test_action_dispatcher_trigger_all_actions(
 ) -> None:
     mock = AsyncMock()
     monkeypatch.setattr(action_dispatcher, '_trigger_action', mock)
-    action_dispatcher.storage.get_module_by_action.return_value = module
 
     action_ids = {
         'block_actions:action_id',
         'block_actions:callback_id',
         'view_submission:callback_id'
     }
+    action_dispatcher.storage.get_modules_by_actions.return_value = {
+        action_id: module for action_id in action_ids
+    }
     payload = {}
-    await action_dispatcher._trigger_all_actions(action_ids, payload)
+    await action_dispatcher._trigger_all_actions(action_ids, payload, time())
 
+    action_dispatcher.storage.get_modules_by_actions.assert_awaited_once_with(
+        action_ids
+    )
     assert mock.await_count == len(action_ids)
+
+
+@pytest.mark.asyncio
+async def test_action_dispatcher_deliver(
+        action_dispatcher: ActionDispatcher,
+        module: Module,
+        test_action_payload: Dict,
+        monkeypatch
+) -> None:
+    mock = AsyncMock()
+    monkeypatch.setattr(action_dispatcher, '_trigger_action', mock)
+    action_dispatcher.storage.get_module_by_action.return_value = module
+
+    await action_dispatcher.deliver(
+        'block_actions:action_id',
+        test_action_payload,
+        ANY,
+    )
+    mock.assert_awaited_once_with(
+        module,
+        'block_actions:action_id',
+        test_action_payload,
+        ANY,
+    )
@@ -0,0 +1,37 @@
+from typing import Dict
+
+from fastapi import FastAPI
+from fastapi_metabot.loop_monitor import LoopMonitor
+from requests import Session
+from starlette.testclient import TestClient
+
+from metabot.lib.metrics import EVENT_LOOP_LAG_SECONDS
+
+
+def test_get_loop_disabled(test_client: Session, admin_headers: Dict) -> None:
+    resp = test_client.get('/api/debug/loop', headers=admin_headers)
+    assert resp.status_code == 404
+
+
+def test_get_loop_without_admin_token(test_client: Session) -> None:
+    # Without an admin token the endpoint doesn't exist at all
+    resp = test_client.get('/api/debug/loop')
+    assert resp.status_code == 404
+
+
+def test_get_loop(app: FastAPI, admin_headers: Dict, monkeypatch) -> None:
+    from metabot.core import event_handlers
+
+    monkeypatch.setattr(event_handlers, 'LOOP_MONITOR', True)
+
+    with TestClient(app) as client:
+        monitor = app.state.loop_monitor
+        assert isinstance(monitor, LoopMonitor)
+        # Lags are observed by the Prometheus histogram as well
+        assert monitor.on_lag == EVENT_LOOP_LAG_SECONDS.observe
+
+        resp = client.get('/api/debug/loop')
+        assert resp.status_code == 403
+        resp = client.get('/api/debug/loop', headers=admin_headers)
+        assert resp.status_code == 200
+        assert resp.json()['stats'] == monitor.stats.dict()
@@ -0,0 +1,70 @@
+from time import time
+
+import pytest
+from prometheus_client import CollectorRegistry, Gauge, Histogram
+
+from metabot.lib.metrics import track, track_since
+
+
+@pytest.fixture
+def registry() -> CollectorRegistry:
+    return CollectorRegistry()
+
+
+@pytest.fixture
+def histogram(registry: CollectorRegistry) -> Histogram:
+    return Histogram(
+        'test_seconds',
+        'Test histogram',
+        ['name', 'outcome'],
+        buckets=[0.1, 1],
+        registry=registry,
+    )
+
+
+def test_track(registry: CollectorRegistry, histogram: Histogram) -> None:
+    in_flight = Gauge(
+        'test_in_flight',
+        'Test gauge',
+        ['name'],
+        registry=registry,
+    )
+    with track(histogram, in_flight, name='test'):
+        assert registry.get_sample_value(
+            'test_in_flight',
+            {'name': 'test'},
+        ) == 1
+    with pytest.raises(ValueError):
+        with track(histogram, in_flight, name='test'):
+            raise ValueError
+
+    assert registry.get_sample_value('test_in_flight', {'name': 'test'}) == 0
+    for outcome in ('ok', 'error'):
+        assert registry.get_sample_value(
+            'test_seconds_count',
+            {'name': 'test', 'outcome': outcome},
+        ) == 1
+
+
+def test_track_since(
+        registry: CollectorRegistry,
+        histogram: Histogram,
+) -> None:
+    with track_since(histogram, time() - 0.5, name='') as labels:
+        labels['name'] = 'late'
+    with pytest.raises(ValueError):
+        with track_since(histogram, name='test'):
+            raise ValueError
+
+    assert registry.get_sample_value(
+        'test_seconds_bucket',
+        {'name': 'late', 'outcome': 'ok', 'le': '0.1'},
+    ) == 0
+    assert registry.get_sample_value(
+        'test_seconds_count',
+        {'name': 'late', 'outcome': 'ok'},
+    ) == 1
+    assert registry.get_sample_value(
+        'test_seconds_count',
+        {'name': 'test', 'outcome': 'error'},
+    ) == 1
@@ -0,0 +1,38 @@
+from requests import Session
+
+
+def test_profile_disabled(test_client: Session) -> None:
+    resp = test_client.post('/api/debug/profile', json={})
+    assert resp.status_code == 404
+
+
+def test_profile_api(test_client: Session, admin_headers: dict) -> None:
+    resp = test_client.post('/api/debug/profile', json={'module': 'help'})
+    assert resp.status_code == 403
+
+    resp = test_client.post(
+        '/api/debug/profile',
+        json={'module': 'help', 'requests': 2},
+        headers=admin_headers,
+    )
+    assert resp.status_code == 200
+    assert resp.json()['requests'] == 2
+
+    resp = test_client.get('/api/debug/profile/status', headers=admin_headers)
+    assert resp.json()['done'] is False
+
+    resp = test_client.get(
+        '/api/debug/profile',
+        params={'format': 'speedscope', 'mode': 'cpu'},
+        headers=admin_headers,
+    )
+    assert resp.status_code == 200
+    assert resp.json()['profiles'][0]['type'] == 'sampled'
+
+    resp = test_client.get('/api/debug/profile', headers=admin_headers)
+    assert resp.headers['content-type'].startswith('text/plain')
+
+    resp = test_client.delete('/api/debug/profile', headers=admin_headers)
+    assert resp.status_code == 200
+    resp = test_client.get('/api/debug/profile', headers=admin_headers)
+    assert resp.status_code == 404
@@ -0,0 +1,142 @@
+import json
+from typing import Dict, Callable
+from unittest.mock import AsyncMock, MagicMock, ANY
+
+import pytest
+
+from metabot.lib.dispatchers import ActionDispatcher
+from metabot.lib.queues import DispatchQueue, QUEUE_STREAM, DEAD_LETTER_STREAM
+from metabot.lib.tracing import start_span
+
+
+@pytest.fixture
+def dispatch_queue() -> DispatchQueue:
+    app = MagicMock()
+    app.state.redis.xadd = AsyncMock()
+    app.state.redis.xack = AsyncMock()
+    app.state.command_dispatcher = AsyncMock()
+    app.state.action_dispatcher = AsyncMock()
+    app.state.action_dispatcher.get_action_ids = ActionDispatcher.get_action_ids
+    return DispatchQueue(app)
+
+
+@pytest.mark.asyncio
+async def test_enqueue_actions(
+        dispatch_queue: DispatchQueue,
+        test_action_payload: Dict,
+) -> None:
+    await dispatch_queue.enqueue_actions(test_action_payload)
+
+    xadd = dispatch_queue.redis.xadd
+    assert xadd.await_count == 2
+    assert {call[0][1]['action_id'] for call in xadd.call_args_list} == {
+        'block_actions:action_id',
+        'block_actions:callback_id',
+    }
+    assert {call[0][0] for call in xadd.call_args_list} == {QUEUE_STREAM}
+    assert all('received_at' in call[0][1] for call in xadd.call_args_list)
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_deliver(
+        dispatch_queue: DispatchQueue,
+        test_command_payload: Callable,
+        test_action_payload: Dict,
+) -> None:
+    command_payload = test_command_payload('help me 123')
+    await dispatch_queue._deliver({
+        b'kind': b'command',
+        b'payload': json.dumps(command_payload).encode('utf-8'),
+        b'received_at': b'1590000000.5',
+    })
+    await dispatch_queue._deliver({
+        b'kind': b'action',
+        b'action_id': b'block_actions:action_id',
+        b'payload': json.dumps(test_action_payload).encode('utf-8'),
+    })
+
+    dispatch_queue.command_dispatcher.deliver.assert_awaited_once_with(
+        command_payload,
+        1590000000.5,
+    )
+    dispatch_queue.action_dispatcher.deliver.assert_awaited_once_with(
+        'block_actions:action_id',
+        test_action_payload,
+        ANY,
+    )
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_dead_letter(
+        dispatch_queue: DispatchQueue,
+        test_command_payload: Callable,
+) -> None:
+    payload = test_command_payload('help me 123')
+    await dispatch_queue._dead_letter((b'1-0', {
+        b'kind': b'command',
+        b'payload': json.dumps(payload).encode('utf-8'),
+    }), 5)
+
+    assert dispatch_queue.redis.xadd.call_args[0][0] == DEAD_LETTER_STREAM
+    dispatch_queue.redis.xack.assert_awaited_once()
+    dispatch_queue.command_dispatcher.fail.assert_awaited_once_with(payload)
+
+
+@pytest.mark.asyncio
+async def test_enqueue_trace_context(
+        dispatch_queue: DispatchQueue,
+        test_command_payload: Callable,
+) -> None:
+    with start_span('request') as span:
+        await dispatch_queue.enqueue_command(test_command_payload('help'))
+
+    fields = dispatch_queue.redis.xadd.call_args[0][1]
+    assert fields['traceparent'] == span.traceparent
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_find_retries_skips_local_messages(
+        dispatch_queue: DispatchQueue,
+) -> None:
+    dispatch_queue.redis.xpending = AsyncMock(return_value=[
+        (b'1-0', b'consumer', 60000, 1),
+        (b'2-0', b'consumer', 60000, 1),
+        (b'3-0', b'consumer', 0, 1),
+    ])
+    dispatch_queue._local.add(b'2-0')
+
+    await dispatch_queue._find_retries()
+    await dispatch_queue._find_retries()
+    assert dispatch_queue._retries.qsize() == 1
+    assert dispatch_queue._retries.get_nowait() == (b'1-0', 1)
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_retries_are_claimed_before_delivery(
+        dispatch_queue: DispatchQueue,
+        test_command_payload: Callable,
+) -> None:
+    fields = {
+        b'kind': b'command',
+        b'payload': json.dumps(test_command_payload('help')).encode('utf-8'),
+    }
+    # Another replica has claimed the first message in the meantime
+    dispatch_queue.redis.xclaim = AsyncMock(side_effect=[
+        [],
+        [(b'2-0', fields)],
+        [(b'3-0', fields)],
+    ])
+    dispatch_queue._retries.put_nowait((b'1-0', 1))
+    dispatch_queue._retries.put_nowait((b'2-0', 1))
+    dispatch_queue._retries.put_nowait((b'3-0', 5))
+
+    assert await dispatch_queue._next_message() == (b'2-0', fields)
+    dispatch_queue._blocking_redis = MagicMock()
+    dispatch_queue._blocking_redis.xread_group = AsyncMock(return_value=[])
+    assert await dispatch_queue._next_message() is None
+    assert dispatch_queue.redis.xadd.call_args[0][0] == DEAD_LETTER_STREAM
+    assert not dispatch_queue._local
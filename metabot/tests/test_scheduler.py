@@ -0,0 +1,134 @@
+import asyncio
+from typing import List
+from unittest.mock import MagicMock, AsyncMock
+
+import pytest
+from slack.errors import SlackApiError
+
+from metabot.lib.scheduler import (
+    SlackScheduler,
+    SlackQueueTimeout,
+    TokenBucket,
+)
+from metabot.models.slack import SlackMethod
+
+
+@pytest.fixture
+def slack() -> MagicMock:
+    slack = MagicMock()
+    slack.token = 'test'
+    return slack
+
+
+def _rate_limited(retry_after: str) -> SlackApiError:
+    response = MagicMock()
+    response.status_code = 429
+    response.headers = {'Retry-After': retry_after}
+    return SlackApiError('ratelimited', response)
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_priorities() -> None:
+    bucket = TokenBucket(requests_per_minute=600)
+    bucket.tokens = 0
+    order: List[int] = []
+
+    async def acquire(priority: int) -> None:
+        await bucket.acquire(priority)
+        order.append(priority)
+
+    await asyncio.gather(acquire(1), acquire(1), acquire(0))
+    assert order == [0, 1, 1]
+    assert bucket.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_block() -> None:
+    bucket = TokenBucket(requests_per_minute=6000)
+    bucket.block(0.2)
+
+    assert bucket.delay() > 0.1
+    assert bucket.rate_limited == 1
+
+
+@pytest.mark.asyncio
+async def test_request_retries_rate_limited(slack: MagicMock) -> None:
+    slack.users_info = AsyncMock(side_effect=[_rate_limited('0.1'), 'ok'])
+    scheduler = SlackScheduler()
+
+    response = await scheduler.request(
+        slack,
+        SlackMethod.USERS_INFO,
+        {'user': 'U012HADR6QP'},
+    )
+    assert response == 'ok'
+    assert slack.users_info.await_count == 2
+
+    stats, = scheduler.get_stats().values()
+    assert stats['tier4'].rate_limited == 1
+
+
+@pytest.mark.asyncio
+async def test_request_raises_other_errors(slack: MagicMock) -> None:
+    error = _rate_limited('0')
+    error.response.status_code = 404
+    slack.users_info = AsyncMock(side_effect=error)
+
+    with pytest.raises(SlackApiError):
+        await SlackScheduler().request(slack, SlackMethod.USERS_INFO, {})
+    slack.users_info.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_max_wait() -> None:
+    bucket = TokenBucket(requests_per_minute=60)
+    bucket.tokens = 0
+
+    with pytest.raises(SlackQueueTimeout) as e:
+        await bucket.acquire(1, max_wait=0.5)
+    assert e.value.retry_after == pytest.approx(1, abs=0.1)
+    assert bucket.waiting == 0
+
+    # Higher priority requests get ahead of queued ones
+    bucket = TokenBucket(requests_per_minute=600)
+    bucket.tokens = 0
+    waiter = asyncio.create_task(bucket.acquire(1, max_wait=0.15))
+    await asyncio.sleep(0)
+    await bucket.acquire(0, max_wait=0.15)
+    with pytest.raises(SlackQueueTimeout):
+        await waiter
+
+
+@pytest.mark.asyncio
+async def test_request_buckets_per_channel(slack: MagicMock) -> None:
+    slack.chat_postMessage = AsyncMock(return_value='ok')
+    scheduler = SlackScheduler(max_wait=0)
+
+    for i in range(20):
+        await scheduler.request(
+            slack,
+            SlackMethod.CHAT_POSTMESSAGE,
+            {'channel': f'U{i}', 'text': 'hi'},
+        )
+    assert slack.chat_postMessage.await_count == 20
+
+    stats, = scheduler.get_stats().values()
+    assert len(stats) == 20
+    assert stats['special:U0'].tokens < 10
+
+
+@pytest.mark.asyncio
+async def test_request_rejected_when_queue_is_too_long(
+        slack: MagicMock,
+) -> None:
+    slack.chat_postMessage = AsyncMock(return_value='ok')
+    scheduler = SlackScheduler(max_wait=3)
+    payload = {'channel': 'U0', 'text': 'hi'}
+
+    # The burst goes right away, the next request would wait for a second
+    for _ in range(10):
+        await scheduler.request(slack, SlackMethod.CHAT_POSTMESSAGE, payload)
+    scheduler.max_wait = 0.5
+    with pytest.raises(SlackQueueTimeout):
+        await scheduler.request(slack, SlackMethod.CHAT_POSTMESSAGE, payload)
+    assert slack.chat_postMessage.await_count == 10
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from metabot.lib.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_coalesced() -> None:
+    singleflight = SingleFlight()
+    calls = []
+
+    async def call() -> int:
+        calls.append(None)
+        call_number = len(calls)
+        await asyncio.sleep(0.01)
+        return call_number
+
+    results = await asyncio.gather(
+        singleflight.do('users_info:a', call),
+        singleflight.do('users_info:a', call),
+        singleflight.do('users_info:b', call),
+    )
+    assert results == [1, 1, 2]
+    assert singleflight.in_flight == 0
+
+    assert await singleflight.do('users_info:a', call) == 3
+
+
+@pytest.mark.asyncio
+async def test_exceptions_shared() -> None:
+    singleflight = SingleFlight()
+
+    async def call() -> None:
+        await asyncio.sleep(0.01)
+        raise ValueError
+
+    results = await asyncio.gather(
+        singleflight.do('users_info:a', call),
+        singleflight.do('users_info:a', call),
+        return_exceptions=True,
+    )
+    assert all(isinstance(x, ValueError) for x in results)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_call() -> None:
+    singleflight = SingleFlight()
+
+    async def call() -> str:
+        await asyncio.sleep(0.01)
+        return 'ok'
+
+    first = asyncio.ensure_future(singleflight.do('users_info:a', call))
+    second = asyncio.ensure_future(singleflight.do('users_info:a', call))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == 'ok'
@@ -0,0 +1,310 @@
+from time import time
+from typing import List, Any
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+from metabot.core.config import MODULE_EXPIRATION_SECONDS
+from metabot.lib import storage as storage_module
+from metabot.lib.storage import (
+    Storage,
+    INVALIDATION_CHANNEL,
+    MODULES_KEY,
+    ACTIONS_KEY,
+    HASHES_KEY,
+    ENDPOINTS_KEY_PREFIX,
+)
+from metabot.models.module import Module
+
+
+def _raw_module(module: Module) -> bytes:
+    return Storage._encode_module(module).encode('utf-8')  # noqa
+
+
+def _result(module: Module, *expirations: float) -> List:
+    endpoints = []
+    for i, expires_at in enumerate(expirations):
+        endpoints += [f'http://{i}', str(expires_at)]
+
+    return [
+        module.name.encode('utf-8'),
+        _raw_module(module),
+        [x.encode('utf-8') for x in endpoints],
+    ]
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_get_module_cached(storage: Storage, module: Module) -> None:
+    evalsha = storage.redis.evalsha
+    evalsha.return_value = [_result(module, time() + 30)]
+    storage._subscribed = True
+
+    assert (await storage.get_module(module.name)).name == module.name
+    assert (await storage.get_module(module.name)).name == module.name
+    evalsha.assert_awaited_once()
+
+    storage._invalidate(module.name)
+    await storage.get_module(module.name)
+    assert evalsha.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_module_not_cached_without_subscription(
+        storage: Storage,
+        module: Module,
+) -> None:
+    evalsha = storage.redis.evalsha
+    evalsha.return_value = [_result(module, time() + 30)]
+
+    await storage.get_module(module.name)
+    await storage.get_module(module.name)
+    assert evalsha.await_count == 2
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_get_module_cache_expires_with_first_endpoint(
+        storage: Storage,
+        module: Module,
+) -> None:
+    evalsha = storage.redis.evalsha
+    evalsha.return_value = [_result(module, time() + 30, time() + 10)]
+    storage._subscribed = True
+
+    await storage.get_module(module.name)
+    expires_at, _ = storage._cache[module.name]
+    assert time() < expires_at < time() + 10
+
+    storage._cache[module.name] = (0, module)
+    await storage.get_module(module.name)
+    assert evalsha.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_module_endpoints(storage: Storage, module: Module) -> None:
+    storage.redis.evalsha.return_value = [
+        _result(module, time() + 30, time() + 10)
+    ]
+
+    result = await storage.get_module(module.name)
+    assert result.endpoints == ['http://0', 'http://1']
+    assert result.url == 'http://0'
+    assert result.commands == module.commands
+
+
+@pytest.mark.asyncio
+async def test_get_module_without_endpoints(
+        storage: Storage,
+        module: Module,
+) -> None:
+    storage.redis.evalsha.return_value = [_result(module)]
+    assert await storage.get_module(module.name) is None
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_add_or_replace_module_publishes_changes(
+        storage: Storage,
+        module: Module,
+) -> None:
+    storage.redis.evalsha.return_value = [_raw_module(module), 0]
+    storage._cache[module.name] = (float('inf'), module)
+
+    await storage.add_or_replace_module(module)
+    storage.redis.publish.assert_not_awaited()
+    assert module.name in storage._cache
+
+    changed = Module(**{**jsonable_encoder(module), 'description': 'new'})
+    await storage.add_or_replace_module(changed)
+    storage.redis.publish.assert_awaited_once_with(
+        INVALIDATION_CHANNEL,
+        module.name,
+    )
+    assert module.name not in storage._cache
+
+
+@pytest.mark.asyncio
+async def test_add_or_replace_module_publishes_new_endpoints(
+        storage: Storage,
+        module: Module,
+) -> None:
+    storage.redis.evalsha.return_value = [_raw_module(module), 1]
+
+    await storage.add_or_replace_module(module)
+    storage.redis.publish.assert_awaited_once_with(
+        INVALIDATION_CHANNEL,
+        module.name,
+    )
+
+
+@pytest.mark.parametrize('result, refreshed, published', [
+    (0, False, False),
+    (1, True, False),
+    (2, True, True),
+])
+@pytest.mark.asyncio
+async def test_refresh_module(
+        storage: Storage,
+        result: int,
+        refreshed: bool,
+        published: bool,
+) -> None:
+    storage.redis.evalsha.return_value = result
+
+    assert await storage.refresh_module('help', 'hash', 'http://0') is refreshed
+    assert storage.redis.publish.called is published
+
+
+@pytest.mark.asyncio
+async def test_get_all_modules(storage: Storage, module: Module) -> None:
+    storage.redis.evalsha.return_value = [
+        _result(module, time() + 30),
+        _result(Module(**{**jsonable_encoder(module), 'name': 'gone'})),
+    ]
+
+    modules = await storage.get_all_modules()
+    assert list(modules) == [module.name]
+    storage.redis.evalsha.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_get_modules_by_actions(
+        storage: Storage,
+        module: Module,
+) -> None:
+    storage.redis.evalsha.return_value = [
+        _result(module, time() + 30),
+        None,
+    ]
+
+    modules = await storage.get_modules_by_actions(
+        ['block_actions:a', 'block_actions:missing']
+    )
+    assert list(modules) == ['block_actions:a']
+    assert modules['block_actions:a'].name == module.name
+    storage.redis.evalsha.assert_awaited_once()
+
+
+# noinspection PyProtectedMember
+@pytest.mark.asyncio
+async def test_get_modules_by_actions_cached(
+        storage: Storage,
+        module: Module,
+) -> None:
+    evalsha = storage.redis.evalsha
+    evalsha.return_value = [_result(module, time() + 30)]
+    storage._subscribed = True
+
+    modules = await storage.get_modules_by_actions(['block_actions:a'])
+    assert modules['block_actions:a'].name == module.name
+    modules = await storage.get_modules_by_actions(['block_actions:a'])
+    assert modules['block_actions:a'].name == module.name
+    evalsha.assert_awaited_once()
+
+    evalsha.return_value = [_result(module, time() + 30), None]
+    await storage.get_modules_by_actions(
+        ['block_actions:a', 'block_actions:missing'],
+    )
+    assert evalsha.await_count == 2
+
+    # Any module may have taken over the action
+    storage._invalidate('other')
+    await storage.get_modules_by_actions(['block_actions:a'])
+    assert evalsha.await_count == 3
+
+
+def _module(module: Module, **fields: Any) -> Module:
+    return Module(**{**jsonable_encoder(module), **fields})
+
+
+@pytest.mark.asyncio
+async def test_registry_register_module(
+        redis_storage: Storage,
+        module: Module,
+) -> None:
+    module = _module(module, actions=['block_actions:a'])
+    await redis_storage.add_or_replace_module(module)
+    await redis_storage.add_or_replace_module(
+        _module(module, url='http://help-module-2:8000')
+    )
+
+    result = await redis_storage.get_module(module.name)
+    assert result.endpoints == [
+        'http://help-module-2:8000',
+        'http://help-module:8000',
+    ]
+    assert result.commands == module.commands
+    assert await redis_storage.get_module('missing') is None
+    assert list(await redis_storage.get_all_modules()) == [module.name]
+    assert await redis_storage.get_module_names() == [module.name]
+
+    modules = await redis_storage.get_modules_by_actions(
+        ['block_actions:a', 'block_actions:missing']
+    )
+    assert list(modules) == ['block_actions:a']
+    assert modules['block_actions:a'].name == module.name
+
+
+@pytest.mark.asyncio
+async def test_registry_replaces_actions(
+        redis_storage: Storage,
+        module: Module,
+) -> None:
+    await redis_storage.add_or_replace_module(
+        _module(module, actions=['block_actions:a', 'block_actions:b'])
+    )
+    await redis_storage.add_or_replace_module(
+        _module(module, actions=['block_actions:b'])
+    )
+    await redis_storage.add_or_replace_module(
+        _module(module, name='other', actions=['block_actions:b'])
+    )
+
+    modules = await redis_storage.get_modules_by_actions(
+        ['block_actions:a', 'block_actions:b']
+    )
+    assert list(modules) == ['block_actions:b']
+    assert modules['block_actions:b'].name == 'other'
+
+
+@pytest.mark.asyncio
+async def test_registry_refresh_module(
+        redis_storage: Storage,
+        module: Module,
+) -> None:
+    await redis_storage.add_or_replace_module(module, 'hash')
+    url = str(module.url)
+
+    refresh = redis_storage.refresh_module
+    assert await refresh(module.name, 'other', url) is False
+    assert await refresh(module.name, 'hash', url) is True
+    assert await refresh(module.name, 'hash', 'http://help-2:8000') is True
+    assert len((await redis_storage.get_module(module.name)).endpoints) == 2
+    assert await refresh('missing', 'hash', url) is False
+
+
+@pytest.mark.asyncio
+async def test_registry_prunes_expired_modules(
+        redis_storage: Storage,
+        module: Module,
+        monkeypatch,
+) -> None:
+    now = time()
+    monkeypatch.setattr(storage_module, 'time', lambda: now)
+    await redis_storage.add_or_replace_module(
+        _module(module, actions=['block_actions:a'])
+    )
+    await redis_storage.add_or_replace_module(_module(module, name='other'))
+
+    # Only the other module sends heartbeats
+    now += MODULE_EXPIRATION_SECONDS + 1
+    assert await redis_storage.get_module(module.name) is None
+    await redis_storage.add_or_replace_module(_module(module, name='other'))
+
+    redis = redis_storage.redis
+    assert await redis.hkeys(MODULES_KEY, encoding='utf-8') == ['other']
+    assert await redis.hkeys(HASHES_KEY, encoding='utf-8') == ['other']
+    assert await redis.hlen(ACTIONS_KEY) == 0
+    assert not await redis.exists(ENDPOINTS_KEY_PREFIX + module.name)
+    assert list(await redis_storage.get_all_modules()) == ['other']
@@ -0,0 +1,96 @@
+import json
+
+import pytest
+from requests import Session
+
+from metabot.lib import tracing
+from metabot.lib.tracing import (
+    SpanExporter,
+    start_span,
+    parse_traceparent,
+    inject_headers,
+    SERVER,
+    STATUS_ERROR,
+)
+
+TRACE_ID = '0af7651916cd43dd8448eb211c80319c'
+PARENT_ID = 'b7ad6b7169203331'
+TRACEPARENT = f'00-{TRACE_ID}-{PARENT_ID}-01'
+
+
+@pytest.fixture
+def exporter(tmp_path, monkeypatch) -> SpanExporter:
+    span_exporter = SpanExporter(file_path=str(tmp_path / 'traces.json'))
+    monkeypatch.setattr(tracing, 'exporter', span_exporter)
+    return span_exporter
+
+
+def test_parse_traceparent() -> None:
+    assert parse_traceparent(TRACEPARENT) == (TRACE_ID, PARENT_ID)
+    assert parse_traceparent(None) is None
+    assert parse_traceparent('00-123-456-01') is None
+    assert parse_traceparent(f'ff-{TRACE_ID}-{PARENT_ID}-01') is None
+    assert parse_traceparent(f'00-{"0" * 32}-{PARENT_ID}-01') is None
+
+
+def test_start_span(exporter: SpanExporter) -> None:
+    assert inject_headers() == {}
+
+    with start_span('request', SERVER, TRACEPARENT) as parent:
+        with start_span('dispatch') as child:
+            assert inject_headers() == {'traceparent': child.traceparent}
+        with pytest.raises(ValueError):
+            with start_span('failure') as failure:
+                raise ValueError
+
+    assert (parent.trace_id, parent.parent_span_id) == (TRACE_ID, PARENT_ID)
+    assert child.trace_id == TRACE_ID
+    assert child.parent_span_id == parent.span_id
+    assert failure.status == STATUS_ERROR
+    assert [span.name for span in exporter._spans] == [  # noqa
+        'dispatch',
+        'failure',
+        'request',
+    ]
+
+    with start_span('new') as new:
+        assert new.trace_id != TRACE_ID
+        assert new.parent_span_id == ''
+
+
+@pytest.mark.asyncio
+async def test_span_exporter_file(exporter: SpanExporter) -> None:
+    attributes = {'http.status_code': 200}
+    with start_span('request', SERVER, TRACEPARENT, **attributes):
+        pass
+    await exporter.flush()
+
+    with open(exporter.file_path) as file:
+        lines = file.readlines()
+    assert len(lines) == 1
+    resource_spans = json.loads(lines[0])['resourceSpans'][0]
+    span = resource_spans['scopeSpans'][0]['spans'][0]
+    assert span['traceId'] == TRACE_ID
+    assert span['parentSpanId'] == PARENT_ID
+    assert span['kind'] == SERVER
+    assert span['attributes'] == [
+        {'key': 'http.status_code', 'value': {'intValue': '200'}},
+    ]
+    assert int(span['endTimeUnixNano']) >= int(span['startTimeUnixNano'])
+
+
+def test_tracing_middleware(
+        test_client: Session,
+        exporter: SpanExporter,
+) -> None:
+    resp = test_client.get(
+        '/api/slack/queues',
+        headers={'traceparent': TRACEPARENT},
+    )
+    assert resp.status_code == 200
+    test_client.get('/metrics')
+
+    span, = exporter._spans  # noqa
+    assert span.name == 'GET /api/slack/queues'
+    assert (span.trace_id, span.parent_span_id) == (TRACE_ID, PARENT_ID)
+    assert span.attributes['http.status_code'] == 200